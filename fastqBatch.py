@@ -0,0 +1,186 @@
+#
+# fastqBatch.py
+# Author: Philip Braunstein
+#
+# Date Created: May 27, 2014
+# Last Modified: May 27, 2014
+#
+# Functions fastqKnowledge uses to answer a list of queries about a FASTQ
+# file without prompting for them, and to write the answers out in a
+# machine-readable format:
+#
+#   json   - one JSON object per line for each file, with the file name
+#            and an entry for each query that was run
+#   tsv    - one line per answer with the columns file, query, key and
+#            value. Random reads have the ID as the key, the nucleotides
+#            as the value and the strand, quality scores and average
+#            quality score in three more columns. Overrepresented
+#            sequences have a line each with the sequence, count,
+#            percent and whether they were counted exactly, and the
+#            files of a sample one each with the file name and its
+#            statistics.
+#
+# Estimated answers, see runEstimates, have the value of each estimate
+# and the low and high ends of its confidence interval, as an object in
+# JSON and in three columns in TSV.
+#
+
+import json
+from collections import OrderedDict
+
+import fastqEstimate
+
+JSON = "json"
+TSV = "tsv"
+FORMATS = [JSON, TSV]
+
+TSV_HEADER = "#file\tquery\tkey\tvalue"
+
+
+# Runs the queries against a FastqReporter and returns the answers in an
+# OrderedDict keyed by query. Queries that weren't asked for are left
+# out. All of the patterns are searched for in one pass over the reads.
+# prefixLength and exact apply to duplication and numOverrepresented,
+# and exact to spectrumK too, see FastqKeeper.getNumDistinctSeqs.
+#
+# For a sample of several files, stats adds the statistics of each file
+# under "files".
+def runQueries(reporter, stats=False, patterns=None, cutoffs=None, \
+                numRandom=None, seed=None, duplication=False, \
+                numOverrepresented=None, spectrumK=None, prefixLength=None, \
+                exact=None):
+        results = OrderedDict()
+
+        if stats:
+                results["stats"] = reporter.getSummary()
+                if len(reporter.getFiles()) > 1:
+                        results["files"] = reporter.getFileSummaries()
+
+        if patterns:
+                counts = reporter.getNumMatchesMany(patterns)
+                results["matches"] = OrderedDict(zip(patterns, counts))
+
+        if cutoffs:
+                results["qual"] = OrderedDict()
+                for cutoff in cutoffs:
+                        results["qual"][cutoff] = \
+                                        reporter.getNumQualSeqs(cutoff)
+
+        if numRandom != None:
+                results["random"] = [readToDict(reporter, read) for read in \
+                                reporter.getRandomSeqs(numRandom, seed)]
+
+        if duplication:
+                distinct = reporter.getNumDistinctSeqs(prefixLength, exact)
+                results["duplication"] = OrderedDict()
+                results["duplication"]["distinct"] = distinct
+                results["duplication"]["duplicationRate"] = \
+                                reporter.getDuplicationRate(prefixLength, exact)
+                results["duplication"]["exact"] = reporter.useExact(exact)
+
+        if numOverrepresented != None:
+                results["overrepresented"] = []
+                for seq, count, percent in reporter.getOverrepresentedSeqs( \
+                                numOverrepresented, prefixLength, exact):
+                        fields = OrderedDict()
+                        fields["seq"] = seq
+                        fields["count"] = count
+                        fields["percent"] = percent
+                        fields["exact"] = reporter.useExact(exact)
+                        results["overrepresented"].append(fields)
+
+        if spectrumK != None:
+                results["kmerSpectrum"] = OrderedDict()
+                results["kmerSpectrum"]["k"] = spectrumK
+                results["kmerSpectrum"]["exact"] = reporter.useExact(exact)
+                for count, kmers in reporter.getKmerSpectrum(spectrumK, exact):
+                        results["kmerSpectrum"][str(count)] = kmers
+
+        return results
+
+
+# Estimates the answers to the queries with a FastqEstimator and returns
+# them as runQueries does, under "estimate" and the name of each query.
+# The queries are the ones that can be estimated, and patterns and cutoffs
+# are answered in percent of reads rather than numbers of reads.
+def runEstimates(estimator, stats=False, patterns=None, cutoffs=None):
+        results = OrderedDict()
+        estimates = OrderedDict()
+
+        if stats:
+                estimates["stats"] = estimator.getSummary()
+
+        if patterns:
+                estimates["matchPercent"] = OrderedDict()
+                for pattern in patterns:
+                        estimates["matchPercent"][pattern] = \
+                                        estimator.getMatchPercent(pattern)
+
+        if cutoffs:
+                estimates["qualPercent"] = OrderedDict()
+                for cutoff in cutoffs:
+                        estimates["qualPercent"][cutoff] = \
+                                        estimator.getQualPercent(cutoff)
+
+        results["estimate"] = OrderedDict()
+        results["estimate"]["samples"] = estimator.getNumSamples()
+        results["estimate"]["confidence"] = fastqEstimate.CONFIDENCE
+        results["estimate"]["targetError"] = estimator.targetError
+        for query, answers in estimates.items():
+                results[query] = OrderedDict()
+                for key, estimate in answers.items():
+                        results[query][key] = estimate.toDict()
+
+        return results
+
+
+# Returns a read as an OrderedDict of its fields
+def readToDict(reporter, read):
+        fields = OrderedDict()
+        fields["id"] = read[reporter.ID_INDEX]
+        fields["seq"] = read[reporter.SEQ_INDEX]
+        fields["strand"] = read[reporter.STRAND_INDEX]
+        fields["qual"] = read[reporter.QSCORE_INDEX]
+        fields["avgQScore"] = read[reporter.AVG_QSCORE_INDEX]
+
+        return fields
+
+
+# Returns the answers for inputFile as a string in fileFormat, without a
+# trailing newline
+def formatResults(inputFile, results, fileFormat):
+        if fileFormat == JSON:
+                return formatJson(inputFile, results)
+
+        return formatTsv(inputFile, results)
+
+
+# Returns the answers for inputFile as one line of JSON
+def formatJson(inputFile, results):
+        record = OrderedDict()
+        record["file"] = inputFile
+        record.update(results)
+
+        return json.dumps(record)
+
+
+# Returns the answers for inputFile as lines of tab separated values
+def formatTsv(inputFile, results):
+        rows = []
+
+        for query, answers in results.items():
+                if isinstance(answers, list):
+                        for answer in answers:
+                                rows.append([inputFile, query] + \
+                                                answer.values())
+                else:
+                        for key, value in answers.items():
+                                if isinstance(value, dict):
+                                        rows.append([inputFile, query, key] + \
+                                                        value.values())
+                                else:
+                                        rows.append([inputFile, query, key, \
+                                                        value])
+
+        return "\n".join(["\t".join([str(field) for field in row]) \
+                        for row in rows])
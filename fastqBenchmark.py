@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+
+#
+# fastqBenchmark.py
+# Author: Philip Braunstein
+#
+# Date Created: May 29, 2014
+# Last Modified: May 29, 2014
+#
+# Benchmarks FastqReporter on a synthetic FASTQ file, or on a file passed
+# in with --input, and writes the results out as JSON so that versions
+# and engines can be compared on the same input.
+#
+# The synthetic file is the same for the same options and --seed. Read
+# lengths are uniform between the two ends of --length, each nucleotide
+# is N with probability --n-rate, quality scores fall in a straight line
+# from the first to the second Phred score of --quality plus uniform noise
+# of up to --quality-noise, and each read is + with probability
+# --plus-rate.
+#
+# Each engine (a way of reading the file in) is run in its own process so
+# that its peak RSS is its own. For each one the records fastqMonitor
+# keeps of every loading phase that ran, and the time of each
+# getNumMatches and getNumQualSeqs query and of the whole load, are saved.
+#
+
+import json
+import math
+import os
+import platform
+import random
+import string
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from collections import OrderedDict
+from multiprocessing import Process
+from multiprocessing import Queue
+
+from fastqMonitor import Monitor
+from fastqMonitor import peakRss
+from fastqReporter import FastqReporter
+
+# CONSTANTS
+# Keyword arguments to FastqReporter for each engine. The parallel engine
+# also gets the number of workers.
+ENGINES = OrderedDict([
+        ("classic", {}),
+        ("streaming", {"streaming": True}),
+        ("readahead", {"streaming": True, "readahead": 1 << 22}),
+        ("columnar", {"columnar": True}),
+        ("packed", {"columnar": "packed"}),
+        ("low-memory", {"keepReads": False}),
+        ("mapped", {"mapped": True}),
+        ("parallel", {}),
+])
+
+DEFAULT_PATTERNS = ["ACGT", "GATTACA", "AGATCGGAAGAGC", "NNACGTNN"]
+DEFAULT_CUTOFFS = ["5", "?"]
+
+# Phred scores are written with an offset of 33, and kept in this range
+MIN_PHRED = 2
+MAX_PHRED = 41
+
+# Maps a hex digit to a nucleotide, each nucleotide gets four digits
+HEX_TO_NUCS = string.maketrans("0123456789abcdef", "ACGT" * 4)
+
+
+def main():
+        args = checkArgs()
+
+        inputFile = args.input
+        if inputFile == None:
+                inputFile = args.keep
+                if inputFile == None:
+                        (handle, inputFile) = tempfile.mkstemp(suffix=".fastq")
+                        os.close(handle)
+
+                log("Generating", args.reads, "reads into", inputFile)
+                generateFastq(inputFile, args.reads, args.minLength, \
+                                args.maxLength, args.nRate, args.qualStart, \
+                                args.qualEnd, args.qualNoise, args.plusRate, \
+                                args.seed)
+
+        try:
+                results = benchmark(inputFile, args)
+        finally:
+                if args.input == None and args.keep == None:
+                        os.remove(inputFile)
+
+        if args.output == None:
+                print json.dumps(results, indent=2)
+        else:
+                with open(args.output, 'w') as filew:
+                        json.dump(results, filew, indent=2)
+                        filew.write("\n")
+
+
+# Checks the arguments passed to the program and returns them
+def checkArgs():
+        parser = ArgumentParser(description="Benchmarks FastqReporter " + \
+                        "and prints the results as JSON.")
+        parser.add_argument("--input", help="benchmark this FASTQ file " + \
+                        "instead of a synthetic one")
+        parser.add_argument("--keep", metavar="FILE", help="write the " + \
+                        "synthetic file to FILE and keep it")
+        parser.add_argument("--reads", type=int, default=100000)
+        parser.add_argument("--length", default="100", \
+                        help="read length, or MIN-MAX (default 100)")
+        parser.add_argument("--n-rate", dest="nRate", type=float, \
+                        default=0.01)
+        parser.add_argument("--quality", default="38-20", help="Phred " + \
+                        "score at the first and last base (default 38-20)")
+        parser.add_argument("--quality-noise", dest="qualNoise", type=int, \
+                        default=4)
+        parser.add_argument("--plus-rate", dest="plusRate", type=float, \
+                        default=0.5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--engines", default=",".join(ENGINES.keys()), \
+                        help="comma separated engines to run (default all)")
+        parser.add_argument("-w", "--workers", type=int, default=4, \
+                        help="workers for the parallel engine")
+        parser.add_argument("--match", dest="patterns", nargs="+", \
+                        default=DEFAULT_PATTERNS)
+        parser.add_argument("--qual", dest="cutoffs", nargs="+", \
+                        default=DEFAULT_CUTOFFS)
+        parser.add_argument("-o", "--output", help="write the JSON here " + \
+                        "instead of to stdout")
+        args = parser.parse_args()
+
+        try:
+                (args.minLength, args.maxLength) = parseRange(args.length)
+                (args.qualStart, args.qualEnd) = parseRange(args.quality)
+        except ValueError:
+                parser.error("--length and --quality take N or N-M")
+
+        args.engines = args.engines.split(",")
+        for engine in args.engines:
+                if engine not in ENGINES:
+                        parser.error("Unknown engine \"" + engine + "\"")
+
+        if args.minLength < 1 or args.maxLength < args.minLength:
+                parser.error("Bad read length " + args.length)
+        if args.nRate < 0 or args.nRate > 1:
+                parser.error("--n-rate must be between 0 and 1")
+        if args.plusRate < 0 or args.plusRate > 1:
+                parser.error("--plus-rate must be between 0 and 1")
+        if args.reads < 1:
+                parser.error("--reads must be at least 1")
+        if args.input != None and not os.path.exists(args.input):
+                parser.error("Can't find file \"" + args.input + "\"")
+
+        return args
+
+
+# Returns the two numbers in a string of the form "N" or "N-M"
+def parseRange(text):
+        parts = text.split("-")
+        if len(parts) == 1:
+                return (int(parts[0]), int(parts[0]))
+        if len(parts) == 2:
+                return (int(parts[0]), int(parts[1]))
+
+        raise ValueError(text)
+
+
+# Writes numReads synthetic reads to outputFile, see the top of this file.
+# The same arguments always write the same file.
+def generateFastq(outputFile, numReads, minLength, maxLength, nRate, \
+                qualStart, qualEnd, qualNoise, plusRate, seed):
+        rand = random.Random(seed)
+
+        # Noise is taken from a random place in a pool rather than drawn
+        # for every base
+        noise = [rand.randint(-qualNoise, qualNoise) \
+                        for i in range(maxLength + 4096)]
+        profiles = {}
+
+        with open(outputFile, 'w') as filew:
+                for readNum in xrange(numReads):
+                        length = rand.randint(minLength, maxLength)
+
+                        nucs = "%0*x" % (length, rand.getrandbits(4 * length))
+                        nucs = list(nucs.translate(HEX_TO_NUCS))
+                        for i in nPositions(rand, length, nRate):
+                                nucs[i] = 'N'
+
+                        if length not in profiles:
+                                profiles[length] = qualityProfile(length, \
+                                                qualStart, qualEnd)
+                        start = rand.randrange(len(noise) - length)
+                        qual = [chr(33 + min(max(phred + noise[start + i], \
+                                MIN_PHRED), MAX_PHRED)) for i, phred in \
+                                enumerate(profiles[length])]
+
+                        if rand.random() < plusRate:
+                                strand = "+"
+                        else:
+                                strand = "-"
+
+                        filew.write("@SYNTH" + str(readNum + 1) + "/1\n")
+                        filew.write("".join(nucs) + "\n")
+                        filew.write(strand + "\n")
+                        filew.write("".join(qual) + "\n")
+
+
+# Yields the positions in a read of length that are N, each position
+# with probability nRate. The gaps between them are drawn directly so
+# the reads don't need a random number per base.
+def nPositions(rand, length, nRate):
+        if nRate <= 0:
+                return
+        if nRate >= 1:
+                for i in xrange(length):
+                        yield i
+                return
+
+        i = -1
+        while True:
+                i += 1 + int(math.log(1.0 - rand.random()) / \
+                                math.log(1.0 - nRate))
+                if i >= length:
+                        return
+                yield i
+
+
+# Returns the Phred score of each base of a read of length, falling in a
+# straight line from qualStart to qualEnd
+def qualityProfile(length, qualStart, qualEnd):
+        if length == 1:
+                return [qualStart]
+
+        step = (qualEnd - qualStart) / float(length - 1)
+        return [int(round(qualStart + step * i)) for i in range(length)]
+
+
+# Runs each engine in args.engines on inputFile in its own process and
+# returns all of the results
+def benchmark(inputFile, args):
+        results = OrderedDict()
+        results["python"] = platform.python_version()
+        results["platform"] = platform.platform()
+
+        source = OrderedDict()
+        source["file"] = inputFile
+        source["bytes"] = os.path.getsize(inputFile)
+        if args.input == None:
+                source["reads"] = args.reads
+                source["length"] = [args.minLength, args.maxLength]
+                source["nRate"] = args.nRate
+                source["quality"] = [args.qualStart, args.qualEnd]
+                source["qualityNoise"] = args.qualNoise
+                source["plusRate"] = args.plusRate
+                source["seed"] = args.seed
+        results["input"] = source
+
+        results["engines"] = OrderedDict()
+        for engine in args.engines:
+                log("Running engine", engine)
+                kwargs = dict(ENGINES[engine])
+                if engine == "parallel":
+                        kwargs["workers"] = args.workers
+
+                queue = Queue()
+                process = Process(target=runEngine, args=(queue, inputFile, \
+                                kwargs, args.patterns, args.cutoffs))
+                process.start()
+                result = queue.get()
+                process.join()
+
+                if "error" in result:
+                        raise Exception("Engine " + engine + " failed: " + \
+                                        result["error"])
+                results["engines"][engine] = result
+
+        return results
+
+
+# Reads inputFile in with FastqReporter and kwargs, runs the queries and
+# puts the timings on queue. Runs in its own process.
+def runEngine(queue, inputFile, kwargs, patterns, cutoffs):
+        result = OrderedDict()
+        kwargs["cache"] = False
+
+        try:
+                monitor = Monitor()
+                start = time.time()
+                reporter = FastqReporter(inputFile, monitor=monitor, **kwargs)
+
+                # Statistics the classic engine leaves until they are used
+                # are worked out here, each timed as its own phase, so
+                # every engine's load and queries cover the same work
+                reporter.computeStats()
+                result["load"] = time.time() - start
+
+                result["phases"] = OrderedDict()
+                for phase in monitor.getRecords():
+                        fields = phase.toDict()
+                        del fields["phase"]
+                        del fields["fraction"]
+                        result["phases"][phase.name] = fields
+
+                result["queries"] = OrderedDict()
+                for pattern in patterns:
+                        start = time.time()
+                        reporter.getNumMatches(pattern)
+                        result["queries"]["getNumMatches " + pattern] = \
+                                        time.time() - start
+                for cutoff in cutoffs:
+                        start = time.time()
+                        reporter.getNumQualSeqs(cutoff)
+                        result["queries"]["getNumQualSeqs " + cutoff] = \
+                                        time.time() - start
+
+                result["numReads"] = reporter.getNumReads()
+                result["peakRss"] = peakRss()
+        except Exception as e:
+                result = {"error": str(e)}
+
+        queue.put(result)
+
+
+# Prints a progress message to stderr
+def log(*words):
+        sys.stderr.write(" ".join([str(word) for word in words]) + "\n")
+
+
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,247 @@
+#
+# fastqCache.py
+# Author: Philip Braunstein
+#
+# Date Created: May 23, 2014
+# Last Modified: May 23, 2014
+#
+# Functions to save what FastqKeeper works out about a FASTQ file to a
+# cache file, so the next time the same file is opened it does not have
+# to be read in again. By default the cache is a sidecar file next to the
+# FASTQ file with ".fqk" added to its name.
+#
+# A cache file is laid out as:
+#
+#   MAGIC, then the header length and its crc32 as little-endian uint32s
+#   a JSON header with the key of the FASTQ file and its FastqStats
+#   padding up to a multiple of 8 bytes
+#   the byte offset each read starts at, little-endian uint64s
+#   the average quality score of each read, little-endian doubles
+#
+# The key is the path, size and modification time of the FASTQ file plus
+# a sha1 of its first HASH_BYTES. A cache whose key doesn't match, or that
+# is corrupt, is ignored and rebuilt. The two columns are memory-mapped
+# rather than read in when a cache is loaded.
+#
+# A FASTQ file that is still being written can be cached up to the end of
+# its last complete read. The header then also has that offset and a
+# sha1 of the HASH_BYTES before it. If the file has only grown since,
+# load(grown=True) returns the cache anyway so that just the reads after
+# the offset need to be read in.
+#
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import islice
+
+from fastqStats import FastqStats
+from fastqRecordIndex import FastqRecordIndex
+
+MAGIC = "FQKCACHE"
+VERSION = 4
+EXTENSION = ".fqk"
+
+# Number of bytes at the start of the FASTQ file that are hashed
+HASH_BYTES = 1 << 20
+
+PREAMBLE = struct.Struct("<8sIII")
+OFFSET = struct.Struct("<Q")
+QSCORE = struct.Struct("<d")
+
+
+# Returns the path of the cache file for inputFile. Caches kept in a
+# separate cacheDir get a hash of the full path in their name so files
+# with the same name in different directories don't collide.
+def cachePath(inputFile, cacheDir=None):
+        if cacheDir == None:
+                return inputFile + EXTENSION
+
+        fullPath = os.path.abspath(inputFile)
+        name = os.path.basename(inputFile) + "." + \
+                        hashlib.sha1(fullPath).hexdigest()[:12] + EXTENSION
+
+        return os.path.join(cacheDir, name)
+
+
+# Returns the key that identifies the current contents of inputFile
+def fileKey(inputFile):
+        info = os.stat(inputFile)
+        with open(inputFile, 'rb') as filer:
+                digest = hashlib.sha1(filer.read(HASH_BYTES)).hexdigest()
+
+        return {"path": os.path.abspath(inputFile), "size": info.st_size,
+                "mtime": info.st_mtime, "hash": digest}
+
+
+# Returns the key that identifies the first end bytes of inputFile,
+# which must be at least that long
+def prefixKey(inputFile, end):
+        with open(inputFile, 'rb') as filer:
+                filer.seek(max(end - HASH_BYTES, 0))
+                digest = hashlib.sha1(filer.read(min(end, HASH_BYTES))) \
+                                .hexdigest()
+
+        return {"end": end, "hash": digest}
+
+
+# Writes stats and recordIndex for inputFile to its cache file. The cache
+# is written to a temporary file first so a half written cache is never
+# left behind. Returns False if the cache could not be written.
+#
+# end is the offset just past the last read in stats when inputFile is
+# still being written, see the top of this file.
+def save(inputFile, stats, recordIndex, cacheDir=None, end=None):
+        path = cachePath(inputFile, cacheDir)
+        tempPath = path + ".tmp"
+
+        fields = {"key": fileKey(inputFile), "stats": stats.__dict__,
+                "numReads": len(recordIndex)}
+        if end != None:
+                fields["prefix"] = prefixKey(inputFile, end)
+        header = json.dumps(fields)
+
+        try:
+                with open(tempPath, 'wb') as filew:
+                        filew.write(PREAMBLE.pack(MAGIC, VERSION, len(header),
+                                zlib.crc32(header) & 0xffffffff))
+                        filew.write(header)
+                        filew.write("\0" * padding(PREAMBLE.size + len(header)))
+
+                        writeColumn(filew, OFFSET, recordIndex.offsets)
+                        writeColumn(filew, QSCORE, recordIndex.means)
+
+                os.rename(tempPath, path)
+        except (IOError, OSError):
+                if os.path.exists(tempPath):
+                        os.remove(tempPath)
+                return False
+
+        return True
+
+
+# Loads the cache for inputFile. Returns a tuple of (FastqStats,
+# FastqRecordIndex, end) or None if there is no cache or it is out of date
+# or corrupt. end is None unless it was saved, see save.
+#
+# With grown=True a cache of an earlier, shorter version of inputFile
+# is returned too, as long as the file is the same up to end.
+def load(inputFile, cacheDir=None, grown=False):
+        path = cachePath(inputFile, cacheDir)
+        if not os.path.exists(path):
+                return None
+
+        try:
+                with open(path, 'rb') as filer:
+                        cache = mmap.mmap(filer.fileno(), 0, \
+                                        access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+                return None
+
+        try:
+                return parse(inputFile, cache, grown)
+        except (ValueError, KeyError, TypeError, struct.error):
+                return None
+
+
+# Parses a memory-mapped cache, see load
+def parse(inputFile, cache, grown=False):
+        (magic, version, length, crc) = PREAMBLE.unpack_from(cache, 0)
+        if magic != MAGIC or version != VERSION:
+                return None
+
+        header = cache[PREAMBLE.size:PREAMBLE.size + length]
+        if zlib.crc32(header) & 0xffffffff != crc:
+                return None
+
+        header = json.loads(header)
+        end = None
+        if "prefix" in header:
+                end = header["prefix"]["end"]
+
+        if header["key"] != fileKey(inputFile) and not (grown and \
+                end != None and os.path.getsize(inputFile) >= end and \
+                header["prefix"] == prefixKey(inputFile, end)):
+                return None
+
+        numReads = header["numReads"]
+        start = PREAMBLE.size + length
+        start += padding(start)
+        meansStart = start + numReads * OFFSET.size
+
+        # Truncated or padded cache file
+        if len(cache) != meansStart + numReads * QSCORE.size:
+                return None
+
+        stats = FastqStats()
+        for name, value in header["stats"].items():
+                setattr(stats, str(name), value)
+
+        recordIndex = FastqRecordIndex(
+                MappedColumn(cache, start, numReads, OFFSET),
+                MappedColumn(cache, meansStart, numReads, QSCORE))
+
+        return (stats, recordIndex, end)
+
+
+# Returns the number of bytes needed to pad length to a multiple of 8
+def padding(length):
+        return -length % 8
+
+
+# Writes the values in column to filew in format. Arrays that already
+# match format are written out whole.
+def writeColumn(filew, format, column):
+        if isinstance(column, array) and column.itemsize == format.size \
+                and sys.byteorder == "little":
+                filew.write(column.tostring())
+                return
+
+        values = iter(column)
+        while True:
+                chunk = list(islice(values, 4096))
+                if len(chunk) == 0:
+                        break
+
+                filew.write(struct.pack("<" + format.format[1:] * len(chunk), \
+                                *chunk))
+
+
+# A read-only column of numbers stored in a memory-mapped file. It can be
+# indexed and iterated over like the array it replaces.
+class MappedColumn:
+        def __init__(self, cache, start, length, format):
+                self.cache = cache
+                self.start = start
+                self.length = length
+                self.format = format
+
+
+        def __len__(self):
+                return self.length
+
+
+        def __getitem__(self, i):
+                if i < 0:
+                        i += self.length
+                if i < 0 or i >= self.length:
+                        raise IndexError("MappedColumn index out of range")
+
+                return self.format.unpack_from(self.cache, \
+                                self.start + i * self.format.size)[0]
+
+
+        # Unpacks values a block at a time rather than one by one
+        def __iter__(self):
+                for first in xrange(0, self.length, 4096):
+                        count = min(4096, self.length - first)
+                        values = struct.unpack_from("<" + \
+                                self.format.format[1:] * count, self.cache, \
+                                self.start + first * self.format.size)
+                        for value in values:
+                                yield value
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+#
+# fastqClient.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 4, 2014
+# Last Modified: Jun 4, 2014
+#
+# Sends queries about a FASTQ file to a server started with
+# fastqKnowledge.py --serve ADDRESS and prints the answer as a line of
+# JSON, the same as fastqKnowledge.py would print it, or with
+# --format tsv. --status prints the files the server has read in instead.
+# See fastqServer.
+#
+
+import json
+import os
+from argparse import ArgumentParser
+from collections import OrderedDict
+from sys import argv
+from sys import exit
+
+import fastqBatch
+import fastqServer
+
+
+def main():
+        args = checkArgs()
+
+        if args.status:
+                request = {"command": fastqServer.STATUS}
+        else:
+                request = OrderedDict([("file", os.path.abspath(args.fastq))])
+                for key in fastqServer.QUERY_KEYS:
+                        value = getattr(args, key)
+                        if value not in [None, False]:
+                                request[key] = value
+
+        try:
+                reply = fastqServer.query(args.address, request)
+        except (IOError, OSError) as e:
+                print "Can't reach server at", args.address + ":", e
+                exit(1)
+
+        if "error" in reply:
+                print reply["error"]
+                exit(1)
+
+        if args.format == fastqBatch.TSV and not args.status:
+                inputFile = reply.pop("file")
+                print fastqBatch.TSV_HEADER
+                print fastqBatch.formatResults(inputFile, reply, args.format)
+        else:
+                print json.dumps(reply)
+
+
+# Checks to make sure appropriate arguments are passed to program
+# and returns them
+def checkArgs():
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("address")
+        parser.add_argument("fastq", nargs="?")
+        parser.add_argument("--status", action="store_true")
+        parser.add_argument("--stats", action="store_true")
+        parser.add_argument("--match", dest="patterns", action="append")
+        parser.add_argument("--qual", dest="cutoffs", action="append")
+        parser.add_argument("--random", dest="numRandom", type=int)
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--duplication", action="store_true")
+        parser.add_argument("--overrepresented", dest="numOverrepresented", \
+                        type=int)
+        parser.add_argument("--kmer-spectrum", dest="spectrumK", type=int)
+        parser.add_argument("--dup-prefix", dest="prefixLength", type=int)
+        parser.add_argument("--exact", action="store_const", const=True)
+        parser.add_argument("--sketch", dest="exact", action="store_const", \
+                        const=False)
+        parser.add_argument("--format", choices=fastqBatch.FORMATS, \
+                        default=fastqBatch.JSON)
+
+        args, unknown = parser.parse_known_args()
+        if unknown or (args.fastq == None and not args.status):
+                usage()
+
+        return args
+
+
+# Prints correct usage and exits non-zero
+def usage():
+        print "USAGE:", argv[0], "ADDRESS FASTQ_FILE.fastq [--stats]",
+        print "[--match PATTERN]... [--qual CUTOFF]..."
+        print "       [--random N] [--seed SEED] [--duplication]",
+        print "[--overrepresented N] [--kmer-spectrum K]"
+        print "       [--dup-prefix N] [--exact|--sketch] [--format json|tsv]"
+        print "      ", argv[0], "ADDRESS --status"
+        print "ADDRESS is the Unix socket or http://HOST:PORT the server was",
+        print "started with."
+        print "The file is read in by the server, so it must be on the same",
+        print "machine."
+        exit(1)
+
+
+
+
+if __name__ == '__main__':
+        main()
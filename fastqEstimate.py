@@ -0,0 +1,482 @@
+#
+# fastqEstimate.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 6, 2014
+# Last Modified: Jun 6, 2014
+#
+# The FastqEstimator class estimates the statistics of an uncompressed
+# FASTQ file from reads sampled at random, without reading the file in,
+# so that a large file can be looked at in seconds. FastqEstimateReporter
+# prints them, marked as estimates, the way FastqReporter prints the
+# exact statistics, and getExact reads the file in for exact answers.
+#
+# Reads are sampled by seeking to a random byte of the file and taking
+# the read that byte is part of, found with fastqParallel.syncToRecord.
+# A read is sampled in proportion to the number of bytes it takes up, so
+# long reads are sampled more often than short ones. Each sampled read is
+# weighted by one over its size in bytes to make up for it, and a
+# statistic averaged over reads is estimated as
+#
+#   sum(weight * value) / sum(weight * base)
+#
+# where base is 1, or the number of A, C, G and T for G/C content. The
+# number of reads is the size of the file times the average weight.
+#
+# Each estimate comes with a 95% confidence interval worked out from the
+# variance of the sampled values (by linearization, for the ratios
+# above). Reads are sampled FIRST_SAMPLES at first and then twice as many
+# at a time until the half-width of the interval is at most targetError
+# times the estimate, or maxSamples reads have been sampled. An estimate
+# near 0, e.g. of a pattern few reads have, is sampled up to maxSamples.
+#
+# Files that are compressed, standard input and samples of several files
+# can't be sampled at random, use FastqReporter for those.
+#
+
+import math
+import os
+import random
+from collections import OrderedDict
+
+import fastqInput
+from fastqMonitor import NullMonitor
+from fastqMotifs import ApproximateMatcher
+from fastqParallel import syncToRecord
+from fastqReporter import FastqReporter
+
+# Percent confidence of the intervals and the number of standard errors
+# either side of the estimate they span
+CONFIDENCE = 95
+Z = 1.96
+
+# Reads sampled before the estimates are first checked
+FIRST_SAMPLES = 1000
+
+# Bytes before a sampled offset that the read it is part of is looked for
+# from, doubled until the read is found. The reads between there and the
+# offset are read through, so this is about two short reads.
+SYNC_WINDOW = 512
+
+FILE_EXCEPTION = "Can't estimate \"{}\": only uncompressed FASTQ files " + \
+                "can be sampled"
+EMPTY_EXCEPTION = "Can't estimate \"{}\": the file is empty"
+RECORD_EXCEPTION = "No read found at byte {} of \"{}\""
+SAMPLES_EXCEPTION = "Number of samples must be at least 2"
+ERROR_EXCEPTION = "Target error must be greater than 0"
+NUCS_EXCEPTION = "No A, C, G or T nucleotides were sampled"
+CHAR_EXCEPTION = "Quality score chars must only be one character long"
+
+
+class Estimate:
+        # value is estimated to be between low and high with CONFIDENCE
+        # percent confidence, from samples reads
+        def __init__(self, value, low, high, samples):
+                self.value = value
+                self.low = low
+                self.high = high
+                self.samples = samples
+
+
+        # Returns the estimate as an OrderedDict of value, low and high
+        def toDict(self):
+                return OrderedDict([("value", self.value), ("low", self.low), \
+                                ("high", self.high)])
+
+
+        def __str__(self):
+                return str(self.value) + " (" + str(CONFIDENCE) + "% CI " + \
+                                str(self.low) + " to " + str(self.high) + ")"
+
+
+class FastqEstimator:
+        ################### Public API ###################
+        # Returns the estimated number of reads as an Estimate
+        def getNumReads(self):
+                estimate = self.sampleUntil(self.estimateNumReads)
+
+                return Estimate(int(round(estimate.value)), \
+                                int(math.floor(estimate.low)), \
+                                int(math.ceil(estimate.high)), \
+                                estimate.samples)
+
+
+        # Returns the estimated G/C and A/T content as a tuple of two
+        # Estimates, in percent of the A, C, G and T nucleotides
+        def getGC_AT(self):
+                gc = self.sampleUntil(self.estimateGC)
+                at = Estimate(round(100 - gc.value, 2), \
+                                round(100 - gc.high, 2), \
+                                round(100 - gc.low, 2), gc.samples)
+
+                return (gc, at)
+
+
+        # Returns the estimated average read length as an Estimate
+        def getAvgLen(self):
+                return self.sampleUntil(self.estimateMean, "length", \
+                                self.readLength)
+
+
+        # Returns the estimated average of the average quality scores of
+        # the reads as an Estimate
+        def getAvgQScore(self):
+                return self.sampleUntil(self.estimateMean, "qScore", \
+                                self.readQScore)
+
+
+        # Returns the estimated percent of reads with an average quality
+        # score at or above cutoff, as getNumQualSeqs counts them
+        def getQualPercent(self, cutoff):
+                if type(cutoff) != str or len(cutoff) != 1:
+                        raise Exception(CHAR_EXCEPTION)
+
+                return self.sampleUntil(self.estimateMean, ("qual", cutoff), \
+                                self.isQual, 100, ord(cutoff))
+
+
+        # Returns the estimated percent of reads that have pattern with up
+        # to maxErrors errors, as getNumMatches finds them
+        def getMatchPercent(self, pattern, maxErrors=0, indels=False, \
+                        bothStrands=False):
+                matcher = ApproximateMatcher(pattern, maxErrors, indels, \
+                                bothStrands)
+                key = ("match", pattern, maxErrors, indels, bothStrands)
+
+                return self.sampleUntil(self.estimateMean, key, \
+                                self.isMatch, 100, matcher)
+
+
+        # Returns an OrderedDict of the Estimates of the statistics that can
+        # be estimated, named as FastqReporter.getSummary names them
+        def getSummary(self):
+                (gc, at) = self.getGC_AT()
+
+                summary = OrderedDict()
+                summary["numReads"] = self.getNumReads()
+                summary["GC"] = gc
+                summary["AT"] = at
+                summary["avgLen"] = self.getAvgLen()
+                summary["avgQScore"] = self.getAvgQScore()
+
+                return summary
+
+
+        # Returns the number of reads sampled so far
+        def getNumSamples(self):
+                return len(self.reads)
+
+
+        # Reads the file in and returns a FastqReporter with the exact
+        # statistics. options are passed on to FastqReporter, which uses
+        # this estimator's monitor unless given another.
+        def getExact(self, **options):
+                options.setdefault("monitor", self.monitor)
+
+                return FastqReporter(self.inputFile, **options)
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Sampling stops once every estimate asked for is within
+        # targetError of its value, relative to it, or maxSamples reads
+        # have been sampled. targetError=None always samples maxSamples
+        # reads. seed repeats the same samples.
+        def __init__(self, inputFile, targetError=0.02, maxSamples=100000, \
+                        seed=None, monitor=None):
+                if not isinstance(inputFile, str) or \
+                                inputFile == fastqInput.STDIN or \
+                                fastqInput.isCompressed(inputFile):
+                        raise Exception(FILE_EXCEPTION.format(inputFile))
+                if maxSamples < 2:
+                        raise Exception(SAMPLES_EXCEPTION)
+                if targetError != None and targetError <= 0:
+                        raise Exception(ERROR_EXCEPTION)
+                if monitor == None:
+                        monitor = NullMonitor()
+
+                self.inputFile = inputFile
+                self.targetError = targetError
+                self.maxSamples = maxSamples
+                self.random = random.Random(seed)
+                self.monitor = monitor
+
+                # Offsets are only drawn up to the end of the last read
+                self.size = self.findEnd()
+                if self.size == 0:
+                        raise Exception(EMPTY_EXCEPTION.format(inputFile))
+
+                # Each sampled read as (nucleotides, average quality
+                # score), the weight of each and the values worked out
+                # from them so far, by name
+                self.reads = []
+                self.weights = []
+                self.columns = {}
+
+
+        # Samples reads until the Estimate returned by estimate(*args) is
+        # close enough, see the top of this file, and returns it
+        def sampleUntil(self, estimate, *args):
+                if len(self.reads) < FIRST_SAMPLES:
+                        self.sample(min(FIRST_SAMPLES, self.maxSamples) - \
+                                        len(self.reads))
+
+                while True:
+                        result = estimate(*args)
+                        if len(self.reads) >= self.maxSamples:
+                                return result
+
+                        if self.targetError != None:
+                                halfWidth = (result.high - result.low) / 2.0
+                                if halfWidth <= self.targetError * \
+                                                abs(result.value):
+                                        return result
+
+                        self.sample(min(len(self.reads), \
+                                        self.maxSamples - len(self.reads)))
+
+
+        # Returns the offset just past the line ending of the last line of
+        # the file that isn't blank, so that blank lines at the end of the
+        # file, which aren't part of any read, are never sampled
+        def findEnd(self):
+                with open(self.inputFile, 'rb') as filer:
+                        end = os.path.getsize(self.inputFile)
+                        while end > 0:
+                                start = max(end - SYNC_WINDOW, 0)
+                                filer.seek(start)
+                                text = filer.read(end - start).rstrip()
+                                if text == "":
+                                        end = start
+                                        continue
+
+                                end = start + len(text)
+                                filer.seek(end)
+                                ending = filer.read(2)
+                                if ending == "\r\n":
+                                        return end + 2
+                                if ending[:1] == "\n":
+                                        return end + 1
+                                return end
+
+                return 0
+
+
+        # Samples n more reads at random offsets
+        def sample(self, n):
+                self.monitor.begin("sampleReads", "Sampling " + str(n) + \
+                                " reads....")
+                with open(self.inputFile, 'rb') as filer:
+                        for i in xrange(n):
+                                offset = self.random.randrange(self.size)
+                                (size, seq, qual) = self.readAt(filer, offset)
+
+                                score = sum(bytearray(qual))
+                                score = round(score / float(max(len(qual), 1)), 2)
+                                self.reads.append((seq, score))
+                                self.weights.append(1.0 / size)
+
+                self.monitor.end(reads=n)
+
+
+        # Returns the size in bytes, nucleotides and quality scores of the
+        # read that the byte at offset is part of
+        def readAt(self, filer, offset):
+                window = SYNC_WINDOW
+                while True:
+                        start = syncToRecord(filer, max(offset - window, 0))
+                        if start <= offset or window >= offset:
+                                break
+                        window *= 2
+
+                filer.seek(start)
+                while True:
+                        lines = [filer.readline() for i in range(4)]
+                        end = start + sum([len(line) for line in lines])
+                        seq = lines[1].strip()
+                        qual = lines[3].strip()
+                        if not lines[0].startswith('@') or \
+                                        lines[2][:1] not in "+-" or \
+                                        len(seq) != len(qual):
+                                raise Exception(RECORD_EXCEPTION.format( \
+                                                offset, self.inputFile))
+
+                        if end > offset:
+                                return (end - start, seq, qual)
+                        start = end
+
+
+        # Returns getValue(read, *args) for each sampled read, kept under
+        # key so each read's is only worked out once
+        def getColumn(self, key, getValue, *args):
+                column = self.columns.setdefault(key, [])
+                for i in xrange(len(column), len(self.reads)):
+                        column.append(getValue(self.reads[i], *args))
+
+                return column
+
+
+        # Estimates of the reads sampled so far, for sampleUntil
+        def estimateNumReads(self):
+                size = float(self.size)
+                return self.mean([size * weight for weight in self.weights])
+
+
+        def estimateGC(self):
+                return self.ratio(self.getColumn("gc", self.countGC), \
+                                self.getColumn("called", self.countCalled), 100)
+
+
+        # Estimates the average over reads of getValue, see getColumn,
+        # times scale
+        def estimateMean(self, key, getValue, scale=1, *args):
+                return self.ratio(self.getColumn(key, getValue, *args), \
+                                None, scale)
+
+
+        # Returns an Estimate of the mean of values, one per sampled read
+        def mean(self, values):
+                n = len(values)
+                mean = float(sum(values)) / n
+                variance = sum([(value - mean) ** 2 for value in values]) / \
+                                (n - 1)
+
+                return self.makeEstimate(mean, variance / n)
+
+
+        # Returns an Estimate of the weighted ratio of values to bases, see
+        # the top of this file, times scale. bases=None counts each read
+        # once, giving the average of values over reads.
+        def ratio(self, values, bases=None, scale=1):
+                weights = self.weights
+                if bases == None:
+                        bases = [1] * len(values)
+
+                top = sum([weight * value for weight, value in \
+                                zip(weights, values)])
+                bottom = sum([weight * base for weight, base in \
+                                zip(weights, bases)])
+                if bottom == 0:
+                        raise Exception(NUCS_EXCEPTION)
+                ratio = top / bottom
+
+                # Linearized variance of a ratio of two sums
+                n = len(values)
+                residuals = sum([(weight * (value - ratio * base)) ** 2 \
+                                for weight, value, base in \
+                                zip(weights, values, bases)])
+                variance = residuals * n / (n - 1) / bottom ** 2
+
+                return self.makeEstimate(ratio * scale, \
+                                variance * scale ** 2)
+
+
+        # Returns an Estimate of value from its variance, rounded to two
+        # decimal places
+        def makeEstimate(self, value, variance):
+                halfWidth = Z * math.sqrt(variance)
+
+                return Estimate(round(value, 2), round(value - halfWidth, 2), \
+                                round(value + halfWidth, 2), len(self.reads))
+
+
+        # Values of a sampled read, for getColumn
+        def countGC(self, read):
+                seq = read[0].upper()
+                return seq.count('G') + seq.count('C')
+
+
+        def countCalled(self, read):
+                seq = read[0].upper()
+                return seq.count('A') + seq.count('C') + seq.count('G') + \
+                                seq.count('T')
+
+
+        def readLength(self, read):
+                return len(read[0])
+
+
+        def readQScore(self, read):
+                return read[1]
+
+
+        def isQual(self, read, cutoff):
+                return int(read[1]) >= cutoff
+
+
+        def isMatch(self, read, matcher):
+                return matcher.distance(read[0]) != None
+
+
+class FastqEstimateReporter(FastqEstimator):
+        ################### Public API ###################
+        def printNumReads(self):
+                estimate = self.getNumReads()
+                print "About", estimate, "total reads"
+                self.printEstimated()
+
+
+        def printAvgReadLength(self):
+                estimate = self.getAvgLen()
+                print "Average read length:", estimate, "nucleotides"
+                self.printEstimated()
+
+
+        def printAvgQualScore(self):
+                estimate = self.getAvgQScore()
+                print "Average quality score:",
+                print unichr(int(round(estimate.value))), "from", estimate
+                self.printEstimated()
+
+
+        def printGC_AT(self):
+                (gc, at) = self.getGC_AT()
+                print "G/C A/T CONTENT FOR ALL READS"
+                print "G/C Content:", str(gc.value) + "%", "(" + \
+                                str(CONFIDENCE) + "% CI", str(gc.low) + "% to", \
+                                str(gc.high) + "%)"
+                print "A/T Content:", str(at.value) + "%", "(" + \
+                                str(CONFIDENCE) + "% CI", str(at.low) + "% to", \
+                                str(at.high) + "%)"
+                self.printEstimated()
+
+
+        # Prints the estimated percent of reads that have pattern, see
+        # getMatchPercent
+        def printNumMatches(self, pattern, maxErrors=0, indels=False, \
+                        bothStrands=False):
+                estimate = self.getMatchPercent(pattern, maxErrors, indels, \
+                                bothStrands)
+                errors = "mismatches"
+                if indels:
+                        errors = "edits"
+
+                print "\"" + pattern + "\"", "found in", str(estimate.value) + \
+                                "% of sequences",
+                if maxErrors > 0:
+                        print "with up to", maxErrors, errors,
+                if bothStrands:
+                        print "on either strand",
+                print
+                print "(" + str(CONFIDENCE) + "% CI", str(estimate.low) + \
+                                "% to", str(estimate.high) + "%)"
+                self.printEstimated()
+
+
+        # Prints the estimated percent of reads with an average quality
+        # score at or above cutoff, see getQualPercent
+        def printNumQualSeqs(self, cutoff):
+                estimate = self.getQualPercent(cutoff)
+                print str(estimate.value) + "%", "of sequences have an",
+                print "average quality score greater than or equal to",
+                print "\"" + cutoff + "\""
+                print "(" + str(CONFIDENCE) + "% CI", str(estimate.low) + \
+                                "% to", str(estimate.high) + "%)"
+                self.printEstimated()
+
+
+        ################ Private Methods ################
+        # Says that the answer just printed is an estimate
+        def printEstimated(self):
+                print "ESTIMATED from", self.getNumSamples(), "sampled reads"
+                print
@@ -0,0 +1,357 @@
+#
+# fastqFilter.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 3, 2014
+# Last Modified: Jun 3, 2014
+#
+# The FastqFilter class decides which reads of a FASTQ file to keep, and
+# filterFile streams a file through one into a new FASTQ file without
+# holding more than a batch of reads in memory. Each read is first trimmed
+# and then has to pass, in order:
+#
+#   minLength, maxLength - the length of the trimmed read
+#   maxN                 - the fraction of its nucleotides that are N
+#   minQual              - its average quality score, rounded down, as
+#                          FastqKeeper.getNumQualSeqs counts it
+#   require              - it has at least one of these patterns
+#   exclude              - it has none of these patterns
+#
+# Patterns are matched as FastqKeeper.getNumMatches matches them, with N
+# standing for any nucleotide. A read that fails is counted against the
+# first predicate it fails, see getReport. Reads aren't otherwise checked
+# the way FastqKeeper checks them, only that they have all four lines and
+# as many quality scores as nucleotides.
+#
+# Trimming with trimQual cuts the 3' end of a read back to the point that
+# maximises the sum of (trimQual - quality) over the bases cut off, which
+# is how BWA trims. Low quality bases are cut even if a few good ones
+# come after them.
+#
+# Passing reads are written out a batch at a time with one write call.
+# Output files ending in .gz, or given a compression level, are gzipped,
+# and "-" writes to standard output.
+#
+
+import gzip
+import io
+import os
+import re
+import sys
+from collections import OrderedDict
+
+import fastqInput
+
+STDOUT = "-"
+
+# Reads written out at a time
+BATCH_READS = 10000
+
+# Bytes of lines read in at a time
+READ_BYTES = 1 << 20
+
+# Size of the output file buffer
+WRITE_BYTES = 1 << 20
+
+# Compression level of gzipped output unless another is given. Lower
+# levels are several times faster for slightly larger files.
+GZIP_LEVEL = 4
+
+IO_EXCEPTION = "Can't find file \"{}\""
+TRUNCATED_EXCEPTION = "Read ID {} is missing lines"
+BALANCE_EXCEPTION = "Read ID {} has a different number of qscores and" + \
+                " nucleotides"
+LENGTH_EXCEPTION = "Length range {} to {} is empty"
+FRACTION_EXCEPTION = "Fraction of Ns {} must be between 0 and 1"
+CHAR_EXCEPTION = "Quality score chars must only be one character long"
+NUC_EXCEPTION = "Unknown nucleotide \"{}\""
+
+
+# Streams the reads of inputFile through fastqFilter and writes the ones
+# that pass to outputFile. Reads starting at or after byte offset end are
+# left out if it is given. Returns fastqFilter.getReport().
+#
+# Progress goes to monitor, if one is given, see fastqMonitor.
+def filterFile(inputFile, outputFile, fastqFilter, compressLevel=None, \
+                workers=1, end=None, monitor=None):
+        size = None
+        try:
+                if inputFile != fastqInput.STDIN:
+                        size = os.path.getsize(inputFile)
+                filer = fastqInput.openFastq(inputFile, workers)
+        except (IOError, OSError):
+                raise Exception(IO_EXCEPTION.format(inputFile))
+
+        if monitor != None:
+                monitor.begin("filterFile", "Filtering reads....", size)
+
+        with filer:
+                writeReads(iterRecords(filer, end), outputFile, fastqFilter, \
+                                compressLevel, monitor)
+
+        if monitor != None:
+                monitor.end(reads=fastqFilter.numReads)
+
+        return fastqFilter.getReport()
+
+
+# Yields each read in filer as [ID, SEQ, STRAND-SENSE, QSCORE] until the
+# end of the file or byte offset end. Blank lines at the end of the file
+# are ignored, but a read that is missing lines raises an Exception.
+#
+# Lines are read READ_BYTES at a time and split into reads with slices,
+# which is much faster than reading them one at a time.
+def iterRecords(filer, end=None):
+        pending = []
+        pos = 0
+
+        while True:
+                chunk = filer.readlines(READ_BYTES)
+                if not chunk:
+                        break
+
+                lines = pending + chunk
+                whole = len(lines) - len(lines) % 4
+                pending = lines[whole:]
+
+                ids = [line.strip() for line in lines[0:whole:4]]
+                nucs = [line.strip() for line in lines[1:whole:4]]
+                strands = [line.strip() for line in lines[2:whole:4]]
+                quals = [line.strip() for line in lines[3:whole:4]]
+
+                for i in xrange(len(ids)):
+                        if end != None:
+                                if pos >= end:
+                                        return
+                                pos += len(lines[4 * i]) + \
+                                        len(lines[4 * i + 1]) + \
+                                        len(lines[4 * i + 2]) + \
+                                        len(lines[4 * i + 3])
+
+                        # Four or more blank lines at the end of the file
+                        if ids[i] == "" and nucs[i] == "" and \
+                                strands[i] == "" and quals[i] == "":
+                                continue
+
+                        yield [ids[i], nucs[i], strands[i], quals[i]]
+
+        # Anything from end on, e.g. a read still being written, is left out
+        seq = [line.strip() for line in pending]
+        if (end == None or pos < end) and "".join(seq) != "":
+                raise Exception(TRUNCATED_EXCEPTION.format(seq[0]))
+
+
+# Writes the reads in reads that pass fastqFilter to outputFile, trimmed.
+# Reads may have more than four fields, e.g. their average quality score,
+# but only the first four are written. Returns the number written.
+def writeReads(reads, outputFile, fastqFilter, compressLevel=None, \
+                monitor=None):
+        raw = openOutput(outputFile)
+        filew = raw
+        if compressLevel == None and outputFile.endswith(".gz"):
+                compressLevel = GZIP_LEVEL
+        if compressLevel != None:
+                filew = gzip.GzipFile(os.path.basename(outputFile), 'wb', \
+                                compressLevel, raw)
+        batch = []
+        passed = 0
+
+        try:
+                for seq in reads:
+                        seq = fastqFilter.filter(seq)
+                        if seq == None:
+                                continue
+
+                        batch.append(seq[0])
+                        batch.append(seq[1])
+                        batch.append(seq[2])
+                        batch.append(seq[3])
+                        passed += 1
+
+                        if passed % BATCH_READS == 0:
+                                filew.write("\n".join(batch) + "\n")
+                                batch = []
+                                if monitor != None:
+                                        monitor.progress( \
+                                                reads=fastqFilter.numReads)
+
+                if batch:
+                        filew.write("\n".join(batch) + "\n")
+        finally:
+                # A GzipFile doesn't close the file it writes to
+                filew.close()
+                raw.close()
+
+        return passed
+
+
+# Opens outputFile for writing. Standard output is written to through the
+# process's own file descriptor, so messages printed to sys.stdout
+# meanwhile can be sent elsewhere by replacing it.
+def openOutput(outputFile):
+        if outputFile != STDOUT:
+                return open(outputFile, 'wb', WRITE_BYTES)
+
+        sys.__stdout__.flush()
+        return io.open(sys.__stdout__.fileno(), 'wb', WRITE_BYTES, \
+                        closefd=False)
+
+
+class FastqFilter:
+        ################### Public API ###################
+        # Returns read trimmed if it passes every predicate, otherwise
+        # None. read is not changed.
+        def filter(self, read):
+                self.numReads += 1
+                nucs = read[1]
+                quals = read[3]
+
+                if len(nucs) != len(quals):
+                        raise Exception(BALANCE_EXCEPTION.format(read[0]))
+
+                if self.trimQual != None:
+                        end = self.trimPoint(quals)
+                        if end < len(quals):
+                                nucs = nucs[:end]
+                                quals = quals[:end]
+                                self.numTrimmed += 1
+
+                for name, passes in self.predicates:
+                        if not passes(nucs, quals):
+                                self.failed[name] += 1
+                                return None
+
+                self.numPassed += 1
+                return [read[0], nucs, read[2], quals]
+
+
+        # Returns an OrderedDict with the number of reads filtered, passed
+        # and trimmed, then the number that failed each predicate in the
+        # order they are checked
+        def getReport(self):
+                report = OrderedDict()
+                report["reads"] = self.numReads
+                report["passed"] = self.numPassed
+                report["trimmed"] = self.numTrimmed
+                report.update(self.failed)
+
+                return report
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # minQual and trimQual are quality score chars, minLength and
+        # maxLength numbers of nucleotides, maxN a fraction between 0 and
+        # 1, and require and exclude lists of nucleotide patterns. Any
+        # left as None aren't checked.
+        def __init__(self, minQual=None, minLength=None, maxLength=None, \
+                        maxN=None, require=None, exclude=None, trimQual=None):
+                self.numReads = 0
+                self.numPassed = 0
+                self.numTrimmed = 0
+
+                self.trimQual = None
+                if trimQual != None:
+                        self.trimQual = self.qualValue(trimQual)
+
+                # (name, function of nucs and quals that is True if the read
+                # passes) for each predicate in the order they are checked
+                self.predicates = []
+
+                if minLength != None or maxLength != None:
+                        self.minLength = minLength or 0
+                        self.maxLength = maxLength
+                        if maxLength != None and self.minLength > maxLength:
+                                raise Exception(LENGTH_EXCEPTION.format( \
+                                                minLength, maxLength))
+                        self.predicates.append(("length", self.checkLength))
+
+                if maxN != None:
+                        if maxN < 0 or maxN > 1:
+                                raise Exception(FRACTION_EXCEPTION.format(maxN))
+                        self.maxN = maxN
+                        self.predicates.append(("maxN", self.checkN))
+
+                if minQual != None:
+                        self.minQual = self.qualValue(minQual)
+                        self.predicates.append(("minQual", self.checkQual))
+
+                if require:
+                        self.required = self.compilePatterns(require)
+                        self.predicates.append(("require", self.checkRequired))
+
+                if exclude:
+                        self.excluded = self.compilePatterns(exclude)
+                        self.predicates.append(("exclude", self.checkExcluded))
+
+                self.failed = OrderedDict([(name, 0) for name, passes in \
+                                self.predicates])
+
+
+        # Returns the number a quality score char stands for
+        def qualValue(self, cutoff):
+                if type(cutoff) != str or len(cutoff) != 1:
+                        raise Exception(CHAR_EXCEPTION)
+
+                return ord(cutoff)
+
+
+        # Returns one regular expression that finds any of patterns
+        def compilePatterns(self, patterns):
+                regexes = []
+                for pattern in patterns:
+                        pattern = pattern.upper()
+                        for nuc in pattern:
+                                if nuc not in "ACGTN":
+                                        raise Exception(NUC_EXCEPTION.format( \
+                                                        nuc))
+                        regexes.append(pattern.replace('N', '.'))
+
+                return re.compile("|".join(regexes))
+
+
+        # Returns how many bases of quals to keep, cutting the 3' end back
+        # to where the sum of trimQual - quality is largest
+        def trimPoint(self, quals):
+                cutoff = self.trimQual
+                values = bytearray(quals)
+                end = len(values)
+                total = 0
+                best = 0
+
+                for i in xrange(len(values) - 1, -1, -1):
+                        total += cutoff - values[i]
+                        if total < 0:
+                                break
+                        if total > best:
+                                best = total
+                                end = i
+
+                return end
+
+
+        def checkLength(self, nucs, quals):
+                return self.minLength <= len(nucs) and \
+                        (self.maxLength == None or len(nucs) <= self.maxLength)
+
+
+        # Ns are counted in either case, as FastqKeeper.countNucs does
+        def checkN(self, nucs, quals):
+                return nucs.upper().count('N') <= self.maxN * len(nucs)
+
+
+        # Same rounding as FastqKeeper.readQScore
+        def checkQual(self, nucs, quals):
+                if len(quals) == 0:
+                        return False
+
+                mean = round(sum(bytearray(quals)) / float(len(quals)), 2)
+                return int(mean) >= self.minQual
+
+
+        def checkRequired(self, nucs, quals):
+                return self.required.search(nucs) != None
+
+
+        def checkExcluded(self, nucs, quals):
+                return self.excluded.search(nucs) == None
@@ -0,0 +1,515 @@
+#
+# fastqInput.py
+# Author: Philip Braunstein
+#
+# Date Created: May 26, 2014
+# Last Modified: May 26, 2014
+#
+# Opens FASTQ files that may be compressed. The format is found from the
+# first bytes of the file rather than its extension:
+#
+#   gzip   - decompressed as a stream with zlib, including files made of
+#            several gzip members
+#   BGZF   - gzip made of independent blocks (bgzip, samtools). With more
+#            than one worker, blocks are decompressed by a process pool.
+#   zstd   - decompressed with the zstandard module if it is installed
+#
+# Anything else is opened as a plain text file. Compressed files come back
+# as a DecompressedFile, which can be read line by line like a file and
+# can seek forward (but not backward) in the decompressed text.
+#
+# The file name "-" reads from standard input, which can only be read once.
+#
+# With readahead, a background thread reads (and decompresses) the file
+# readahead bytes at a time into a queue of at most READAHEAD_BUFFERS
+# buffers while the caller parses the ones before, so that waiting on the
+# disk and parsing overlap. The thread blocks when the queue is full, so
+# at most READAHEAD_BUFFERS + 2 buffers are held at once. How long the
+# thread took to read and how long the caller waited for it go in an
+# InputStats, to tell whether reading or parsing is the bottleneck.
+#
+
+import io
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from multiprocessing import Pool
+from Queue import Empty
+from Queue import Full
+from Queue import Queue
+
+STDIN = "-"
+
+PLAIN = "plain"
+GZIP = "gzip"
+BGZF = "bgzf"
+ZSTD = "zstd"
+
+GZIP_MAGIC = "\x1f\x8b"
+ZSTD_MAGIC = "\x28\xb5\x2f\xfd"
+
+# Size of the reads from compressed files and of the line buffer
+CHUNK_BYTES = 1 << 20
+
+# BGZF blocks given to a worker at a time, each is at most 64 KB
+BGZF_BATCH_BLOCKS = 64
+
+# Buffers the readahead thread may get ahead of the caller, and how often
+# it checks whether the file was closed while the queue is full
+READAHEAD_BUFFERS = 4
+READAHEAD_POLL = 0.1
+
+# Size of the buffers read ahead past the end of a range of a file, which
+# only has to finish its last read
+READAHEAD_TAIL_BYTES = 1 << 16
+
+ZSTD_EXCEPTION = "Reading zstd compressed file \"{}\" needs the" + \
+                " zstandard module"
+BGZF_EXCEPTION = "Bad BGZF block in \"{}\""
+
+
+# Standard input as a buffered binary file, shared so that bytes peeked
+# at by detectFormat are not lost
+stdin = None
+
+
+# Opens inputFile, or standard input for STDIN, as a binary file
+def openRaw(inputFile):
+        global stdin
+
+        if inputFile != STDIN:
+                return open(inputFile, 'rb')
+
+        if stdin == None:
+                stdin = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+        return stdin
+
+
+# Returns which of PLAIN, GZIP, BGZF or ZSTD inputFile is
+def detectFormat(inputFile):
+        if inputFile == STDIN:
+                header = openRaw(inputFile).peek(16)[:16]
+        else:
+                with openRaw(inputFile) as filer:
+                        header = filer.read(16)
+
+        if header.startswith(ZSTD_MAGIC):
+                return ZSTD
+
+        if not header.startswith(GZIP_MAGIC):
+                return PLAIN
+
+        # BGZF sets FEXTRA and has a BC subfield first in the extra field
+        if len(header) >= 14 and ord(header[3]) & 4 and header[12:14] == "BC":
+                return BGZF
+
+        return GZIP
+
+
+# Returns True if inputFile is compressed
+def isCompressed(inputFile):
+        return detectFormat(inputFile) != PLAIN
+
+
+# Opens inputFile for reading whether it is compressed or not. workers
+# is the number of processes used to decompress BGZF files. Time spent
+# decompressing is added to inputStats if it is passed in.
+#
+# With readahead, a number of bytes, the file is read ahead that many
+# bytes at a time by a background thread, see the top of this file, and
+# can then only seek forward. start is where an uncompressed file is first
+# read ahead from, so the caller's first seek there is free, and past end,
+# if it is given, it is read ahead in small buffers.
+def openFastq(inputFile, workers=1, inputStats=None, readahead=None, \
+                start=0, end=None):
+        fileFormat = detectFormat(inputFile)
+
+        if fileFormat == PLAIN and readahead != None:
+                chunks = plainChunks(inputFile, start, end, readahead, \
+                                inputStats)
+                return DecompressedFile(ChunkStream(ReadaheadChunks(chunks, \
+                                inputStats), None, start), CHUNK_BYTES)
+
+        if fileFormat == PLAIN and inputFile == STDIN:
+                return openRaw(inputFile)
+        elif fileFormat == PLAIN:
+                return open(inputFile, 'r')
+        elif fileFormat == ZSTD:
+                chunks = zstdChunks(inputFile, inputStats)
+        elif fileFormat == BGZF and workers > 1:
+                chunks = bgzfChunks(inputFile, workers, inputStats)
+        else:
+                # BGZF is valid gzip, so one worker can read it as such
+                chunks = gzipChunks(inputFile, inputStats)
+
+        if readahead != None:
+                # Decompressed in the background instead, and timed there
+                chunks = ReadaheadChunks(timedChunks(chunks, inputStats), \
+                                inputStats)
+                return DecompressedFile(ChunkStream(chunks), CHUNK_BYTES)
+
+        return DecompressedFile(ChunkStream(chunks, inputStats), CHUNK_BYTES)
+
+
+# Yields an uncompressed file chunkBytes at a time from offset start, and
+# READAHEAD_TAIL_BYTES at a time past end, telling the OS it will be read
+# sequentially where it can be told
+def plainChunks(inputFile, start, end, chunkBytes, inputStats):
+        with openRaw(inputFile) as filer:
+                if inputFile != STDIN:
+                        filer.seek(start)
+                        fadvise = getattr(os, "posix_fadvise", None)
+                        if fadvise != None:
+                                fadvise(filer.fileno(), start, 0, \
+                                                os.POSIX_FADV_SEQUENTIAL)
+
+                pos = start
+                while True:
+                        size = chunkBytes
+                        if end != None and pos < end:
+                                size = min(chunkBytes, end - pos)
+                        elif end != None:
+                                size = READAHEAD_TAIL_BYTES
+
+                        began = time.time()
+                        data = filer.read(size)
+                        pos += len(data)
+                        if inputStats != None:
+                                inputStats.readTime += time.time() - began
+                                inputStats.readBytes += len(data)
+                        if data == "":
+                                break
+                        yield data
+
+
+# Yields the decompressed contents of a gzip file a chunk at a time
+def gzipChunks(inputFile, inputStats):
+        with openRaw(inputFile) as filer:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+                while True:
+                        data = filer.read(CHUNK_BYTES)
+                        if data == "":
+                                break
+                        if inputStats != None:
+                                inputStats.compressedBytes += len(data)
+
+                        while data != "":
+                                text = decompressor.decompress(data)
+                                if text != "":
+                                        yield text
+
+                                # One member ended, the rest of data is
+                                # the start of the next one
+                                data = decompressor.unused_data
+                                if data != "":
+                                        decompressor = zlib.decompressobj(
+                                                16 + zlib.MAX_WBITS)
+
+                text = decompressor.flush()
+                if text != "":
+                        yield text
+
+
+# Yields the decompressed contents of a BGZF file a batch of blocks at a
+# time. Batches are decompressed by a pool of workers, with at most two
+# batches per worker read ahead so memory stays bounded.
+def bgzfChunks(inputFile, workers, inputStats):
+        pool = Pool(workers)
+        pending = deque()
+
+        try:
+                batches = bgzfBatches(inputFile, inputStats)
+                for batch in batches:
+                        pending.append(pool.apply_async(inflateBlocks, (batch,)))
+
+                        if len(pending) >= 2 * workers:
+                                yield pending.popleft().get()
+
+                while len(pending) > 0:
+                        yield pending.popleft().get()
+
+                pool.close()
+        finally:
+                pool.terminate()
+                pool.join()
+
+
+# Yields lists of BGZF_BATCH_BLOCKS compressed blocks from inputFile
+def bgzfBatches(inputFile, inputStats):
+        batch = []
+
+        with openRaw(inputFile) as filer:
+                while True:
+                        block = readBgzfBlock(filer, inputFile)
+                        if block == None:
+                                break
+                        if inputStats != None:
+                                inputStats.compressedBytes += len(block)
+
+                        batch.append(block)
+                        if len(batch) == BGZF_BATCH_BLOCKS:
+                                yield batch
+                                batch = []
+
+        if len(batch) > 0:
+                yield batch
+
+
+# Reads one BGZF block from filer. Returns None at the end of the file.
+#
+# The header is 12 bytes ending with the length of the extra field, and
+# the BC subfield in the extra field holds the block size minus one.
+def readBgzfBlock(filer, inputFile):
+        header = filer.read(12)
+        if header == "":
+                return None
+        if len(header) < 12 or not header.startswith(GZIP_MAGIC):
+                raise Exception(BGZF_EXCEPTION.format(inputFile))
+
+        extraLen = ord(header[10]) | ord(header[11]) << 8
+        extra = filer.read(extraLen)
+
+        blockSize = None
+        i = 0
+        while i + 4 <= len(extra):
+                subLen = ord(extra[i + 2]) | ord(extra[i + 3]) << 8
+                if extra[i:i + 2] == "BC" and subLen == 2:
+                        blockSize = ord(extra[i + 4]) | ord(extra[i + 5]) << 8
+                        blockSize += 1
+                i += 4 + subLen
+
+        if blockSize == None:
+                raise Exception(BGZF_EXCEPTION.format(inputFile))
+
+        rest = filer.read(blockSize - 12 - extraLen)
+        if len(rest) != blockSize - 12 - extraLen:
+                raise Exception(BGZF_EXCEPTION.format(inputFile))
+
+        return header + extra + rest
+
+
+# Decompresses a list of BGZF blocks, each a complete gzip member, and
+# returns their text joined together
+def inflateBlocks(blocks):
+        return "".join([zlib.decompress(block, 16 + zlib.MAX_WBITS) \
+                for block in blocks])
+
+
+# Yields the decompressed contents of a zstd file a chunk at a time
+def zstdChunks(inputFile, inputStats):
+        try:
+                import zstandard
+        except ImportError:
+                raise Exception(ZSTD_EXCEPTION.format(inputFile))
+
+        with openRaw(inputFile) as filer:
+                reader = zstandard.ZstdDecompressor().stream_reader(filer)
+                while True:
+                        text = reader.read(CHUNK_BYTES)
+                        if text == "":
+                                break
+                        yield text
+
+                if inputStats != None:
+                        inputStats.compressedBytes += filer.tell()
+
+
+# Time spent decompressing, and how much went in and came out. With
+# readahead, the bytes read ahead and the time it took, and the time the
+# caller spent waiting for them. Without it, the caller waits while each
+# chunk is decompressed.
+class InputStats:
+        def __init__(self):
+                self.compressedBytes = 0
+                self.decompressedBytes = 0
+                self.decompressTime = 0.0
+                self.readBytes = 0
+                self.readTime = 0.0
+                self.waitTime = 0.0
+
+
+        # Adds the totals of another InputStats, e.g. from another process
+        def merge(self, other):
+                self.compressedBytes += other.compressedBytes
+                self.decompressedBytes += other.decompressedBytes
+                self.decompressTime += other.decompressTime
+                self.readBytes += other.readBytes
+                self.readTime += other.readTime
+                self.waitTime += other.waitTime
+
+
+# Yields the chunks of a generator of decompressed chunks, adding the time
+# each took and its size to inputStats, as ChunkStream does when it reads
+# from the generator itself
+def timedChunks(chunks, inputStats):
+        try:
+                while True:
+                        began = time.time()
+                        try:
+                                chunk = next(chunks)
+                        except StopIteration:
+                                return
+                        finally:
+                                if inputStats != None:
+                                        inputStats.decompressTime += \
+                                                time.time() - began
+
+                        if inputStats != None:
+                                inputStats.decompressedBytes += len(chunk)
+                        yield chunk
+        finally:
+                chunks.close()
+
+
+# Iterates over the chunks of a generator that is run by a background
+# thread, at most READAHEAD_BUFFERS chunks ahead. The time spent waiting
+# for the thread is added to inputStats. Exceptions raised in the thread
+# are raised again by next.
+class ReadaheadChunks:
+        def __init__(self, chunks, inputStats=None):
+                self.inputStats = inputStats
+                self.queue = Queue(READAHEAD_BUFFERS)
+                self.stopped = threading.Event()
+                self.done = False
+
+                self.thread = threading.Thread(target=self.readAhead, \
+                                args=(chunks,))
+                self.thread.daemon = True
+                self.thread.start()
+
+
+        def __iter__(self):
+                return self
+
+
+        def next(self):
+                if self.done:
+                        raise StopIteration
+
+                began = time.time()
+                (chunk, error) = self.queue.get()
+                if self.inputStats != None:
+                        self.inputStats.waitTime += time.time() - began
+
+                if error != None:
+                        self.done = True
+                        raise error[0], error[1], error[2]
+                if chunk == None:
+                        self.done = True
+                        raise StopIteration
+
+                return chunk
+
+
+        # Stops the thread, which closes the generator
+        def close(self):
+                self.stopped.set()
+                self.done = True
+                while self.thread.is_alive():
+                        try:
+                                self.queue.get(timeout=READAHEAD_POLL)
+                        except Empty:
+                                pass
+                self.thread.join()
+
+
+        # Runs in the thread, putting each chunk on the queue followed by
+        # None, or the exception the generator raised
+        def readAhead(self, chunks):
+                try:
+                        for chunk in chunks:
+                                if not self.put((chunk, None)):
+                                        return
+                        self.put((None, None))
+                except Exception:
+                        self.put((None, sys.exc_info()))
+                finally:
+                        chunks.close()
+
+
+        # Puts item on the queue once there is room. Returns False if the
+        # reader was closed first.
+        def put(self, item):
+                while not self.stopped.is_set():
+                        try:
+                                self.queue.put(item, timeout=READAHEAD_POLL)
+                                return True
+                        except Full:
+                                pass
+
+                return False
+
+
+# Raw stream that reads from a generator of decompressed chunks. Its
+# position is the number of decompressed bytes handed out so far, plus
+# start for chunks that start part way through the file.
+class ChunkStream(io.RawIOBase):
+        def __init__(self, chunks, inputStats=None, start=0):
+                self.chunks = chunks
+                self.inputStats = inputStats
+                self.pending = ""
+                self.pendingPos = 0
+                self.pos = start
+
+
+        def readable(self):
+                return True
+
+
+        def readinto(self, buf):
+                while self.pendingPos == len(self.pending):
+                        start = time.time()
+                        try:
+                                self.pending = next(self.chunks)
+                        except StopIteration:
+                                return 0
+                        finally:
+                                if self.inputStats != None:
+                                        elapsed = time.time() - start
+                                        self.inputStats.decompressTime += \
+                                                elapsed
+                                        self.inputStats.waitTime += elapsed
+
+                        self.pendingPos = 0
+                        if self.inputStats != None:
+                                self.inputStats.decompressedBytes += \
+                                                len(self.pending)
+
+                length = min(len(buf), len(self.pending) - self.pendingPos)
+                buf[:length] = buffer(self.pending, self.pendingPos, length)
+                self.pendingPos += length
+                self.pos += length
+
+                return length
+
+
+        def tell(self):
+                return self.pos
+
+
+        def close(self):
+                if not self.closed:
+                        self.chunks.close()
+                io.RawIOBase.close(self)
+
+
+# Buffered reader over a ChunkStream, of decompressed or read ahead
+# chunks. Lines are read by the C buffered reader; seek is only supported
+# forward, by reading and discarding.
+class DecompressedFile(io.BufferedReader):
+        def seek(self, offset, whence=io.SEEK_SET):
+                pos = self.tell()
+                if whence != io.SEEK_SET or offset < pos:
+                        raise IOError("Compressed input can only seek forward")
+
+                while pos < offset:
+                        skipped = len(self.read(min(offset - pos, CHUNK_BYTES)))
+                        if skipped == 0:
+                                break
+                        pos += skipped
+
+                return pos
@@ -14,8 +14,43 @@
 # whose average quality score is above a certain threshold.
 #
 
+import os
 import random
 import re
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter
+from collections import OrderedDict
+from itertools import groupby
+from itertools import izip_longest
+
+import fastqCache
+import fastqFilter
+import fastqInput
+import fastqKernels
+import fastqMap
+import fastqParallel
+from fastqKmers import KmerIndex
+from fastqMap import FastqMap
+from fastqMonitor import monitored
+from fastqMonitor import NullMonitor
+from fastqMonitor import PrintMonitor
+from fastqMotifs import ApproximateMatcher
+from fastqMotifs import MotifMatcher
+from fastqMotifs import reverseComplement
+from fastqProfile import FastqProfile
+from fastqRecordIndex import FastqRecordIndex
+from fastqSketches import CountMinSketch
+from fastqSketches import hashItem
+from fastqSketches import hashMany
+from fastqSketches import HyperLogLog
+from fastqSketches import SpaceSaving
+from fastqStats import addCounts
+from fastqStats import FastqStats
+from fastqStats import hundredths
+from fastqStore import FastqStore
+from fastqStore import PACKED
 
 class FastqKeeper:
         ################### Public API ###################
@@ -24,14 +59,59 @@ class FastqKeeper:
 
         # Returns an list of [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE]
         # it returns a random sequence 
+        @monitored
         def getRandomSeq(self):
-                return random.choice(self.seqs)    
+                if self.seqs != None:
+                        return self.withQScore(random.choice(self.seqs))
+
+                # Reads not kept, read one back from its offset
+                i = random.randrange(len(self.recordIndex))
+                return self.readRecordAt(i)
+
+
+        # Returns a list of n random reads, each of the form of
+        # getRandomSeq, in the order they appear in the file. Passing the
+        # same seed gives the same reads. With replace=True the same read
+        # may be picked more than once.
+        #
+        # When reads are not kept in memory, the chosen reads are read
+        # from the file in order of their offsets.
+        @monitored
+        def getRandomSeqs(self, n, seed=None, replace=False):
+                numReads = self.getNumReads()
+                if n < 0 or (n > numReads and not replace):
+                        raise Exception(self.SAMPLE_EXCEPTION.format(n, \
+                                numReads))
+
+                rand = random.Random(seed)
+                if replace:
+                        readNums = [rand.randrange(numReads) for i in range(n)]
+                else:
+                        readNums = rand.sample(xrange(numReads), n)
+                readNums.sort()
+
+                if self.seqs != None:
+                        return [self.withQScore(self.seqs[i]) for i in readNums]
+
+                return list(self.readRecordsAt(readNums))
         
         # Returns the number of reads that have the passed in
         # pattern. Ns in the pattern are interpreted as match any
         # one nucleotide each. 
         # Ns in the source sequence do not have this property.
-        def getNumMatches(self, pattern):
+        #
+        # With maxErrors, reads that have the pattern with up to that many
+        # mismatches count too, or with indels=True up to that many
+        # mismatches, insertions and deletions. bothStrands counts reads
+        # that have the reverse complement of the pattern as well. See
+        # getNumMatchesByErrors.
+        @monitored
+        def getNumMatches(self, pattern, maxErrors=0, indels=False, \
+                        bothStrands=False):
+                if maxErrors != 0 or bothStrands:
+                        return sum(self.getNumMatchesByErrors(pattern, \
+                                        maxErrors, indels, bothStrands))
+
                 pattern = pattern.upper()
 
                 # Throw exception if invalid characters passed in 
@@ -47,13 +127,201 @@ class FastqKeeper:
                         else:
                                 newPattern += pattern[i]
 
-                for seq in self.seqs:
-                        if re.search(newPattern, seq[self.SEQ_INDEX]) != None:
+                regex = re.compile(newPattern)
+
+                # Only search the reads the k-mer index says could match
+                candidates = self.getKmerCandidates(pattern)
+                if candidates != None:
+                        for nucs in self.iterSeqsAt(candidates):
+                                if regex.search(nucs) != None:
+                                        count += 1
+
+                        return count
+
+                # Packed reads are searched without unpacking them
+                if isinstance(self.seqs, FastqStore) and self.seqs.packed:
+                        return self.seqs.countMatches(pattern)
+
+                for nucs in self.iterSeqs():
+                        if regex.search(nucs) != None:
                                 count += 1
 
                 return count
 
 
+        # Returns a list with, for each number of errors from 0 to
+        # maxErrors, the number of reads whose closest match to pattern has
+        # that many errors, counted in one pass with an ApproximateMatcher.
+        # Errors are mismatches, or with indels=True mismatches,
+        # insertions and deletions. With bothStrands, the closer of the
+        # pattern and its reverse complement counts.
+        @monitored
+        def getNumMatchesByErrors(self, pattern, maxErrors, indels=False, \
+                        bothStrands=False):
+                pattern = pattern.upper()
+                self.validateNucs(pattern)
+                if type(maxErrors) != int or maxErrors < 0:
+                        raise Exception(self.ERRORS_EXCEPTION.format( \
+                                        maxErrors))
+
+                matcher = ApproximateMatcher(pattern, maxErrors, indels, \
+                                bothStrands)
+                counts = [0] * (maxErrors + 1)
+
+                candidates = self.getApproximateCandidates(pattern, \
+                                maxErrors, bothStrands)
+                if candidates != None:
+                        seqs = self.iterSeqsAt(candidates)
+                else:
+                        seqs = self.iterSeqs()
+
+                for nucs in seqs:
+                        errors = matcher.distance(nucs)
+                        if errors != None:
+                                counts[errors] += 1
+
+                return counts
+
+
+        # Returns the sorted read numbers that the k-mer index says could
+        # have pattern with up to maxErrors errors, or None if every read
+        # has to be searched. Split into maxErrors + 1 pieces, the pattern
+        # can only be found with that many errors where one of the pieces
+        # is found exactly, so any read with a piece is a candidate.
+        def getApproximateCandidates(self, pattern, maxErrors, bothStrands):
+                patterns = [pattern]
+                if bothStrands:
+                        patterns.append(reverseComplement(pattern))
+
+                numPieces = maxErrors + 1
+                pieceLen = len(pattern) // numPieces
+                if pieceLen == 0:
+                        return None
+
+                candidates = set()
+                for strand in patterns:
+                        for i in range(numPieces):
+                                start = i * pieceLen
+                                end = start + pieceLen
+                                if i == numPieces - 1:
+                                        end = len(strand)
+
+                                reads = self.getKmerCandidates( \
+                                                strand[start:end])
+                                if reads == None:
+                                        return None
+                                candidates.update(reads)
+
+                return sorted(candidates)
+
+
+        # Returns a list with the number of reads that have each of
+        # patterns, in the same order, using the same rules as
+        # getNumMatches. All patterns are searched for at once with a
+        # MotifMatcher in a single pass over the reads.
+        #
+        # With readIds=True, returns a tuple of the counts and a list with
+        # the IDs of the reads that have each pattern, in file order.
+        @monitored
+        def getNumMatchesMany(self, patterns, readIds=False):
+                patterns = [pattern.upper() for pattern in patterns]
+                for pattern in patterns:
+                        self.validateNucs(pattern)
+
+                matcher = MotifMatcher(patterns)
+                counts = [0] * len(patterns)
+                readNums = [[] for pattern in patterns]
+
+                for readNum, nucs in enumerate(self.iterSeqs()):
+                        for i in matcher.match(nucs):
+                                counts[i] += 1
+                                if readIds:
+                                        readNums[i].append(readNum)
+
+                if not readIds:
+                        return counts
+
+                ids = []
+                for nums in readNums:
+                        ids.append([seq[self.ID_INDEX] for seq in \
+                                        self.iterReadsAt(nums)])
+
+                return (counts, ids)
+
+
+        # Returns the sorted read numbers that the k-mer index says could
+        # match pattern, or None if every read has to be searched.
+        def getKmerCandidates(self, pattern):
+                if self.kmerMode == "lazy" and self.kmerIndex == None:
+                        self.buildKmerIndex()
+
+                if self.kmerIndex == None:
+                        return None
+
+                return self.kmerIndex.candidates(pattern)
+
+
+        # Builds the k-mer index over all reads. If it would use more than
+        # kmerMaxBytes, it is dropped and every search scans all reads.
+        def buildKmerIndex(self):
+                self.monitor.begin("buildKmerIndex", \
+                                "Building k-mer index....")
+                kmerIndex = KmerIndex(self.kmerSize, self.kmerMaxBytes)
+
+                # Only try once
+                self.kmerMode = None
+
+                if not kmerIndex.build(self.iterSeqs()):
+                        self.monitor.message("K-mer index would use more " + \
+                                "than " + str(self.kmerMaxBytes) + \
+                                " bytes, not using it")
+                        self.monitor.end()
+                        return
+
+                self.kmerIndex = kmerIndex
+                self.monitor.message("K-mer index of " + \
+                        str(kmerIndex.getNumKmers()) + " " + \
+                        str(self.kmerSize) + "-mers uses about " + \
+                        str(kmerIndex.size) + " bytes, built in " + \
+                        str(round(kmerIndex.buildTime, 2)) + " seconds")
+                self.monitor.end(reads=self.getNumReads())
+
+
+        # Yields the nucleotides of each read in readNums, which must be
+        # sorted
+        def iterSeqsAt(self, readNums):
+                if isinstance(self.seqs, (FastqStore, FastqMap)):
+                        for i in readNums:
+                                yield self.seqs.getSeq(i)
+                elif self.seqs != None:
+                        for i in readNums:
+                                yield self.seqs[i][self.SEQ_INDEX]
+                else:
+                        for seq in self.readRecordsAt(readNums):
+                                yield seq[self.SEQ_INDEX]
+
+
+        # Yields each read in readNums, which must be sorted, as
+        # [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE]
+        def iterReadsAt(self, readNums):
+                if self.seqs != None:
+                        for i in readNums:
+                                yield self.withQScore(self.seqs[i])
+                else:
+                        for seq in self.readRecordsAt(readNums):
+                                yield seq
+
+
+        # Returns seq with its average quality score. Reads that are read
+        # in only get theirs when the quality statistics are worked out
+        # (see __getattr__), so until then it is worked out for a copy.
+        def withQScore(self, seq):
+                if len(seq) > self.AVG_QSCORE_INDEX:
+                        return seq
+
+                return seq + [self.readQScore(seq)]
+
+
         # Makes sure all characters in pattern are one 
         # of those listed in valid list in method.
         # Assumes that pattern has already been converted to upper case.
@@ -68,21 +336,406 @@ class FastqKeeper:
         
         # Gets the number of sequences with a quality score at or above
         # the character passed in.
+        #
+        # The cutoff is a whole number, so this is the number of reads
+        # whose average quality score rounds down to at least the cutoff.
+        # That is looked up in a table built from self.qualCounts.
+        @monitored
         def getNumQualSeqs(self, cutoff):
+                self.validateQual(cutoff)
+
+                return self.getQualTable()[ord(cutoff)]
+
+
+        # Gets the number of sequences with a quality score at or above
+        # low and below high, e.g. getNumQualSeqsBetween('5', '?') for
+        # between Q20 and Q30 in Phred+33.
+        @monitored
+        def getNumQualSeqsBetween(self, low, high):
+                self.validateQual(low)
+                self.validateQual(high)
+
+                table = self.getQualTable()
+                return max(table[ord(low)] - table[ord(high)], 0)
+
+
+        # Makes sure cutoff is a one character string
+        def validateQual(self, cutoff):
                 if type(cutoff) != str:
                         raise Exception(self.STRING_EXCEPTION)
 
                 if len(cutoff) != 1:
                         raise Exception(self.CHAR_EXCEPTION)
 
-                count = 0
-                val = ord(cutoff)
 
-                for seq in self.seqs:
-                        if seq[self.AVG_QSCORE_INDEX] >= val:
-                                count += 1
+        # Returns a list where element i is the number of reads with an
+        # average quality score of at least i
+        def getQualTable(self):
+                if self.qualTable == None:
+                        self.qualTable = [0] * (len(self.qualCounts) + 1)
+                        for i in reversed(range(len(self.qualCounts))):
+                                self.qualTable[i] = self.qualTable[i + 1] + \
+                                                self.qualCounts[i]
 
-                return count
+                return self.qualTable
+
+
+        # Yields every read as [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE].
+        # Reads come from memory when they were kept, otherwise the
+        # file is streamed again, up to the reads read in so far if it is
+        # being tailed.
+        def iterReads(self):
+                if self.seqs != None:
+                        for seq in self.seqs:
+                                yield self.withQScore(seq)
+                        return
+
+                for inputFile in self.inputFiles:
+                        for seq in self.iterRecords(inputFile, 0, \
+                                        self.tailOffset):
+                                seq.append(self.readQScore(seq))
+                                yield seq
+
+
+        # Yields the nucleotides of every read
+        def iterSeqs(self):
+                if isinstance(self.seqs, (FastqStore, FastqMap)):
+                        return self.seqs.iterSeqs()
+
+                return (seq[self.SEQ_INDEX] for seq in self.iterReads())
+
+
+        # Yields the average quality score of every read
+        def iterQScores(self):
+                if isinstance(self.seqs, (FastqStore, FastqMap)):
+                        return self.seqs.iterQScores()
+
+                if self.seqs == None:
+                        return iter(self.recordIndex.means)
+
+                return (seq[self.AVG_QSCORE_INDEX] for seq in self.iterReads())
+
+
+        # Reads read i back in from the file using the record index
+        def readRecordAt(self, i):
+                return next(self.readRecordsAt([i]))
+
+
+        # Yields reads readNums, which must be sorted, from the file using
+        # the record index. Each file is opened once and only the lines of
+        # the wanted reads are read.
+        def readRecordsAt(self, readNums):
+                for fileNum, fileReadNums in groupby(readNums, self.fileOf):
+                        inputFile = self.inputFiles[fileNum]
+                        try:
+                                with self.openInput(inputFile) as filer:
+                                        seq = None
+                                        last = None
+                                        for i in fileReadNums:
+                                                # Same read picked again
+                                                if i == last:
+                                                        yield list(seq)
+                                                        continue
+
+                                                filer.seek( \
+                                                        self.recordIndex.getOffset(i))
+                                                seq = [filer.readline().strip() \
+                                                        for k in range( \
+                                                        self.FASTQ_LINES)]
+                                                seq.append( \
+                                                        self.recordIndex.getQScore(i))
+                                                last = i
+                                                yield seq
+                        except IOError:
+                                raise Exception(self.IO_EXCEPTION.format( \
+                                                inputFile))
+
+
+        # Returns the number of the file in self.inputFiles that read i is
+        # in, see fileStarts
+        def fileOf(self, i):
+                return bisect_right(self.fileStarts, i) - 1
+
+
+        # Writes the reads that pass readFilter, a FastqFilter, to
+        # outputFile and returns its report, see fastqFilter. The reads are
+        # streamed from the file again rather than taken from memory, as
+        # that is faster than building them back up into lines, except
+        # from standard input which can only be read once and from
+        # samples of several files.
+        @monitored
+        def writeFiltered(self, outputFile, readFilter, compressLevel=None):
+                if self.inputFile == fastqInput.STDIN or \
+                        len(self.inputFiles) > 1:
+                        fastqFilter.writeReads(self.iterReads(), outputFile, \
+                                        readFilter, compressLevel)
+                        return readFilter.getReport()
+
+                return fastqFilter.filterFile(self.inputFile, outputFile, \
+                                readFilter, compressLevel, self.workers, \
+                                self.tailOffset)
+
+
+        # Returns the files that were read in, in order. That is just the
+        # one file unless a sample was read in, see __init__.
+        def getFiles(self):
+                return list(self.inputFiles)
+
+
+        # Returns an OrderedDict of the FastqStats of each file read in, in
+        # order. Their totals add up to those of the whole sample.
+        def getFileStats(self):
+                if self.fileStats == None:
+                        return OrderedDict([(self.inputFile, self.stats)])
+
+                return self.fileStats
+
+
+        # Works out every statistic that would otherwise wait until it is
+        # first used, see __getattr__
+        def computeStats(self):
+                for name in self.lazyStats.keys():
+                        self.computeStat(name)
+
+
+        # Returns the FastqProfile of the quality scores and nucleotides at
+        # each position of the reads
+        def getProfile(self):
+                self.computeStat("profile")
+                return self.profile
+
+
+        # Returns the number of distinct read sequences, comparing only the
+        # first prefixLength nucleotides of each read if it is given (FastQC
+        # uses 50). With exact=True they are counted with a set, otherwise
+        # estimated with a HyperLogLog with a relative standard error of
+        # error. exact=None counts exactly if there are at most
+        # EXACT_READS reads, see useExact.
+        @monitored
+        def getNumDistinctSeqs(self, prefixLength=None, exact=None, \
+                        error=0.005):
+                if self.useExact(exact):
+                        return len(set(self.iterSeqKeys(prefixLength)))
+
+                sketch = HyperLogLog(error)
+                for key in self.iterSeqKeys(prefixLength):
+                        sketch.add(hashItem(key))
+
+                return min(sketch.estimate(), self.getNumReads())
+
+
+        # Returns the percentage of reads that are a duplicate of another
+        # read to 2 decimal places, see getNumDistinctSeqs
+        def getDuplicationRate(self, prefixLength=None, exact=None, \
+                        error=0.005):
+                distinct = self.getNumDistinctSeqs(prefixLength, exact, error)
+                return round(100 - 100.0 * distinct / self.getNumReads(), 2)
+
+
+        # Returns the n most common read sequences, cut to prefixLength if
+        # it is given, as a list of (sequence, number of reads, percentage
+        # of reads) from most to least common. With exact=False they are
+        # found with a SpaceSaving sketch instead of counting every
+        # sequence, and counts are over by at most error times the number
+        # of reads. Sequences seen only once, or with a sketch no more
+        # often than that, are left out. exact=None is as in
+        # getNumDistinctSeqs.
+        @monitored
+        def getOverrepresentedSeqs(self, n=10, prefixLength=None, \
+                        exact=None, error=0.001):
+                if self.useExact(exact):
+                        top = [(key, count) for key, count in \
+                                        Counter(self.iterSeqKeys( \
+                                        prefixLength)).most_common(n) \
+                                        if count > 1]
+                else:
+                        sketch = SpaceSaving(error)
+                        for key in self.iterSeqKeys(prefixLength):
+                                sketch.add(key)
+                        top = [(key, count) for key, count, over in \
+                                        sketch.getTop(n)]
+
+                return [(key, count, round(100.0 * count / \
+                                self.getNumReads(), 2)) for key, count in top]
+
+
+        # Returns the k-mer spectrum of the reads: a list of (abundance,
+        # number of distinct k-mers seen that many times) in order of
+        # abundance. Only k-mers of A, C, G and T count, and k can be at
+        # most 32.
+        #
+        # With exact=False the number of times each k-mer is seen is
+        # estimated with a CountMinSketch of maxBytes (SKETCH_BYTES by
+        # default), over by at most about e times the number of k-mers
+        # divided by the number of counters per row, with probability
+        # 1 - delta. It needs a counter per row for every distinct k-mer
+        # to be close to exact. The reads are
+        # read twice, once to fill the sketch and once to look up every
+        # k-mer seen. A k-mer estimated to be seen c times counts as 1 / c
+        # of a k-mer each time it is seen, which adds up to one k-mer.
+        # exact=None is as in getNumDistinctSeqs.
+        @monitored
+        def getKmerSpectrum(self, k=21, exact=None, maxBytes=None, \
+                        delta=0.05):
+                if k < 1 or k > 32:
+                        raise Exception(self.KMER_EXCEPTION.format(k))
+
+                if self.useExact(exact):
+                        codes = fastqKernels.concatenate(self.iterKmerCodes(k))
+                        counts = fastqKernels.valueCounts(codes)[1]
+                        return zip(*fastqKernels.valueCounts(counts))
+
+                if maxBytes == None:
+                        maxBytes = self.SKETCH_BYTES
+
+                sketch = CountMinSketch(delta=delta, maxBytes=maxBytes)
+                for codes in self.iterKmerCodes(k):
+                        sketch.addMany(hashMany(codes))
+
+                sightings = Counter()
+                for codes in self.iterKmerCodes(k):
+                        estimates = sketch.estimateMany(hashMany(codes))
+                        sightings.update(dict(zip( \
+                                *fastqKernels.valueCounts(estimates))))
+
+                spectrum = Counter()
+                for count, seen in sightings.items():
+                        spectrum[int(count)] += int(round(float(seen) / count))
+
+                return sorted([(count, kmers) for count, kmers in \
+                                spectrum.items() if kmers > 0])
+
+
+        # Returns whether to count exactly given exact, which is True,
+        # False or None to count exactly only if there are at most
+        # EXACT_READS reads
+        def useExact(self, exact):
+                if exact == None:
+                        return self.getNumReads() <= self.EXACT_READS
+
+                return exact
+
+
+        # Yields the nucleotides of every read, cut to prefixLength unless
+        # it is None
+        def iterSeqKeys(self, prefixLength=None):
+                if prefixLength == None:
+                        return self.iterSeqs()
+
+                return (nucs[:prefixLength] for nucs in self.iterSeqs())
+
+
+        # Yields the codes of the k-mers in each batch of reads, see
+        # fastqKernels.kmerCodes
+        def iterKmerCodes(self, k):
+                batch = []
+                for nucs in self.iterSeqs():
+                        batch.append(nucs)
+                        if len(batch) == self.BATCH_READS:
+                                yield self.batchKmerCodes(batch, k)
+                                batch = []
+
+                if len(batch) > 0:
+                        yield self.batchKmerCodes(batch, k)
+
+
+        # Returns the codes of the k-mers in the nucleotides in batch
+        def batchKmerCodes(self, batch, k):
+                offsets = [0]
+                for nucs in batch:
+                        offsets.append(offsets[-1] + len(nucs))
+
+                return fastqKernels.kmerCodes("".join(batch), offsets, k)
+
+
+        # Returns the number of bytes the columnar read store, or the line
+        # offsets of a memory-mapped file, take up, or None if reads are
+        # not kept in either.
+        def getMemoryFootprint(self):
+                if isinstance(self.seqs, (FastqStore, FastqMap)):
+                        return self.seqs.memoryFootprint()
+
+                return None
+
+
+        # Returns an estimate of the bytes of memory taken up by the reads,
+        # record index and k-mer index, whichever are kept. A list of reads
+        # is estimated as READ_BYTES per read plus its characters.
+        def estimateMemory(self):
+                total = self.getMemoryFootprint()
+                if total == None:
+                        total = 0
+
+                if self.seqs != None and total == 0:
+                        if self.stats != None:
+                                chars = self.stats.chars
+                        else:
+                                chars = sum([len(seq[self.ID_INDEX]) + \
+                                        len(seq[self.SEQ_INDEX]) + \
+                                        len(seq[self.STRAND_INDEX]) + \
+                                        len(seq[self.QSCORE_INDEX]) \
+                                        for seq in self.seqs])
+                        total = self.numReads * self.READ_BYTES + chars
+
+                if self.recordIndex != None:
+                        for column in [self.recordIndex.offsets, \
+                                        self.recordIndex.means]:
+                                total += getattr(column, "itemsize", 8) * \
+                                                len(column)
+
+                if self.kmerIndex != None:
+                        total += self.kmerIndex.size
+
+                return total
+
+
+        # Reads in the reads that have been appended to the file since it
+        # was last read in and adds them to the statistics. Only files
+        # opened with tail=True can be refreshed, see __init__. Returns
+        # the number of new reads.
+        #
+        # The cache, if there is one, is brought up to date too.
+        def refresh(self):
+                if not self.tail:
+                        raise Exception(self.TAIL_EXCEPTION.format( \
+                                        self.inputFile))
+
+                size = self.getInputSize(self.inputFile)
+                if size == None or size < self.tailOffset:
+                        raise Exception(self.SHRUNK_EXCEPTION.format( \
+                                        self.inputFile))
+
+                self.monitor.begin("refresh", "Reading in new sequences....", \
+                                size - self.tailOffset)
+                if self.recordIndex != None:
+                        self.recordIndex = self.recordIndex.toArrays()
+
+                (stats, seqs, recordIndex) = self.ingestRange(self.inputFile, \
+                                self.tailOffset, None, self.seqs != None, \
+                                isinstance(self.seqs, FastqStore), \
+                                self.recordIndex != None, True)
+
+                if stats.numReads > 0:
+                        if seqs != None:
+                                self.seqs.extend(seqs)
+                        if recordIndex != None:
+                                self.recordIndex.extend(recordIndex)
+                        self.applyStats(self.stats.merge(stats))
+
+                        # Rebuilt with the new reads when next needed
+                        self.qualTable = None
+                        if self.kmerIndex != None:
+                                self.kmerIndex = None
+                                self.kmerMode = "lazy"
+
+                        if self.cache:
+                                self.saveCache(self.inputFile, self.cacheDir)
+
+                self.monitor.message(str(stats.numReads) + " new reads")
+                self.monitor.end(self.readPosition(stats.chars), \
+                                stats.numReads)
+
+                return stats.numReads
                 
         ################ Private Methods ################
         # INITIALIZER
@@ -94,17 +747,239 @@ class FastqKeeper:
         # all of the important functions during each line of read in
         # would be faster. Here speed is sacrificed for clarity of 
         # code deliberately.
-        def __init__(self, inputFile):
-                print "Initializing FastqKeeper:"
+        #
+        # Passing streaming=True uses that faster approach instead: see
+        # ingest(). With keepReads=False the reads are not held in
+        # memory at all. Their offsets are kept in a FastqRecordIndex
+        # instead, and queries stream the file again. With
+        # columnar=True reads are kept in a compact FastqStore rather
+        # than a list of lists, which also implies streaming, and
+        # columnar=PACKED ("packed") keeps their nucleotides two bits each
+        # as well, see fastqPacked. With more
+        # than one worker the file is read in by that many processes.
+        # Compressed files can't be split up, so for them the workers only
+        # decompress (BGZF files only, see fastqInput).
+        #
+        # With mapped=True an uncompressed file is read through a memory
+        # map instead, see ingestMapped, and workers is ignored. Lines are
+        # then only stripped of their line endings, not of other
+        # whitespace. Standard input, compressed files and files that mix
+        # line endings are read in as if mapped were False.
+        #
+        # tail=True is for files that are still being written. A final read
+        # that isn't completely written yet (no line break after its
+        # quality scores) is left out, and refresh reads in the reads
+        # written since. With cache=True the cache remembers how far the
+        # file had got, so opening it again only reads the reads added
+        # since it was cached. The file is always read in with ingest, and
+        # standard input and compressed files can't be tailed.
+        #
+        # With cache=True the results are saved to a cache file (next to
+        # inputFile unless cacheDir is given, see fastqCache). If a cache
+        # for the same file contents already exists, the file is not read
+        # in at all, and queries use the cache and stream the file.
+        #
+        # kmerIndex="eager" builds a KmerIndex of kmerSize-mers after the
+        # reads are read in to speed up getNumMatches, and "lazy" builds
+        # it on the first call instead. kmerMaxBytes caps its memory use.
+        #
+        # With readahead, a number of bytes, files read through from start
+        # to end (or a worker's chunk of one) are read that many bytes at
+        # a time by a background thread while the reads before are parsed,
+        # see fastqInput, and how long parsing waited for the file is
+        # reported. Mapped files and reads looked up by offset aren't read
+        # ahead.
+        #
+        # inputFile can also be a list of files that make up one sample,
+        # e.g. the lanes of a run, or a list of (R1, R2) tuples of paired-end
+        # files. Each file, or pair, is read in by its own process and the
+        # totals are merged for the whole sample, with those of each file
+        # kept as well, see getFileStats. The two files of a pair are read
+        # in step and each read must have the same ID as its mate, see
+        # ingestPair. Reads are kept in file order, R1 before R2. A sample
+        # is never cached, tailed or mapped, and workers is ignored.
+        #
+        # Progress messages and the timings of each phase and query go to
+        # monitor, see fastqMonitor. The default prints the messages;
+        # a NullMonitor turns them off.
+        def __init__(self, inputFile, streaming=False, keepReads=True, \
+                        columnar=False, workers=1, cache=False, cacheDir=None, \
+                        kmerIndex=None, kmerSize=8, kmerMaxBytes=None, \
+                        monitor=None, mapped=False, tail=False, readahead=None):
+                if monitor == None:
+                        monitor = PrintMonitor()
+                self.monitor = monitor
+
+                self.monitor.message("Initializing FastqKeeper:")
                 self.initConstants()
-                self.seqs = self.readIn(inputFile)
-                self.verifyReads()
-                self.numReads = len(self.seqs)
-                self.countNucs()
-                self.assignQScores()
-                self.avgLenQScore()
-                print "done."
-                print
+
+                # Standard input can only be read once
+                if inputFile == fastqInput.STDIN:
+                        keepReads = True
+                        cache = False
+                        tail = False
+                elif isinstance(inputFile, list):
+                        cache = False
+                        tail = False
+                        mapped = False
+                elif tail and self.isCompressed(inputFile):
+                        tail = False
+
+                self.inputFile = inputFile
+                self.pairs = None
+                self.inputFiles = self.checkFiles(inputFile)
+                self.fileStats = None
+                self.fileStarts = [0]
+                self.tail = tail
+                self.tailOffset = None
+                self.cache = cache
+                self.cacheDir = cacheDir
+                self.workers = workers
+                self.readahead = readahead
+                self.inputStats = fastqInput.InputStats()
+                self.stats = None
+                self.recordIndex = None
+                self.qualTable = None
+                self.profile = None
+
+                # Statistics not worked out yet, see __getattr__
+                self.lazyStats = {}
+
+                # Not built until it is needed
+                self.kmerIndex = None
+                self.kmerMode = kmerIndex
+                self.kmerSize = kmerSize
+                self.kmerMaxBytes = kmerMaxBytes
+
+                if not cache or not self.loadCache(inputFile, cacheDir):
+                        # Reads left out of memory are found by offset
+                        self.load(inputFile, streaming, keepReads, columnar, \
+                                        workers, cache or not keepReads, mapped, \
+                                        tail)
+
+                        if cache:
+                                self.saveCache(inputFile, cacheDir)
+
+                if kmerIndex == "eager":
+                        self.buildKmerIndex()
+                self.monitor.message("done.")
+                self.monitor.message()
+
+
+        # Reads in inputFile and sets the statistics for it, see __init__
+        def load(self, inputFile, streaming, keepReads, columnar, workers, \
+                        indexed, mapped=False, tail=False):
+                if isinstance(inputFile, list):
+                        self.ingestSample(inputFile, keepReads, columnar, \
+                                        indexed)
+                        return
+
+                if tail:
+                        self.ingest(inputFile, keepReads, columnar, indexed, \
+                                        True)
+                        return
+
+                fileMap = None
+                if mapped and inputFile != fastqInput.STDIN and \
+                        not self.isCompressed(inputFile):
+                        fileMap = self.mapInput(inputFile)
+
+                if fileMap != None:
+                        self.ingestMapped(fileMap, keepReads, indexed)
+                elif workers > 1 and inputFile != fastqInput.STDIN and \
+                        not self.isCompressed(inputFile):
+                        self.ingestParallel(inputFile, workers, keepReads, \
+                                        columnar, indexed)
+                elif streaming or not keepReads or columnar or indexed:
+                        self.ingest(inputFile, keepReads, columnar, indexed)
+                else:
+                        # verifyReads checks the nucleotides as well, so a
+                        # bad file fails here as it does on the other
+                        # paths. The statistics take a pass over the reads
+                        # each, so they wait until they are used.
+                        self.seqs = self.readIn(inputFile)
+                        self.verifyReads()
+                        self.numReads = len(self.seqs)
+                        for method, names in self.LAZY_STATS:
+                                self.deferStats(method, names)
+
+
+        # Sets the statistics and record index from the cache for
+        # inputFile. Returns False if there is no usable cache.
+        def loadCache(self, inputFile, cacheDir):
+                self.monitor.begin("loadCache")
+                try:
+                        cached = fastqCache.load(inputFile, cacheDir, self.tail)
+                except (IOError, OSError):
+                        raise Exception(self.IO_EXCEPTION.format(inputFile))
+
+                # Caches of whole files don't say where a tail would start
+                if cached == None or (self.tail and cached[2] == None):
+                        self.monitor.end()
+                        return False
+
+                self.monitor.message("Loading cached statistics....")
+                (stats, self.recordIndex, self.tailOffset) = cached
+                self.seqs = None
+                self.applyStats(stats)
+                self.monitor.end(reads=self.numReads)
+
+                if self.tail and self.tailOffset < \
+                        self.getInputSize(inputFile):
+                        self.refresh()
+
+                return True
+
+
+        # Writes the statistics and record index to the cache for inputFile
+        def saveCache(self, inputFile, cacheDir):
+                self.monitor.begin("saveCache", "Writing cache....")
+                if not fastqCache.save(inputFile, self.stats, \
+                                self.recordIndex, cacheDir, self.tailOffset):
+                        self.monitor.message("Could not write cache for " + \
+                                        inputFile)
+                self.monitor.end(reads=self.numReads)
+
+
+        # Statistics in self.lazyStats aren't attributes until they are
+        # first used, which lands here. The method that works one out
+        # works out the rest of its group from the same pass over the
+        # reads, and sets them all as attributes, so it only runs once.
+        def __getattr__(self, name):
+                lazyStats = self.__dict__.get("lazyStats")
+                if lazyStats == None or name not in lazyStats:
+                        raise AttributeError(name)
+
+                self.computeStat(name)
+                return self.__dict__[name]
+
+
+        # Leaves the statistics in names to be worked out by method, see
+        # __getattr__
+        def deferStats(self, method, names):
+                for name in names:
+                        self.lazyStats[name] = method
+
+
+        # Works out the statistic name and the rest of its group now if
+        # they haven't been yet
+        def computeStat(self, name):
+                method = self.lazyStats.get(name)
+                if method == None:
+                        return
+
+                getattr(self, method)()
+                for other, otherMethod in self.lazyStats.items():
+                        if otherMethod == method:
+                                del self.lazyStats[other]
+
+
+        # Copies of the keeper sent to worker processes don't report to
+        # the monitor, which may hold open files
+        def __getstate__(self):
+                state = self.__dict__.copy()
+                state["monitor"] = NullMonitor()
+                return state
 
 
         # Sets constants that will be used by this class
@@ -119,6 +994,32 @@ class FastqKeeper:
                 # Number of lines per read in fastq file
                 self.FASTQ_LINES = 4
 
+                # Statistics that read in reads work out on first use,
+                # with the method that works out each group of them in one
+                # pass, see __getattr__. The profile is made from the
+                # per-position counts of both of the first two groups.
+                self.LAZY_STATS = [
+                        ("countNucs", ["A", "C", "G", "T", "N", "total", \
+                                "GC", "AT", "posNucCounts"]),
+                        ("countQScores", ["avgLen", "avgQScore", "plus", \
+                                "minus", "qualCounts", "posQualCounts"]),
+                        ("makeProfile", ["profile"])]
+
+                # Number of reads handed to fastqKernels at once
+                self.BATCH_READS = 10000
+
+                # Files with at most this many reads are counted exactly
+                # rather than with sketches, see useExact
+                self.EXACT_READS = 100000
+
+                # Default size of the k-mer counting sketch
+                self.SKETCH_BYTES = 64 * 1024 * 1024
+
+                # Bytes taken up by a read in a list of reads, not counting
+                # its characters: the list, four strings and a float
+                self.READ_BYTES = sys.getsizeof([None] * 5) + \
+                                4 * sys.getsizeof("") + sys.getsizeof(0.0)
+
                 # Exceptions
                 self.IO_EXCEPTION = "Can't find file \"{}\""
                 self.NUC_EXCEPTION = "Unknown nucleotide \"{}\""
@@ -129,6 +1030,29 @@ class FastqKeeper:
                 self.CHAR_EXCEPTION = "Quality score chars must only be" + \
                                 " one character long"
                 self.STRING_EXCEPTION = "Expected string"
+                self.TRUNCATED_EXCEPTION = "Read ID {} is missing lines"
+                self.SAMPLE_EXCEPTION = "Can't choose {} reads out of {}"
+                self.ERRORS_EXCEPTION = "Number of errors {} must be a" + \
+                                " whole number of at least 0"
+                self.KMER_EXCEPTION = "K-mer length {} must be between 1" + \
+                                " and 32"
+                self.TAIL_EXCEPTION = "File \"{}\" wasn't opened to be" + \
+                                " refreshed"
+                self.SHRUNK_EXCEPTION = "File \"{}\" is shorter than when" + \
+                                " it was last read"
+                self.MATE_EXCEPTION = "Read ID {} in \"{}\" doesn't match" + \
+                                " its mate {} in \"{}\""
+                self.MATES_EXCEPTION = "File \"{}\" has more reads than" + \
+                                " its mate \"{}\""
+                self.PAIR_EXCEPTION = "Paired-end files {} must be an" + \
+                                " (R1, R2) tuple"
+                self.EMPTY_SAMPLE_EXCEPTION = "A sample needs at least one file"
+                self.MIXED_SAMPLE_EXCEPTION = "A sample must be all single" + \
+                                " files or all (R1, R2) tuples"
+                self.STDIN_SAMPLE_EXCEPTION = "Standard input can't be part" + \
+                                " of a sample"
+                self.REPEAT_EXCEPTION = "File \"{}\" is in the sample more" + \
+                                " than once"
                  
                 
 
@@ -140,14 +1064,19 @@ class FastqKeeper:
         # Undefined behavior with functions of different file
         # types.
         def readIn(self, inputFile):
-                print "Reading in Sequences...."
+                self.monitor.begin("readIn", "Reading in Sequences....", \
+                                self.getInputSize(inputFile))
+                start = time.time()
                 seqs = []
                 newSeq = None
                 count = 0
+                size = 0
+                batch = self.BATCH_READS
 
                 try:
-                        with open(inputFile, 'r') as filer:
+                        with self.openInput(inputFile, 0) as filer:
                                 for line in filer:
+                                        size += len(line)
                                         line = line.strip()
 
                                         # found a new read
@@ -155,6 +1084,9 @@ class FastqKeeper:
                                                 count == self.FASTQ_LINES:
                                                 if newSeq != None:
                                                         seqs.append(newSeq)
+                                                if len(seqs) % batch == 0:
+                                                        self.reportProgress( \
+                                                                size, len(seqs))
 
                                                 newSeq = [line]
 
@@ -169,58 +1101,749 @@ class FastqKeeper:
                 except IOError:
                         raise Exception(self.IO_EXCEPTION.format(inputFile))
 
+                self.reportProgress(size, len(seqs))
+                self.reportReadahead(time.time() - start)
+                self.monitor.end()
                 return seqs
 
+        # Yields each read in inputFile as [ID, SEQ, STRAND-SENSE, QSCORE]
+        # without holding the rest of the file in memory.
+        #
+        # A final read with fewer than four lines is yielded as is, unless
+        # it is only blank lines at the end of the file.
+        #
+        # start and end limit this to the reads that begin at byte offsets
+        # in [start, end). start must be the beginning of a read. The
+        # offset of each read is appended to offsets if it is passed in.
+        #
+        # With complete=True a final read that is missing lines, or whose
+        # last line has no line break yet, is left out instead, and the
+        # offset just past the last read yielded is kept in
+        # self.tailOffset.
+        def iterRecords(self, inputFile, start=0, end=None, offsets=None, \
+                        complete=False):
+                lines = []
+
+                try:
+                        with self.openInput(inputFile, start, end) as filer:
+                                filer.seek(start)
+                                pos = start
+                                readline = filer.readline
+                                while end == None or pos < end:
+                                        lines = [readline(), readline(), \
+                                                readline(), readline()]
+
+                                        # End of file, or of what has
+                                        # been written of it so far
+                                        if lines[-1] == "" or (complete and \
+                                                not lines[-1].endswith("\n")):
+                                                break
+
+                                        if offsets != None:
+                                                offsets.append(pos)
+
+                                        pos += len(lines[0]) + len(lines[1]) + \
+                                                len(lines[2]) + len(lines[3])
+
+                                        yield [lines[0].strip(), \
+                                                lines[1].strip(), \
+                                                lines[2].strip(), \
+                                                lines[3].strip()]
+                                        lines = []
+                except IOError:
+                        raise Exception(self.IO_EXCEPTION.format(inputFile))
+
+                if complete:
+                        self.tailOffset = pos
+                        return
+
+                newSeq = [line.strip() for line in lines if line != ""]
+                if "".join(newSeq) != "":
+                        yield newSeq
+
+
+        # Opens inputFile for reading, decompressing it if need be. If it
+        # is going to be read through from offset start, to about end if
+        # that is given, it is read ahead with readahead, see __init__.
+        def openInput(self, inputFile, start=None, end=None):
+                if start == None or self.readahead == None:
+                        return fastqInput.openFastq(inputFile, self.workers, \
+                                        self.inputStats)
+
+                return fastqInput.openFastq(inputFile, self.workers, \
+                                self.inputStats, self.readahead, start, end)
+
+
+        # Returns the size of inputFile in bytes, or None if it isn't known
+        def getInputSize(self, inputFile):
+                if inputFile == fastqInput.STDIN:
+                        return None
+
+                try:
+                        return os.path.getsize(inputFile)
+                except OSError:
+                        return None
+
+
+        # Tells the monitor that reading in has got position bytes into
+        # the file and read in reads reads, see readPosition
+        def reportProgress(self, position, reads):
+                self.monitor.progress(self.readPosition(position), reads)
+
+
+        # Returns how far into the file reading in has got, given that it
+        # has got position bytes into the text. For compressed files that
+        # is in the decompressed text, so how much of the compressed file
+        # has been read is returned instead.
+        def readPosition(self, position):
+                if self.inputStats.compressedBytes > 0:
+                        return self.inputStats.compressedBytes
+                return position
+
+
+        # Returns True if inputFile is compressed
+        def isCompressed(self, inputFile):
+                try:
+                        return fastqInput.isCompressed(inputFile)
+                except IOError:
+                        raise Exception(self.IO_EXCEPTION.format(inputFile))
+
+
+        # Reports how fast the file was decompressed and parsed, given the
+        # total time spent reading it in by processes processes at once
+        def reportThroughput(self, elapsed, processes=1):
+                megabytes = 1024.0 * 1024.0
+                decompressTime = self.inputStats.decompressTime
+
+                if self.inputStats.decompressedBytes > 0:
+                        size = self.inputStats.decompressedBytes / megabytes
+                        self.monitor.message("Decompressed " + \
+                                str(round(size, 2)) + " MB in " + \
+                                str(round(decompressTime, 2)) + " seconds (" + \
+                                str(round(size / max(decompressTime, 1e-6), \
+                                2)) + " MB/s)")
+
+                size = self.stats.chars / megabytes
+                parseTime = elapsed - self.inputStats.waitTime / processes
+                self.monitor.message("Parsed " + str(round(size, 2)) + \
+                        " MB in " + str(round(parseTime, 2)) + " seconds (" + \
+                        str(round(size / max(parseTime, 1e-6), 2)) + " MB/s)")
+                self.reportReadahead(elapsed, processes)
+
+
+        # Reports how long the file took to read ahead in the background,
+        # how long parsing waited for it and which of reading and parsing
+        # is the bottleneck, given the time spent reading it in by
+        # processes processes at once
+        def reportReadahead(self, elapsed, processes=1):
+                if self.readahead == None or (self.inputStats.readBytes == 0 \
+                                and self.inputStats.decompressedBytes == 0):
+                        return
+
+                megabytes = 1024.0 * 1024.0
+                if self.inputStats.readBytes > 0:
+                        size = self.inputStats.readBytes / megabytes
+                        readTime = self.inputStats.readTime
+                        self.monitor.message("Read ahead " + \
+                                str(round(size, 2)) + " MB in " + \
+                                str(round(readTime, 2)) + " seconds (" + \
+                                str(round(size / max(readTime, 1e-6), 2)) + \
+                                " MB/s)")
+
+                # Decompressing is part of reading ahead, not of parsing
+                readTime = (self.inputStats.readTime + \
+                                self.inputStats.decompressTime) / processes
+                waitTime = self.inputStats.waitTime / processes
+                parseTime = elapsed - waitTime
+
+                bottleneck = "parsing"
+                if readTime > parseTime:
+                        bottleneck = "reading the file"
+                self.monitor.message("Reading took " + \
+                        str(round(readTime, 2)) + " seconds and parsing " + \
+                        str(round(parseTime, 2)) + " seconds, waiting " + \
+                        str(round(waitTime, 2)) + " seconds for input, so " + \
+                        bottleneck + " is the bottleneck")
+
+
+        # Same as ingest, but the file is split into one chunk per worker
+        # and the chunks are read in and counted by a pool of processes.
+        # See fastqParallel.
+        def ingestParallel(self, inputFile, workers, keepReads=True, \
+                        columnar=False, indexed=False):
+                self.monitor.begin("ingestParallel", "Reading in and " + \
+                                "counting sequences with " + str(workers) + \
+                                " workers....", self.getInputSize(inputFile))
+                start = time.time()
+                chunks = fastqParallel.findChunks(self, inputFile, workers)
+
+                (stats, seqs, recordIndex) = fastqParallel.parseChunks(self, \
+                                inputFile, chunks, keepReads, columnar, indexed)
+
+                self.seqs = seqs
+                self.recordIndex = recordIndex
+                self.applyStats(stats)
+                self.reportThroughput(time.time() - start, len(chunks))
+
+                if columnar and keepReads:
+                        self.monitor.message("Read store uses " + \
+                                str(self.getMemoryFootprint()) + " bytes")
+                self.monitor.end(self.readPosition(stats.chars), \
+                                self.numReads)
+
+
+        # Same as ingestParallel for a sample of several files, see
+        # __init__. Each file, or pair of files, is read in by its own
+        # process. The totals of each file are kept in self.fileStats and
+        # merged into those of the sample, and the number of the first read
+        # of each file in self.fileStarts.
+        def ingestSample(self, inputFiles, keepReads=True, columnar=False, \
+                        indexed=False):
+                sizes = [self.getInputSize(inputFile) for inputFile in \
+                                self.inputFiles]
+                self.monitor.begin("ingestSample", "Reading in and " + \
+                                "counting sequences from " + \
+                                str(len(self.inputFiles)) + " files....", \
+                                sum([size or 0 for size in sizes]))
+                start = time.time()
+                results = fastqParallel.parseFiles(self, inputFiles, \
+                                keepReads, columnar, indexed)
+
+                (stats, seqs, recordIndex) = self.newRange(keepReads, \
+                                columnar, indexed)
+                self.fileStats = OrderedDict()
+                self.fileStarts = []
+                for inputFile, (fileStats, fileSeqs, fileIndex) in \
+                                zip(self.inputFiles, results):
+                        self.fileStats[inputFile] = fileStats
+                        self.fileStarts.append(stats.numReads)
+                        stats.merge(fileStats)
+
+                        if keepReads:
+                                seqs.extend(fileSeqs)
+                        if indexed:
+                                recordIndex.extend(fileIndex)
+
+                self.seqs = seqs
+                self.recordIndex = recordIndex
+                self.applyStats(stats)
+                self.reportThroughput(time.time() - start, len(inputFiles))
+                self.monitor.end(self.readPosition(stats.chars), \
+                                self.numReads)
+
+
+        # Single pass alternative to readIn through avgLenQScore. Every
+        # read is verified as soon as it is read in and counted along with
+        # the rest of its batch. The totals are collected in a FastqStats.
+        #
+        # With indexed=True the offset and average quality score of each
+        # read are kept in a FastqRecordIndex as well. complete is passed
+        # on to iterRecords.
+        def ingest(self, inputFile, keepReads=True, columnar=False, \
+                        indexed=False, complete=False):
+                self.monitor.begin("ingest", "Reading in and counting " + \
+                                "sequences in one pass....", \
+                                self.getInputSize(inputFile))
+                start = time.time()
+                (stats, seqs, recordIndex) = self.ingestRange(inputFile, 0, \
+                                None, keepReads, columnar, indexed, complete)
+
+                self.seqs = seqs
+                self.recordIndex = recordIndex
+                self.applyStats(stats)
+                self.reportThroughput(time.time() - start)
+
+                if columnar and keepReads:
+                        self.monitor.message("Read store uses " + \
+                                str(self.getMemoryFootprint()) + " bytes")
+                self.monitor.end(self.readPosition(stats.chars), \
+                                self.numReads)
+
+
+        # Returns a FastqMap of inputFile, or None if it can't be mapped
+        def mapInput(self, inputFile):
+                try:
+                        return fastqMap.mapFile(inputFile)
+                except (IOError, OSError):
+                        raise Exception(self.IO_EXCEPTION.format(inputFile))
+
+
+        # Same as ingest, but the reads are never copied out of fileMap
+        # one by one. The lines of a batch of reads are sliced straight out
+        # of the map and joined for fastqKernels, and the line lengths give
+        # the rest of the totals. Reads are verified a batch at a time, in
+        # the same order as ingest verifies them.
+        #
+        # With keepReads=True fileMap takes the place of the list of
+        # reads, otherwise it is closed once the reads are counted.
+        def ingestMapped(self, fileMap, keepReads=True, indexed=False):
+                self.monitor.begin("ingestMapped", "Reading in and " + \
+                                "counting memory-mapped sequences....", \
+                                len(fileMap.buf))
+                start = time.time()
+                stats = FastqStats()
+                numReads = fileMap.getNumRecords()
+
+                for first in xrange(0, numReads, self.BATCH_READS):
+                        last = min(first + self.BATCH_READS, numReads)
+                        self.ingestMappedBatch(fileMap, first, last, stats)
+                        self.monitor.progress(fileMap.starts[last * \
+                                        self.FASTQ_LINES], stats.numReads)
+
+                self.checkMappedEnd(fileMap)
+
+                self.recordIndex = None
+                if indexed:
+                        self.recordIndex = FastqRecordIndex( \
+                                        fileMap.getReadOffsets(), fileMap.means)
+
+                self.seqs = None
+                if keepReads:
+                        self.seqs = fileMap
+                else:
+                        fileMap.close()
+
+                self.applyStats(stats)
+                self.reportThroughput(time.time() - start)
+
+                if keepReads:
+                        self.monitor.message("Line offsets use " + \
+                                str(self.getMemoryFootprint()) + " bytes")
+                self.monitor.end(reads=self.numReads)
+
+
+        # Verifies and counts reads first up to but not including last of
+        # fileMap, adding them to stats and their average quality scores
+        # to fileMap.means
+        def ingestMappedBatch(self, fileMap, first, last, stats):
+                seqLengths = fileMap.getLineLengths(first, last, \
+                                self.SEQ_INDEX)
+                qualLengths = fileMap.getLineLengths(first, last, \
+                                self.QSCORE_INDEX)
+                strands = fileMap.gatherLines(first, last, \
+                                self.STRAND_INDEX)[0]
+                plus = strands.count('+')
+                numReads = last - first
+
+                # Find the read at fault the same way ingest would
+                if seqLengths != qualLengths or len(strands) != numReads or \
+                        plus + strands.count('-') != numReads:
+                        for i in xrange(first, last):
+                                self.verifyRead(fileMap.getRecord(i))
+
+                (nucs, offsets) = fileMap.gatherLines(first, last, \
+                                self.SEQ_INDEX)
+                (quals, offsets) = fileMap.gatherLines(first, last, \
+                                self.QSCORE_INDEX)
+
+                stats.numReads += numReads
+                stats.length += len(nucs)
+                stats.plus += plus
+
+                # Every line without its line ending, plus a line break each
+                lineEnds = self.FASTQ_LINES * numReads
+                stats.chars += int(fileMap.starts[last * self.FASTQ_LINES] - \
+                                fileMap.starts[first * self.FASTQ_LINES] - \
+                                lineEnds * (fileMap.newline - 1))
+
+                self.addNucs(nucs, stats)
+                self.addNucPositions(nucs, offsets, stats)
+                self.addQualPositions(quals, offsets, stats)
+
+                for qScore in fastqKernels.qualityMeans(quals, offsets):
+                        stats.addScore(qScore)
+                        stats.qualCounts[int(qScore)] += 1
+                        fileMap.means.append(qScore)
+
+
+        # Raises an exception if the lines at the end of fileMap that
+        # don't make up a whole read are anything but blank
+        def checkMappedEnd(self, fileMap):
+                lines = [fileMap.getLine(k).strip() for k in \
+                        xrange(fileMap.getNumRecords() * self.FASTQ_LINES, \
+                                fileMap.getNumLines())]
+
+                if "".join(lines) != "":
+                        raise Exception(self.TRUNCATED_EXCEPTION.\
+                                format(lines[0]))
+
+
+        # Reads in and counts the reads that begin in [start, end) of
+        # inputFile. Returns a tuple of a FastqStats of their totals, the
+        # reads themselves and a FastqRecordIndex of them. The reads are
+        # None if keepReads is False and the index is None unless indexed
+        # is True. complete is passed on to iterRecords.
+        def ingestRange(self, inputFile, start, end, keepReads, columnar, \
+                        indexed=False, complete=False):
+                (stats, seqs, recordIndex) = self.newRange(keepReads, \
+                                columnar, indexed)
+
+                offsets = None
+                means = None
+                if indexed:
+                        offsets = recordIndex.offsets
+                        means = recordIndex.means
+
+                batch = []
+                for seq in self.iterRecords(inputFile, start, end, offsets, \
+                                complete):
+                        self.ingestRead(seq, stats)
+                        batch.append(seq)
+
+                        if len(batch) == self.BATCH_READS:
+                                self.ingestBatch(batch, stats, seqs, means)
+                                batch = []
+                                self.reportProgress(stats.chars, \
+                                                stats.numReads)
+
+                self.ingestBatch(batch, stats, seqs, means)
+
+                return (stats, seqs, recordIndex)
+
+
+        # Returns an empty FastqStats, reads and FastqRecordIndex for
+        # ingestRange to fill in
+        def newRange(self, keepReads, columnar, indexed):
+                seqs = None
+                if keepReads and columnar:
+                        seqs = FastqStore(columnar == PACKED)
+                elif keepReads:
+                        seqs = []
+
+                recordIndex = None
+                if indexed:
+                        recordIndex = FastqRecordIndex()
+
+                return (FastqStats(), seqs, recordIndex)
+
+
+        # Same as ingestRange for the whole of two paired-end files. They
+        # are read in step, a read from each at a time, so that neither
+        # has to be held in memory to check that each read has the same ID
+        # as its mate, see checkMates. Returns a list of the results for
+        # each file.
+        def ingestPair(self, inputFile1, inputFile2, keepReads, columnar, \
+                        indexed=False):
+                mates = [self.newRange(keepReads, columnar, indexed), \
+                                self.newRange(keepReads, columnar, indexed)]
+
+                records = []
+                means = []
+                for inputFile, (stats, seqs, recordIndex) in \
+                                zip([inputFile1, inputFile2], mates):
+                        offsets = None
+                        means.append(None)
+                        if indexed:
+                                offsets = recordIndex.offsets
+                                means[-1] = recordIndex.means
+                        records.append(self.iterRecords(inputFile, 0, None, \
+                                        offsets))
+
+                batches = [[], []]
+                for pair in izip_longest(*records):
+                        self.checkMates(pair, inputFile1, inputFile2)
+
+                        for i in range(2):
+                                self.ingestRead(pair[i], mates[i][0])
+                                batches[i].append(pair[i])
+
+                        if len(batches[0]) == self.BATCH_READS:
+                                for i in range(2):
+                                        self.ingestBatch(batches[i], \
+                                                mates[i][0], mates[i][1], \
+                                                means[i])
+                                batches = [[], []]
+                                self.reportProgress(mates[0][0].chars + \
+                                                mates[1][0].chars, \
+                                                2 * mates[0][0].numReads)
+
+                for i in range(2):
+                        self.ingestBatch(batches[i], mates[i][0], \
+                                        mates[i][1], means[i])
+
+                return mates
+
+
+        # Makes sure that the two reads of pair, from inputFile1 and
+        # inputFile2, are mates. One is None if its file ran out of reads
+        # before the other.
+        def checkMates(self, pair, inputFile1, inputFile2):
+                if pair[0] == None:
+                        raise Exception(self.MATES_EXCEPTION.format( \
+                                        inputFile2, inputFile1))
+                if pair[1] == None:
+                        raise Exception(self.MATES_EXCEPTION.format( \
+                                        inputFile1, inputFile2))
+
+                name1 = pair[0][self.ID_INDEX]
+                name2 = pair[1][self.ID_INDEX]
+                if self.mateName(name1) != self.mateName(name2):
+                        raise Exception(self.MATE_EXCEPTION.format(name1, \
+                                        inputFile1, name2, inputFile2))
+
+
+        # Returns the part of a read ID that its mate's ID has too: up to
+        # the first whitespace, e.g. before " 1:N:0" in Casava 1.8 IDs,
+        # and without a /1 or /2 at the end
+        def mateName(self, readId):
+                fields = readId.split(None, 1)
+                if fields:
+                        readId = fields[0]
+                if readId.endswith("/1") or readId.endswith("/2"):
+                        readId = readId[:-2]
+
+                return readId
+
+
+        # Returns the files that inputFile is made of, see __init__. For a
+        # sample of (R1, R2) tuples the pairs are kept in self.pairs.
+        def checkFiles(self, inputFile):
+                if not isinstance(inputFile, list):
+                        return [inputFile]
+
+                if len(inputFile) == 0:
+                        raise Exception(self.EMPTY_SAMPLE_EXCEPTION)
+
+                paired = [isinstance(item, tuple) for item in inputFile]
+                if any(paired) and not all(paired):
+                        raise Exception(self.MIXED_SAMPLE_EXCEPTION)
+
+                inputFiles = []
+                for item in inputFile:
+                        group = (item,)
+                        if isinstance(item, tuple):
+                                if len(item) != 2:
+                                        raise Exception( \
+                                                self.PAIR_EXCEPTION.format(item))
+                                group = item
+
+                        for name in group:
+                                if name == fastqInput.STDIN:
+                                        raise Exception( \
+                                                self.STDIN_SAMPLE_EXCEPTION)
+                                if name in inputFiles:
+                                        raise Exception( \
+                                                self.REPEAT_EXCEPTION.format(name))
+                                inputFiles.append(name)
+
+                if all(paired):
+                        self.pairs = list(inputFile)
+
+                return inputFiles
+
+
+        # Verifies one read and adds its length, strand-sense and
+        # character count to the totals in stats. Nucleotides and quality
+        # scores are left to ingestBatch.
+        def ingestRead(self, seq, stats):
+                if len(seq) != self.FASTQ_LINES:
+                        raise Exception(self.TRUNCATED_EXCEPTION.\
+                                format(seq[self.ID_INDEX]))
+
+                self.verifyRead(seq)
+
+                nucs = seq[self.SEQ_INDEX]
+                stats.numReads += 1
+                stats.length += len(nucs)
+                if seq[self.STRAND_INDEX] == '+':
+                        stats.plus += 1
+
+                # Line breaks after each line
+                stats.chars += 4 + len(seq[self.ID_INDEX]) + len(nucs) + \
+                                len(seq[self.STRAND_INDEX]) + \
+                                len(seq[self.QSCORE_INDEX])
+
+
+        # Counts the nucleotides of a batch of verified reads, appends each
+        # read's average quality score to it and adds both to stats, along
+        # with the counts at each position. The reads are then added to
+        # seqs and their average quality scores to means unless they are
+        # None.
+        def ingestBatch(self, batch, stats, seqs, means=None):
+                offsets = self.batchOffsets(batch)
+                nucs = "".join([seq[self.SEQ_INDEX] for seq in batch])
+                quals = "".join([seq[self.QSCORE_INDEX] for seq in batch])
+
+                self.addNucs(nucs, stats)
+                self.addNucPositions(nucs, offsets, stats)
+                self.addQualPositions(quals, offsets, stats)
+
+                for seq, qScore in zip(batch, \
+                                fastqKernels.qualityMeans(quals, offsets)):
+                        seq.append(qScore)
+                        stats.addScore(qScore)
+                        stats.qualCounts[int(qScore)] += 1
+
+                        if means != None:
+                                means.append(qScore)
+
+                        if seqs != None:
+                                seqs.append(seq)
+
+
+        # Adds the nucleotides in nucs to the counts in stats. The first
+        # unknown nucleotide is kept in stats for checkNucs to raise.
+        def addNucs(self, nucs, stats):
+                (a, c, g, t, n, unknown) = fastqKernels.countNucs(nucs)
+
+                if stats.unknownNuc == None:
+                        stats.unknownNuc = unknown
+
+                stats.A += a
+                stats.C += c
+                stats.G += g
+                stats.T += t
+                stats.N += n
+
+
+        # Adds the nucleotides at each position of the reads in nucs to
+        # stats. Read i spans offsets[i] to offsets[i + 1] in nucs.
+        def addNucPositions(self, nucs, offsets, stats):
+                addCounts(stats.posNucCounts, fastqKernels.positionCounts( \
+                                nucs, offsets, fastqKernels.NUM_NUC_BINS, \
+                                fastqKernels.NUC_BINS))
+
+
+        # Adds the quality scores at each position of the reads in quals to
+        # stats, see addNucPositions
+        def addQualPositions(self, quals, offsets, stats):
+                addCounts(stats.posQualCounts, fastqKernels.positionCounts( \
+                                quals, offsets, len(stats.qualCounts)))
+
+
+        # Returns the offsets of each read in batch once their nucleotides
+        # or quality scores are joined together, with the total at the end
+        def batchOffsets(self, batch):
+                offsets = [0]
+                for seq in batch:
+                        offsets.append(offsets[-1] + len(seq[self.QSCORE_INDEX]))
+
+                return offsets
+
+
+        # Raises an exception if an unknown nucleotide was counted in stats
+        def checkNucs(self, stats):
+                if stats.unknownNuc != None:
+                        raise Exception(self.NUC_EXCEPTION.\
+                                format(stats.unknownNuc))
+
+
+        # Returns the average quality score of each read in batch
+        def batchQScores(self, batch, stats=None):
+                offsets = self.batchOffsets(batch)
+                quals = "".join([seq[self.QSCORE_INDEX] for seq in batch])
+
+                if stats != None:
+                        self.addQualPositions(quals, offsets, stats)
+
+                return fastqKernels.qualityMeans(quals, offsets)
+
+
+        # Sets the file-wide statistics from a FastqStats. The results are
+        # the same as countNucs, assignQScores and avgLenQScore give.
+        #
+        # Raises an exception if an unknown nucleotide was counted. Like
+        # the multi-pass path, this comes after all reads are verified.
+        def applyStats(self, stats):
+                self.checkNucs(stats)
+                self.stats = stats
+                self.numReads = stats.numReads
+
+                self.A = stats.A
+                self.C = stats.C
+                self.G = stats.G
+                self.T = stats.T
+                self.N = stats.N
+                self.total = self.A + self.C + self.G + self.T + self.N
+                self.qualCounts = stats.qualCounts
+                self.profile = FastqProfile(stats.posQualCounts, \
+                                stats.posNucCounts)
+
+                # A file being tailed may not have a complete read yet. The
+                # averages and percentages are left as None until refresh
+                # reads some in, as in FastqStats.getSummary.
+                if self.numReads == 0:
+                        self.GC = None
+                        self.AT = None
+                        self.avgLen = None
+                        self.avgQScore = None
+                        self.plus = None
+                        self.minus = None
+                        return
+
+                self.calculateGC_AT()
+                self.avgLen = float(stats.length) / self.numReads
+                self.avgQScore = stats.getAvgQScore()
+
+                # Round to 2 decimals
+                self.plus = round(float(stats.plus) / self.numReads, 2) * 100
+                self.minus = 100 - self.plus
+
+
         # Checks to make sure that each read has an equal number of
         # quality scores and nucelotides as well as checks for
-        # invalid strand-sense
+        # invalid strand-sense, then that every nucleotide is known
         def verifyReads(self):
-                print "Verifying reads...."
+                self.monitor.begin("verifyReads", "Verifying reads....")
                 for seq in self.seqs:
-                        if len(seq[self.SEQ_INDEX]) != \
-                                len(seq[self.QSCORE_INDEX]):
-                                raise Exception(self.BALANCE_EXCEPTION.\
-                                        format(seq[self.ID_INDEX]))
+                        self.verifyRead(seq)
 
-                        if seq[self.STRAND_INDEX] != '+' and  \
-                                seq[self.STRAND_INDEX] != '-':
-                                raise Exception(self.STRAND_EXCEPTION.\
-                                        format(seq[self.STRAND_INDEX], \
-                                                seq[self.ID_INDEX]))
+                # Checked a batch of reads at a time without counting them,
+                # which countNucs leaves until the counts are used
+                for first in xrange(0, len(self.seqs), self.BATCH_READS):
+                        batch = self.seqs[first:first + self.BATCH_READS]
+                        unknown = "".join([seq[self.SEQ_INDEX] for seq in \
+                                        batch]).translate(None, \
+                                        fastqKernels.VALID_NUCS)
+                        if unknown != "":
+                                raise Exception(self.NUC_EXCEPTION.\
+                                        format(unknown[0]))
+                self.monitor.end(reads=len(self.seqs))
+
+
+        # Verifies a single read, see verifyReads
+        def verifyRead(self, seq):
+                if len(seq[self.SEQ_INDEX]) != len(seq[self.QSCORE_INDEX]):
+                        raise Exception(self.BALANCE_EXCEPTION.\
+                                format(seq[self.ID_INDEX]))
+
+                if seq[self.STRAND_INDEX] != '+' and  \
+                        seq[self.STRAND_INDEX] != '-':
+                        raise Exception(self.STRAND_EXCEPTION.\
+                                format(seq[self.STRAND_INDEX], \
+                                        seq[self.ID_INDEX]))
 
 
         # Counts the number of nucleotides of each type in whole file
         #
         # Raises an exception if an unknown nucleotide is readIn
         def countNucs(self):
-                print "Counting nucleotides...."
-                self.A = 0
-                self.C = 0
-                self.G = 0
-                self.T = 0
-                self.N = 0
-
-                # Capitalization probably unecessary, but a good idea
-                for seq in self.seqs:
-                        for char in seq[self.SEQ_INDEX]:
-                                if char == 'A' or char == 'a':
-                                        self.A += 1
-                                elif char == 'C' or char == 'c':
-                                        self.C += 1
-                                elif char == 'G' or char == 'g':
-                                        self.G += 1
-                                elif char == 'T' or char == 't':
-                                        self.T += 1
-                                elif char == 'N' or char == 'n':
-                                        self.N += 1
-                                else:  # Unknown nucleotide throw exception
-                                        raise Exception(self.NUC_EXCEPTION.\
-                                                format(char))
+                self.monitor.begin("countNucs", "Counting nucleotides....")
+                stats = FastqStats()
+
+                # Capitalization probably unecessary, but a good idea.
+                # fastqKernels counts both cases a batch of reads at a time.
+                for first in xrange(0, len(self.seqs), self.BATCH_READS):
+                        batch = self.seqs[first:first + self.BATCH_READS]
+                        nucs = "".join([seq[self.SEQ_INDEX] for seq in batch])
+                        self.addNucs(nucs, stats)
+                        self.addNucPositions(nucs, self.batchOffsets(batch), \
+                                        stats)
+
+                self.checkNucs(stats)
+                self.posNucCounts = stats.posNucCounts
+
+                self.A = stats.A
+                self.C = stats.C
+                self.G = stats.G
+                self.T = stats.T
+                self.N = stats.N
 
                 self.total = self.A + self.C + self.G + self.T + \
                                 self.N
 
                 self.calculateGC_AT()
+                self.monitor.end(reads=len(self.seqs))
 
 
         # Calculates GC and AT content to the nearest integer
@@ -237,34 +1860,59 @@ class FastqKeeper:
                 self.AT = 100 -gc
 
 
+        # Works out the quality score statistics and the average quality
+        # score of each read, see assignQScores and avgLenQScore
+        def countQScores(self):
+                self.assignQScores()
+                self.avgLenQScore()
+
+
+        # Makes the per-position profile of the reads, see fastqProfile
+        def makeProfile(self):
+                self.profile = FastqProfile(self.posQualCounts, \
+                                self.posNucCounts)
+
+
         # Adds a 5th element to each read in self.seqs
         # that is the average quality score of that read
         def assignQScores(self):
-                print "Assessing quality...."
-                for seq in self.seqs:
-                        seq.append(self.avgQScore(seq))
+                self.monitor.begin("assignQScores", "Assessing quality....")
+                stats = FastqStats()
+                for first in xrange(0, len(self.seqs), self.BATCH_READS):
+                        batch = self.seqs[first:first + self.BATCH_READS]
+                        for seq, qScore in zip(batch, \
+                                        self.batchQScores(batch, stats)):
+                                seq.append(qScore)
+
+                self.posQualCounts = stats.posQualCounts
+                self.monitor.end(reads=len(self.seqs))
 
 
         # Takes in a read of the form [ID, SEQ, STRAND-SENSE, QSCORE]
         # and returns an int with rounded avg Q-score for that read
-        def avgQScore(self, seq):
-                qScore = 0
-                for letter in seq[self.QSCORE_INDEX]:
-                        qScore += ord(letter)  # Get numerical equivalent
+        #
+        # NOTE: avgLenQScore stores the file-wide average in self.avgQScore,
+        # so this can't share that name.
+        def readQScore(self, seq):
+                # Get numerical equivalents
+                qScore = sum(bytearray(seq[self.QSCORE_INDEX]))
 
                 # Get average, round to two decimal places
                 return round(qScore / float(len(seq[self.QSCORE_INDEX])), 2)
 
 
         def avgLenQScore(self):
+                self.monitor.begin("avgLenQScore")
                 length = 0
                 score = 0
                 plus = 0
+                self.qualCounts = [0] * 256
 
                 # Sum all lengths and qscores
                 for seq in self.seqs:
                         length += len(seq[self.SEQ_INDEX])
-                        score += seq[self.AVG_QSCORE_INDEX]
+                        score += hundredths(seq[self.AVG_QSCORE_INDEX])
+                        self.qualCounts[int(seq[self.AVG_QSCORE_INDEX])] += 1
 
                         # Only count + strands to get distribution of strand
                         # sense
@@ -272,11 +1920,12 @@ class FastqKeeper:
                                 plus += 1
 
                 self.avgLen = float(length) / self.getNumReads()
-                self.avgQScore = float(score) / self.getNumReads()
+                self.avgQScore = float(score) / (100 * self.getNumReads())
 
                 # Round to 2 decimals
                 self.plus = round(float(plus) / self.numReads, 2) * 100
                 self.minus = 100 - self.plus
+                self.monitor.end(reads=self.numReads)
 
 
 
@@ -0,0 +1,488 @@
+#
+# fastqKernels.py
+# Author: Philip Braunstein
+#
+# Date Created: May 21, 2014
+# Last Modified: May 21, 2014
+#
+# Per-base statistics over many reads at once. Each function takes the
+# nucleotides or quality scores of a batch of reads concatenated into one
+# buffer (a str or bytearray) rather than one read at a time.
+#
+# Packed buffers of nucleotides, two bits each, can be counted and
+# searched without unpacking them, see packNucs.
+#
+# NumPy is used when it is installed. Otherwise the functions fall back
+# on pure Python; both paths give identical results.
+#
+
+import binascii
+import re
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from itertools import izip
+from itertools import izip_longest
+
+try:
+        import numpy
+except ImportError:
+        numpy = None
+
+# Set to False to force the pure Python path
+USE_NUMPY = numpy != None
+
+VALID_NUCS = "ACGTNacgtn"
+
+# Translation table from a nucleotide to its bin in positionCounts: A, C,
+# G, T and N in either case are 0 to 4, anything else is 5
+NUC_BINS = "".join([chr("ACGTN".find(chr(i).upper())) \
+                if chr(i) in VALID_NUCS else chr(5) for i in range(256)])
+NUM_NUC_BINS = 6
+
+# Translation table from a nucleotide to the digit it has in a k-mer code
+# in base 4, see kmerCodes. Anything but A, C, G and T becomes N.
+KMER_DIGITS = "".join([str("ACGT".find(chr(i).upper())) \
+                if chr(i) in "ACGTacgt" else "N" for i in range(256)])
+
+# Translation table from a nucleotide to its 2-bit code in a packed
+# buffer, see packNucs, as a base 4 digit. Anything but A, C, G and T (in
+# either case) is packed as A.
+PACK_DIGITS = "".join([str(max("ACGT".find(chr(i).upper()), 0)) \
+                for i in range(256)])
+
+# The four nucleotides packed into each possible byte
+UNPACK_TABLE = ["".join(["ACGT"[(byte >> shift) & 3] for shift in \
+                (6, 4, 2, 0)]) for byte in range(256)]
+
+# Set bits of each possible byte
+POPCOUNTS = [bin(byte).count('1') for byte in range(256)]
+
+if numpy != None:
+        # VALID_TABLE[byte] is True for bytes that are valid nucleotides
+        VALID_TABLE = numpy.zeros(256, dtype=bool)
+        for nuc in VALID_NUCS:
+                VALID_TABLE[ord(nuc)] = True
+
+        # KMER_TABLE[byte] is the k-mer digit of byte, or 4 for N
+        KMER_TABLE = numpy.array([int(digit) if digit != "N" else 4 \
+                        for digit in KMER_DIGITS], dtype=numpy.uint64)
+
+        PACK_TABLE = numpy.array([int(digit) for digit in PACK_DIGITS], \
+                        dtype=numpy.uint8)
+        POPCOUNT_TABLE = numpy.array(POPCOUNTS, dtype=numpy.int64)
+
+
+# Counts the nucleotides in buf regardless of case. Returns a tuple of
+# (A, C, G, T, N, unknown) where unknown is the first character in buf
+# that is not a nucleotide or None if every character is one.
+def countNucs(buf):
+        if USE_NUMPY:
+                return countNucsNumpy(buf)
+
+        buf = str(buf)
+        counts = []
+        for nuc in "ACGTN":
+                counts.append(buf.count(nuc) + buf.count(nuc.lower()))
+
+        unknown = None
+        if sum(counts) != len(buf):
+                unknown = buf.translate(None, VALID_NUCS)[0]
+
+        return tuple(counts) + (unknown,)
+
+
+# NumPy version of countNucs, a histogram of byte values with bincount
+def countNucsNumpy(buf):
+        arr = numpy.frombuffer(buf, dtype=numpy.uint8)
+        hist = numpy.bincount(arr, minlength=256)
+
+        counts = []
+        for nuc in "ACGTN":
+                counts.append(int(hist[ord(nuc)] + hist[ord(nuc.lower())]))
+
+        unknown = None
+        if sum(counts) != len(arr):
+                first = numpy.flatnonzero(~VALID_TABLE[arr])[0]
+                unknown = chr(arr[first])
+
+        return tuple(counts) + (unknown,)
+
+
+# Returns the average quality score of each read in buf rounded to two
+# decimal places. Read i spans offsets[i] to offsets[i + 1] in buf, and
+# only reads first up to but not including last are averaged.
+def qualityMeans(buf, offsets, first=0, last=None):
+        if last == None:
+                last = len(offsets) - 1
+
+        if USE_NUMPY:
+                sums = qualitySumsNumpy(buf, offsets, first, last)
+        else:
+                sums = []
+                for i in xrange(first, last):
+                        sums.append(sum(bytearray(
+                                buf[offsets[i]:offsets[i + 1]])))
+
+        # Rounded in Python so both paths round the same way
+        means = []
+        for i in xrange(first, last):
+                length = offsets[i + 1] - offsets[i]
+                means.append(round(sums[i - first] / float(length), 2))
+
+        return means
+
+
+# Sums quality scores per read with reduceat over the read offsets
+def qualitySumsNumpy(buf, offsets, first, last):
+        start = offsets[first]
+        arr = numpy.frombuffer(buf, dtype=numpy.uint8, \
+                        count=offsets[last] - start, offset=start)
+
+        if len(arr) == 0:
+                return [0] * (last - first)
+
+        starts = numpy.array(offsets[first:last], dtype=numpy.int64) - start
+        sums = numpy.add.reduceat(arr, numpy.minimum(starts, len(arr) - 1), \
+                        dtype=numpy.int64)
+
+        # reduceat gives a single element rather than 0 for an empty read
+        lengths = numpy.diff(numpy.array(offsets[first:last + 1], \
+                        dtype=numpy.int64))
+        sums[lengths == 0] = 0
+
+        return sums.tolist()
+
+
+# Counts the characters at each position of the reads in buf, where read
+# i spans offsets[i] to offsets[i + 1]. Characters are translated with
+# table first if it is given, and must then be less than numBins.
+# Returns a flat list where element pos * numBins + char is the number of
+# reads with char at position pos, as long as the longest read.
+def positionCounts(buf, offsets, numBins, table=None):
+        if table != None:
+                buf = str(buf).translate(table)
+
+        if USE_NUMPY:
+                return positionCountsNumpy(buf, offsets, numBins)
+
+        reads = [buf[offsets[i]:offsets[i + 1]] \
+                        for i in xrange(len(offsets) - 1)]
+
+        # Each column holds the characters at one position of every read
+        # that long
+        counts = []
+        for column in izip_longest(*reads, fillvalue=""):
+                column = "".join(column)
+                row = [0] * numBins
+                for char in set(column):
+                        row[ord(char)] = column.count(char)
+                counts.extend(row)
+
+        return counts
+
+
+# NumPy version of positionCounts, one bincount of position * numBins +
+# char over the whole buffer
+def positionCountsNumpy(buf, offsets, numBins):
+        start = offsets[0]
+        arr = numpy.frombuffer(buf, dtype=numpy.uint8, \
+                        count=offsets[-1] - start, offset=start)
+        if len(arr) == 0:
+                return []
+
+        lengths = numpy.diff(numpy.array(offsets, dtype=numpy.intp))
+        maxLength = int(lengths.max())
+
+        if lengths.min() == maxLength:
+                # Reads all the same length, the common case
+                bases = numpy.arange(maxLength, dtype=numpy.intp) * numBins
+                index = (arr.reshape(-1, maxLength) + bases).ravel()
+        else:
+                starts = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+                positions = numpy.arange(len(arr), dtype=numpy.intp) - starts
+                index = positions * numBins + arr
+
+        return numpy.bincount(index, minlength=maxLength * numBins).tolist()
+
+
+
+# Returns the ranges of buf that start at starts and are lengths long
+# joined together in one str. buf can be anything that can be sliced,
+# such as an mmap, so only the ranges are copied out of it.
+#
+# There is no NumPy version: gathering the bytes with an index array is
+# slower than slicing and joining.
+def gatherRanges(buf, starts, lengths):
+        return "".join([buf[start:start + length] \
+                        for start, length in izip(starts, lengths)])
+
+
+# Returns the code of every k-mer of the reads in buf that is made up of
+# only A, C, G and T (in either case), where read i spans offsets[i] to
+# offsets[i + 1]. A k-mer's code is the k-mer read as a number in base 4
+# with A, C, G and T as the digits 0 to 3, so k can be at most 32. Codes
+# are in order of read and then position, as a NumPy array of uint64 when
+# NumPy is used and otherwise a list.
+def kmerCodes(buf, offsets, k):
+        if USE_NUMPY:
+                return kmerCodesNumpy(buf, offsets, k)
+
+        codes = []
+        for i in xrange(len(offsets) - 1):
+                digits = str(buf[offsets[i]:offsets[i + 1]]).translate( \
+                                KMER_DIGITS)
+                for run in digits.split("N"):
+                        codes.extend([int(run[j:j + k], 4) \
+                                        for j in xrange(len(run) - k + 1)])
+
+        return codes
+
+
+# NumPy version of kmerCodes. Every position of buf starts a k-mer, built
+# up a digit at a time, and those that run into an N or past the end of
+# their read are dropped.
+def kmerCodesNumpy(buf, offsets, k):
+        start = offsets[0]
+        arr = numpy.frombuffer(buf, dtype=numpy.uint8, \
+                        count=offsets[-1] - start, offset=start)
+        count = len(arr) - k + 1
+        if count <= 0:
+                return numpy.zeros(0, dtype=numpy.uint64)
+
+        digits = KMER_TABLE[arr]
+        codes = numpy.zeros(count, dtype=numpy.uint64)
+        for j in xrange(k):
+                codes = (codes << numpy.uint64(2)) | \
+                                (digits[j:j + count] & numpy.uint64(3))
+
+        # Ns up to each position, to find the k-mers with none in them
+        ns = numpy.concatenate(([0], numpy.cumsum(digits == 4)))
+        keep = ns[k:] - ns[:count] == 0
+
+        # Distance from each position to the end of its read
+        ends = numpy.array(offsets[1:], dtype=numpy.intp) - start
+        lengths = numpy.diff(numpy.array(offsets, dtype=numpy.intp))
+        remaining = numpy.repeat(ends, lengths) - numpy.arange(len(arr))
+        keep &= remaining[:count] >= k
+
+        return codes[keep]
+
+
+# Joins the lists or NumPy arrays in parts, as kmerCodes returns them,
+# into one
+def concatenate(parts):
+        if USE_NUMPY:
+                parts = list(parts)
+                if len(parts) == 0:
+                        return numpy.zeros(0, dtype=numpy.uint64)
+                return numpy.concatenate(parts)
+
+        joined = []
+        for part in parts:
+                joined.extend(part)
+
+        return joined
+
+
+# Returns a tuple of the distinct values in values in order and the
+# number of times each one appears, both as lists
+def valueCounts(values):
+        if USE_NUMPY:
+                (distinct, counts) = numpy.unique(values, return_counts=True)
+                return (distinct.tolist(), counts.tolist())
+
+        counts = Counter(values)
+        distinct = sorted(counts.keys())
+        return (distinct, [counts[value] for value in distinct])
+
+
+# Packs the nucleotides in buf, whose length must be a multiple of 4, two
+# bits each into a bytearray: A, C, G and T are 0 to 3 and the first of
+# every four nucleotides is in the highest two bits of its byte.
+# Characters other than A, C, G and T (in either case) are packed as A,
+# so they have to be kept elsewhere to be unpacked, see PackedSeqs.
+def packNucs(buf):
+        if USE_NUMPY:
+                return packNucsNumpy(buf)
+
+        if len(buf) == 0:
+                return bytearray()
+
+        # Read as one number in base 4, each byte is two hex digits
+        value = int(str(buf).translate(PACK_DIGITS), 4)
+        return bytearray(binascii.unhexlify("%0*x" % (len(buf) // 2, value)))
+
+
+# NumPy version of packNucs, shifts the codes of each of the four
+# nucleotides of a byte into place at once
+def packNucsNumpy(buf):
+        codes = PACK_TABLE[numpy.frombuffer(buf, dtype=numpy.uint8)]
+        packed = (codes[0::4] << 6) | (codes[1::4] << 4) | \
+                        (codes[2::4] << 2) | codes[3::4]
+
+        return bytearray(packed.tobytes())
+
+
+# Returns the runs of characters in chars in buf as a tuple of lists
+# (starts, ends, offsets): run i spans starts[i] to ends[i] (plus base),
+# and offsets[i] is how many characters of the runs come before it.
+def findRuns(buf, chars, base=0):
+        if USE_NUMPY:
+                return findRunsNumpy(buf, chars, base)
+
+        (starts, ends, offsets) = ([], [], [])
+        total = 0
+        for match in re.finditer("[" + re.escape(chars) + "]+", str(buf)):
+                starts.append(base + match.start())
+                ends.append(base + match.end())
+                offsets.append(total)
+                total += match.end() - match.start()
+
+        return (starts, ends, offsets)
+
+
+# NumPy version of findRuns, runs start where the characters in chars
+# start and end where they stop
+def findRunsNumpy(buf, chars, base):
+        table = numpy.zeros(256, dtype=numpy.int8)
+        table[numpy.frombuffer(chars, dtype=numpy.uint8)] = 1
+        inRuns = table[numpy.frombuffer(buf, dtype=numpy.uint8)]
+
+        edges = numpy.diff(numpy.concatenate(([0], inRuns, [0])))
+        starts = numpy.flatnonzero(edges == 1)
+        ends = numpy.flatnonzero(edges == -1)
+        offsets = numpy.cumsum(ends - starts) - (ends - starts)
+
+        return ((starts + base).tolist(), (ends + base).tolist(), \
+                        offsets.tolist())
+
+
+# Returns the nucleotides packed into buf from nucleotide start up to
+# nucleotide end as a str, see packNucs
+def unpackNucs(buf, start, end):
+        first = start // 4
+        last = (end + 3) // 4
+        nucs = "".join([UNPACK_TABLE[byte] for byte in buf[first:last]])
+
+        return nucs[start - 4 * first:end - 4 * first]
+
+
+# Returns a tuple of (A, C, G, T), the number of each code in buf as
+# packNucs packs them, by counting bits rather than nucleotides: the low
+# bit of a code is set for C and T, the high bit for G and T, and both
+# only for T.
+def countPacked(buf):
+        if USE_NUMPY:
+                arr = numpy.frombuffer(buf, dtype=numpy.uint8)
+                low = int(POPCOUNT_TABLE[arr & 0x55].sum())
+                high = int(POPCOUNT_TABLE[arr & 0xAA].sum())
+                both = int(POPCOUNT_TABLE[arr & (arr >> 1) & 0x55].sum())
+        elif len(buf) == 0:
+                (low, high, both) = (0, 0, 0)
+        else:
+                # The whole buffer as one number, 01 and 10 in every code
+                value = int(binascii.hexlify(buf), 16)
+                lowBits = int("55" * len(buf), 16)
+                low = bin(value & lowBits).count('1')
+                high = bin(value & (lowBits << 1)).count('1')
+                both = bin(value & (value >> 1) & lowBits).count('1')
+
+        T = both
+        G = high - both
+        C = low - both
+        return (4 * len(buf) - C - G - T, C, G, T)
+
+
+# Returns the number of reads in buf, packed as packNucs packs them, that
+# have pattern, where read i spans nucleotides offsets[i] to
+# offsets[i + 1]. Ns in pattern match anything, as in getNumMatches.
+# blocked is a list of (starts, ends) of sorted runs of nucleotides that
+# don't match anything else, since they aren't really the A, C, G or T
+# they were packed as.
+def packedMatches(buf, offsets, pattern, blocked):
+        if USE_NUMPY:
+                return packedMatchesNumpy(buf, offsets, pattern, blocked)
+
+        regex = re.compile(pattern.replace('N', '.'))
+        count = 0
+        for i in xrange(len(offsets) - 1):
+                start = offsets[i]
+                end = offsets[i + 1]
+                nucs = bytearray(unpackNucs(buf, start, end))
+
+                for (starts, ends) in blocked:
+                        j = bisect_right(ends, start)
+                        while j < len(starts) and starts[j] < end:
+                                first = max(starts[j], start) - start
+                                last = min(ends[j], end) - start
+                                nucs[first:last] = "x" * (last - first)
+                                j += 1
+
+                if regex.search(str(nucs)) != None:
+                        count += 1
+
+        return count
+
+
+# NumPy version of packedMatches. Every position is compared with the
+# first nucleotide of pattern at once, then the positions that still
+# match with each of the others in turn, so later comparisons only look
+# at a few positions. The matches left are dropped if they run past the
+# end of their read or have a blocked nucleotide where pattern has no N.
+def packedMatchesNumpy(buf, offsets, pattern, blocked):
+        start = offsets[0]
+        end = offsets[-1]
+        length = len(pattern)
+        count = end - start - length + 1
+        if count <= 0:
+                return 0
+
+        arr = numpy.frombuffer(buf, dtype=numpy.uint8)[start // 4: \
+                        (end + 3) // 4]
+        codes = numpy.empty((len(arr), 4), dtype=numpy.uint8)
+        for j, shift in enumerate((6, 4, 2, 0)):
+                codes[:, j] = (arr >> shift) & 3
+        codes = codes.reshape(-1)[start % 4:start % 4 + end - start]
+
+        checked = [j for j, nuc in enumerate(pattern) if nuc != 'N']
+        if checked:
+                j = checked[0]
+                positions = numpy.flatnonzero(codes[j:j + count] == \
+                                "ACGT".index(pattern[j]))
+        else:
+                positions = numpy.arange(count)
+        for j in checked[1:]:
+                positions = positions[codes[positions + j] == \
+                                "ACGT".index(pattern[j])]
+        positions += start
+
+        bounds = asArray(offsets)
+        reads = numpy.searchsorted(bounds, positions, side='right') - 1
+        keep = positions + length <= bounds[reads + 1]
+        positions = positions[keep]
+        reads = reads[keep]
+
+        for (starts, ends) in blocked:
+                if len(starts) == 0:
+                        continue
+                starts = asArray(starts)
+                ends = asArray(ends)
+                for j in checked:
+                        nucs = positions + j
+                        runs = numpy.searchsorted(starts, nucs, side='right') - 1
+                        keep = (runs < 0) | (nucs >= ends[runs])
+                        positions = positions[keep]
+                        reads = reads[keep]
+
+        return len(numpy.unique(reads))
+
+
+# Returns values, an array.array or list of whole numbers, as a NumPy
+# array, without copying an array.array
+def asArray(values):
+        if isinstance(values, array):
+                return numpy.frombuffer(values, dtype=numpy.dtype('u' + \
+                                str(values.itemsize)))
+
+        return numpy.array(values, dtype=numpy.intp)
@@ -0,0 +1,157 @@
+#
+# fastqKmers.py
+# Author: Philip Braunstein
+#
+# Date Created: May 24, 2014
+# Last Modified: May 24, 2014
+#
+# The KmerIndex class maps every k-mer (substring of length k) seen in the
+# reads to the list of reads it appears in. FastqKeeper uses it to narrow
+# down which reads could match a pattern before searching them.
+#
+# Read numbers in each list are sorted, so they are stored as the
+# differences between consecutive read numbers, each written as a varint
+# (7 bits per byte, high bit set on all but the last byte) in a bytearray.
+#
+
+import sys
+import time
+
+class KmerIndex:
+        ################### Public API ###################
+        # Indexes each sequence in seqs, numbered in order from 0. Returns
+        # False and empties the index if it would grow past maxBytes.
+        def build(self, seqs):
+                start = time.time()
+                k = self.k
+
+                # Locals rather than attributes, this loop runs once per
+                # k-mer per read
+                postings = self.postings
+                lastRead = self.lastRead
+                size = self.size
+
+                for readNum, seq in enumerate(seqs):
+                        for kmer in set([seq[i:i + k] \
+                                        for i in xrange(len(seq) - k + 1)]):
+                                posting = postings.get(kmer)
+                                if posting == None:
+                                        posting = bytearray()
+                                        postings[kmer] = posting
+                                        delta = readNum + 1
+                                        size += self.ENTRY_BYTES
+                                else:
+                                        delta = readNum - lastRead[kmer]
+                                lastRead[kmer] = readNum
+
+                                if delta < 0x80:
+                                        posting.append(delta)
+                                        size += 1
+                                else:
+                                        size += self.appendVarint(posting, \
+                                                        delta)
+
+                        if self.maxBytes != None and size > self.maxBytes:
+                                self.clear()
+                                self.buildTime = time.time() - start
+                                return False
+
+                # Only needed while building
+                self.lastRead = {}
+
+                self.size = size
+                self.buildTime = time.time() - start
+                return True
+
+
+        # Returns the sorted list of reads that contain every k-mer in
+        # pattern that has no N in it. Returns None if pattern doesn't have
+        # any such k-mers, in which case every read is a candidate.
+        def candidates(self, pattern):
+                kmers = set()
+                for i in xrange(len(pattern) - self.k + 1):
+                        kmer = pattern[i:i + self.k]
+                        if 'N' not in kmer:
+                                kmers.add(kmer)
+
+                if len(kmers) == 0:
+                        return None
+
+                # Start from the shortest list so the sets stay small
+                postings = []
+                for kmer in kmers:
+                        if kmer not in self.postings:
+                                return []
+                        postings.append(self.postings[kmer])
+                postings.sort(key=len)
+
+                reads = set(self.decode(postings[0]))
+                for posting in postings[1:]:
+                        if len(reads) == 0:
+                                break
+                        reads.intersection_update(self.decode(posting))
+
+                return sorted(reads)
+
+
+        # Returns the number of distinct k-mers in the index
+        def getNumKmers(self):
+                return len(self.postings)
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # k is the k-mer length. maxBytes caps the estimated memory the
+        # index may use, or None for no cap.
+        def __init__(self, k, maxBytes=None):
+                self.k = k
+                self.maxBytes = maxBytes
+                self.buildTime = 0.0
+
+                # Estimated bytes for one k-mer's entries in both dicts
+                # while building, not counting its list of reads
+                self.ENTRY_BYTES = sys.getsizeof("A" * k) + \
+                                sys.getsizeof(bytearray()) + \
+                                sys.getsizeof(sys.maxint) + 48
+
+                self.clear()
+
+
+        # Empties the index
+        def clear(self):
+                self.postings = {}
+                self.lastRead = {}
+                self.size = 0
+
+
+        # Appends delta to posting as a varint and returns the number of
+        # bytes that took
+        def appendVarint(self, posting, delta):
+                length = 1
+                while delta >= 0x80:
+                        posting.append((delta & 0x7f) | 0x80)
+                        delta >>= 7
+                        length += 1
+                posting.append(delta)
+
+                return length
+
+
+        # Returns the read numbers stored in posting as a list
+        def decode(self, posting):
+                reads = []
+                readNum = -1
+                delta = 0
+                shift = 0
+
+                for byte in posting:
+                        delta |= (byte & 0x7f) << shift
+                        if byte & 0x80:
+                                shift += 7
+                        else:
+                                readNum += delta
+                                reads.append(readNum)
+                                delta = 0
+                                shift = 0
+
+                return reads
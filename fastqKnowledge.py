@@ -10,41 +10,592 @@
 # This python file contains a main that takes in a FASTQ file and allows
 # the user to query the FastqReporter data model.
 #
+# If any of --stats, --match, --qual, --random, --duplication,
+# --overrepresented or --kmer-spectrum are given, those queries
+# are answered for each file on the command line in turn and printed as
+# JSON or TSV instead. "-" or no file at all reads from standard input.
+# Progress messages go to stderr so stdout only has the answers.
+#
+# With --sample all of the files are read in as one sample, by one process
+# each, and with --paired they are R1 R2 pairs of paired-end files, see
+# FastqKeeper.
+#
+# With --serve ADDRESS the program keeps running and answers the same
+# queries from fastqClient.py over a Unix socket or HTTP instead, reading
+# in each file once, see fastqServer. HTTP is only served on loopback
+# addresses unless --allow-remote is given, and files are only cached if
+# --cache is.
+#
+# With --filter-out FILE the reads that pass the filters given are written
+# to FILE instead, see fastqFilter, and the number that failed each
+# filter is printed the same way.
+#
+# With --estimate the statistics, patterns and cutoffs are estimated from
+# reads sampled at random instead of reading the file in, see
+# fastqEstimate, and are marked as estimates. Option w of the prompt
+# reads the file in for exact answers.
+#
 
+import os
+import sys
+from argparse import ArgumentParser
 from sys import argv
 from sys import exit
 
+import fastqBatch
+import fastqFilter
+import fastqMonitor
+import fastqServer
+from fastqEstimate import FastqEstimateReporter
+from fastqEstimate import FastqEstimator
+from fastqFilter import FastqFilter
+from fastqInput import STDIN
 from fastqReporter import FastqReporter
+from fastqStore import PACKED
 
 # CONSTANTS
-EXTENSION = "fastq"
+EXTENSIONS = ["fastq", "fq", "fastq.gz", "fq.gz", "fastq.bgz", "fq.bgz", \
+                "fastq.zst", "fq.zst"]
 
-def main():
-        checkArgs()
+# Options of the prompt that need the whole file read in, so can't be
+# answered with --estimate until it is with option w
+EXACT_OPTIONS = ['e', 'f', 'i', 'k', 'p', 'r', 's', 'u']
 
-        sequences = FastqReporter(argv[1])  # Instantiate FastqReporter
+def main():
+        args = checkArgs()
+
+        if args.serve != None:
+                runServer(args)
+                return
+
+        if args.filterOut != None:
+                runFilter(args)
+                return
+
+        if isBatch(args):
+                runBatch(args)
+                return
+
+        if args.sample:
+                sequences = openReporter(args, getSample(args))
+        elif args.estimate:
+                sequences = openEstimator(args, args.fastq[0])
+        else:
+                sequences = openReporter(args, args.fastq[0])
+        runLoop(sequences, args)
+
+
+# Returns the files on the command line as a sample for FastqReporter: a
+# list of them, or of (R1, R2) tuples with --paired
+def getSample(args):
+        if args.paired:
+                return zip(args.fastq[0::2], args.fastq[1::2])
+
+        return list(args.fastq)
+
+
+# Instantiates a FastqReporter for inputFile with the options in args
+def openReporter(args, inputFile):
+        return FastqReporter(inputFile, tail=args.tail, \
+                        monitor=makeMonitor(args), **getOptions(args))
+
+
+# Instantiates a FastqEstimateReporter for inputFile with the options in
+# args
+def openEstimator(args, inputFile):
+        kwargs = {"seed": args.seed, "monitor": makeMonitor(args)}
+        if args.targetError != None:
+                kwargs["targetError"] = args.targetError
+        if args.maxSamples != None:
+                kwargs["maxSamples"] = args.maxSamples
+
+        return FastqEstimateReporter(inputFile, **kwargs)
+
+
+# Returns the keyword arguments to FastqReporter for reading files in the
+# way asked for in args
+def getOptions(args):
+        return {"workers": args.workers, "cache": args.cache, \
+                        "cacheDir": args.cacheDir, "kmerIndex": args.kmerIndex, \
+                        "kmerSize": args.kmerSize, \
+                        "kmerMaxBytes": args.kmerMaxBytes, \
+                        "keepReads": args.keepReads, "mapped": args.mapped, \
+                        "columnar": args.columnar, "readahead": args.readahead}
+
+
+# Answers queries sent to the --serve address until interrupted, after
+# reading in the files given on the command line, see fastqServer
+def runServer(args):
+        monitor = makeMonitor(args)
+        pool = fastqServer.ReporterPool(args.maxBytes, getOptions(args), \
+                        monitor)
+        for inputFile in args.fastq:
+                pool.query({"file": inputFile})
+
+        server = fastqServer.makeServer(args.serve, pool, args.allowRemote)
+        if args.allowRemote:
+                monitor.message("Warning: clients on other machines can" + \
+                                " read any file this server can")
+        monitor.message("Answering queries at " + args.serve)
+        try:
+                server.serve_forever()
+        except KeyboardInterrupt:
+                pass
+        finally:
+                server.server_close()
+                if not args.serve.startswith(fastqServer.HTTP):
+                        os.remove(args.serve)
+
+
+# Returns the monitor asked for in args, see fastqMonitor
+def makeMonitor(args):
+        if args.quiet:
+                return fastqMonitor.NullMonitor()
+        if args.log != None:
+                return fastqMonitor.LogMonitor(args.log)
+        if args.progress:
+                return fastqMonitor.ProgressMonitor(sys.stderr)
+
+        return fastqMonitor.PrintMonitor(args.timings)
+
+
+# Returns True if any queries were given on the command line
+def isBatch(args):
+        return args.stats or args.patterns != None or \
+                        args.cutoffs != None or args.numRandom != None or \
+                        args.duplication or args.numOverrepresented != None \
+                        or args.spectrumK != None
+
+
+# Answers the queries in args for each file and prints them to stdout.
+# Anything printed while reading a file in goes to stderr instead.
+def runBatch(args):
+        out = sys.stdout
+        if args.format == fastqBatch.TSV:
+                out.write(fastqBatch.TSV_HEADER + "\n")
+
+        inputFiles = args.fastq or [STDIN]
+        if args.sample:
+                inputFiles = [getSample(args)]
+
+        for inputFile in inputFiles:
+                sys.stdout = sys.stderr
+                try:
+                        if args.estimate:
+                                results = fastqBatch.runEstimates( \
+                                        openEstimator(args, inputFile), \
+                                        args.stats, args.patterns, args.cutoffs)
+                        else:
+                                sequences = openReporter(args, inputFile)
+                                results = fastqBatch.runQueries(sequences, \
+                                        args.stats, args.patterns, \
+                                        args.cutoffs, args.numRandom, \
+                                        args.seed, args.duplication, \
+                                        args.numOverrepresented, \
+                                        args.spectrumK, args.prefixLength, \
+                                        args.exact)
+                finally:
+                        sys.stdout = out
+
+                if args.sample:
+                        inputFile = ",".join(args.fastq)
+                text = fastqBatch.formatResults(inputFile, results, \
+                                args.format)
+                if text != "":
+                        out.write(text + "\n")
+                out.flush()
+
+
+# Writes the reads that pass the filters in args to the --filter-out file,
+# streaming them straight from the input file, and prints the number that
+# failed each filter. Anything printed along the way goes to stderr, as
+# does the report if the reads are written to stdout.
+def runFilter(args):
+        out = sys.stdout
+        report = sys.stdout
+        if args.filterOut == fastqFilter.STDOUT:
+                report = sys.stderr
+
+        inputFile = STDIN
+        if args.fastq:
+                inputFile = args.fastq[0]
+
+        readFilter = FastqFilter(args.minQual, args.minLength, args.maxLength, \
+                        args.maxN, args.require, args.exclude, args.trimQual)
+
+        sys.stdout = sys.stderr
+        try:
+                results = {"filter": fastqFilter.filterFile(inputFile, \
+                                args.filterOut, readFilter, args.compressLevel, \
+                                args.workers, monitor=makeMonitor(args))}
+        finally:
+                sys.stdout = out
 
-        runLoop(sequences)
-      
+        report.write(fastqBatch.formatResults(inputFile, results, \
+                        args.format) + "\n")
 
 
 # Checks to make sure appropriate arguments are passed to program
+# and returns them
 def checkArgs():
-        if len(argv) != 2:
+        parser = ArgumentParser(add_help=False)
+        parser.add_argument("fastq", nargs="*")
+        parser.add_argument("-w", "--workers", type=int, default=1)
+        parser.add_argument("--cache", action="store_const", const=True)
+        parser.add_argument("--no-cache", dest="cache", action="store_const", \
+                        const=False)
+        parser.add_argument("--low-memory", dest="keepReads", \
+                        action="store_false")
+        parser.add_argument("--mmap", dest="mapped", action="store_true")
+        parser.add_argument("--packed", dest="columnar", \
+                        action="store_const", const=PACKED, default=False)
+        parser.add_argument("--tail", action="store_true")
+        parser.add_argument("--readahead", type=int)
+        parser.add_argument("--sample", action="store_true")
+        parser.add_argument("--paired", action="store_true")
+        parser.add_argument("--cache-dir", dest="cacheDir")
+        parser.add_argument("--kmer-index", dest="kmerIndex", \
+                        choices=["eager", "lazy"])
+        parser.add_argument("--kmer-size", dest="kmerSize", type=int, default=8)
+        parser.add_argument("--kmer-max-bytes", dest="kmerMaxBytes", type=int)
+        parser.add_argument("--stats", action="store_true")
+        # One value each, so that they don't take the files after them
+        parser.add_argument("--match", dest="patterns", action="append")
+        parser.add_argument("--qual", dest="cutoffs", action="append")
+        parser.add_argument("--random", dest="numRandom", type=int)
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--duplication", action="store_true")
+        parser.add_argument("--overrepresented", dest="numOverrepresented", \
+                        type=int)
+        parser.add_argument("--kmer-spectrum", dest="spectrumK", type=int)
+        parser.add_argument("--dup-prefix", dest="prefixLength", type=int)
+        parser.add_argument("--exact", action="store_const", const=True)
+        parser.add_argument("--sketch", dest="exact", action="store_const", \
+                        const=False)
+        parser.add_argument("--estimate", action="store_true")
+        parser.add_argument("--target-error", dest="targetError", type=float)
+        parser.add_argument("--max-samples", dest="maxSamples", type=int)
+        parser.add_argument("--serve")
+        parser.add_argument("--allow-remote", dest="allowRemote", \
+                        action="store_true")
+        parser.add_argument("--memory-budget", dest="maxBytes", type=int)
+        parser.add_argument("--filter-out", dest="filterOut")
+        parser.add_argument("--min-qual", dest="minQual")
+        parser.add_argument("--trim-qual", dest="trimQual")
+        parser.add_argument("--min-length", dest="minLength", type=int)
+        parser.add_argument("--max-length", dest="maxLength", type=int)
+        parser.add_argument("--max-n", dest="maxN", type=float)
+        parser.add_argument("--require", action="append")
+        parser.add_argument("--exclude", action="append")
+        parser.add_argument("--compress-level", dest="compressLevel", \
+                        type=int)
+        parser.add_argument("--format", choices=fastqBatch.FORMATS, \
+                        default=fastqBatch.JSON)
+        parser.add_argument("-q", "--quiet", action="store_true")
+        parser.add_argument("--progress", action="store_true")
+        parser.add_argument("--timings", action="store_true")
+        parser.add_argument("--log")
+
+        args, unknown = parser.parse_known_args()
+        if unknown:
+                usage()
+        if args.workers < 1:
+                print "Number of workers must be at least 1"
+                usage()
+        if args.readahead != None and args.readahead < 1:
+                print "Readahead buffers must be at least 1 byte"
+                usage()
+
+        if args.filterOut != None and len(args.fastq) > 1:
+                print "Please provide at most one FASTQ file to filter"
+                usage()
+        if args.serve != None and (args.sample or args.tail or \
+                        args.filterOut != None or isBatch(args) or \
+                        STDIN in args.fastq):
+                print "--serve can't be used with --sample, --paired,",
+                print "--tail, --filter-out, queries or standard input"
+                usage()
+        if args.maxBytes != None and args.serve == None:
+                print "--memory-budget is for --serve"
+                usage()
+        if args.allowRemote and (args.serve == None or \
+                        not args.serve.startswith(fastqServer.HTTP)):
+                print "--allow-remote is for --serve http://HOST:PORT"
+                usage()
+        if args.serve != None and args.serve.startswith(fastqServer.HTTP) \
+                and not args.allowRemote:
+                (host, port) = fastqServer.parseHttpAddress(args.serve)
+                if not fastqServer.isLoopback(host):
+                        print fastqServer.REMOTE_EXCEPTION.format(host) + ",",
+                        print "use --allow-remote to serve it anyway"
+                        usage()
+
+        # Clients of a server could otherwise have cache files written
+        # next to any file they name, see fastqServer
+        if args.cache == None:
+                args.cache = args.serve == None
+        checkEstimate(args)
+        if args.paired:
+                args.sample = True
+                if len(args.fastq) % 2 != 0:
+                        print "Please provide paired-end files as R1 R2 pairs"
+                        usage()
+        if args.sample and (args.filterOut != None or not args.fastq or \
+                        STDIN in args.fastq):
+                print "Please provide the FASTQ files of the sample on the",
+                print "command line"
+                usage()
+        if not isBatch(args) and args.filterOut == None and \
+                args.serve == None and not args.sample and \
+                (len(args.fastq) != 1 or \
+                args.fastq[0] == STDIN):
+                print "Please provide one FASTQ file on the command line"
                 usage()
-        if argv[1].split(".")[-1] != EXTENSION:
-                print "Please provide a FASTQ file on the command line"
+        for inputFile in args.fastq:
+                if inputFile != STDIN and not hasExtension(inputFile):
+                        print "Please provide a FASTQ file on the command line"
+                        usage()
+
+        checkQueries(args)
+        checkFilters(args)
+
+        if args.log != None:
+                try:
+                        args.log = open(args.log, 'a')
+                except IOError:
+                        print "Can't write log file", args.log
+                        usage()
+
+        return args
+
+
+# Checks the options for --estimate and exits with usage if they can't be
+# used together with the others given
+def checkEstimate(args):
+        if not args.estimate:
+                if args.targetError != None or args.maxSamples != None:
+                        print "--target-error and --max-samples are for",
+                        print "--estimate"
+                        usage()
+                return
+
+        if args.sample or args.paired or args.tail or args.serve != None or \
+                        args.filterOut != None or not args.fastq or \
+                        STDIN in args.fastq:
+                print "--estimate can't be used with --sample, --paired,",
+                print "--tail, --serve, --filter-out or standard input"
+                usage()
+        if args.numRandom != None or args.duplication or \
+                        args.numOverrepresented != None or \
+                        args.spectrumK != None:
+                print "Only --stats, --match and --qual can be estimated"
+                usage()
+        if args.targetError != None and args.targetError <= 0:
+                print "Target error must be greater than 0"
+                usage()
+        if args.maxSamples != None and args.maxSamples < 2:
+                print "Number of samples must be at least 2"
+                usage()
+
+
+# Checks the queries given on the command line, upper casing the
+# patterns, and exits with usage if any are invalid
+def checkQueries(args):
+        if args.patterns != None:
+                args.patterns = [pattern.upper() for pattern in args.patterns]
+                for pattern in args.patterns:
+                        if not validSeq(pattern):
+                                print "Invalid nucleotide sequence:", pattern
+                                usage()
+
+        if args.cutoffs != None:
+                for cutoff in args.cutoffs:
+                        if len(cutoff) != 1:
+                                print "Quality Score must be one character long."
+                                usage()
+
+        if args.numRandom != None and args.numRandom < 0:
+                print "Number of random reads can't be negative"
+                usage()
+
+        if args.numOverrepresented != None and args.numOverrepresented < 0:
+                print "Number of overrepresented sequences can't be negative"
+                usage()
+
+        if args.spectrumK != None and not 1 <= args.spectrumK <= 32:
+                print "K-mer length must be between 1 and 32"
+                usage()
+
+        if args.prefixLength != None and args.prefixLength < 1:
+                print "Prefix length must be at least 1"
                 usage()
 
 
+# Checks the filters given on the command line, upper casing the
+# patterns, and exits with usage if any are invalid
+def checkFilters(args):
+        filters = [args.minQual, args.trimQual, args.minLength, \
+                        args.maxLength, args.maxN, args.require, args.exclude, \
+                        args.compressLevel]
+        if args.filterOut == None and filters != [None] * len(filters):
+                print "Filters need --filter-out FILE to write the reads to"
+                usage()
+
+        for cutoff in [args.minQual, args.trimQual]:
+                if cutoff != None and len(cutoff) != 1:
+                        print "Quality Score must be one character long."
+                        usage()
+
+        for length in [args.minLength, args.maxLength]:
+                if length != None and length < 0:
+                        print "Read lengths can't be negative"
+                        usage()
+
+        if args.maxN != None and not 0 <= args.maxN <= 1:
+                print "Fraction of Ns must be between 0 and 1"
+                usage()
+
+        for name in ["require", "exclude"]:
+                patterns = getattr(args, name)
+                if patterns == None:
+                        continue
+
+                patterns = [pattern.upper() for pattern in patterns]
+                setattr(args, name, patterns)
+                for pattern in patterns:
+                        if not validSeq(pattern):
+                                print "Invalid nucleotide sequence:", pattern
+                                usage()
+
+        if args.compressLevel != None and not 0 <= args.compressLevel <= 9:
+                print "Compression level must be between 0 and 9"
+                usage()
+
+
+# Returns True if path ends in one of the FASTQ extensions
+def hasExtension(path):
+        for extension in EXTENSIONS:
+                if path.endswith("." + extension):
+                        return True
+
+        return False
+
+
 # Prints correct usage and exits non-zero
 def usage():
-        print "USAGE:", argv[0], "FASTQ_FILE.fastq"
+        print "USAGE:", argv[0], "[-w WORKERS] [--no-cache] [--cache-dir DIR]",
+        print "[--low-memory] [--mmap] [--packed] [--tail]"
+        print "       [--readahead BYTES] [-q] [--progress] [--timings]",
+        print "[--log FILE]"
+        print "       [--kmer-index eager|lazy] [--kmer-size K]",
+        print "[--kmer-max-bytes BYTES] FASTQ_FILE.fastq"
+        print "      ", argv[0], "[OPTIONS] --sample|--paired FASTQ_FILE.fastq..."
+        print "      ", argv[0], "[OPTIONS] [--stats] [--match PATTERN]...",
+        print "[--qual CUTOFF]..."
+        print "       [--random N] [--seed SEED] [--duplication]",
+        print "[--overrepresented N]"
+        print "       [--kmer-spectrum K] [--dup-prefix N] [--exact|--sketch]"
+        print "       [--format json|tsv] [FASTQ_FILE.fastq|- ...]"
+        print "      ", argv[0], "[-q] --estimate [--target-error E]",
+        print "[--max-samples N] [--seed SEED]"
+        print "       [--stats] [--match PATTERN]... [--qual CUTOFF]...",
+        print "[--format json|tsv]"
+        print "       FASTQ_FILE.fastq..."
+        print "      ", argv[0], "[OPTIONS] --serve SOCKET|http://HOST:PORT",
+        print "[--memory-budget BYTES]"
+        print "       [--cache] [--allow-remote] [FASTQ_FILE.fastq ...]"
+        print "      ", argv[0], "[OPTIONS] --filter-out FILE|- [--min-qual C]",
+        print "[--trim-qual C]"
+        print "       [--min-length N] [--max-length N] [--max-n FRACTION]"
+        print "       [--require PATTERN]... [--exclude PATTERN]...",
+        print "[--compress-level L]"
+        print "       [--format json|tsv] [FASTQ_FILE.fastq|-]"
+        print "  -w, --workers  number of processes to read the file with"
+        print "  --no-cache     don't read or write a cache of the file"
+        print "  --cache        cache files read in by --serve too, which it",
+        print "doesn't by default"
+        print "  --cache-dir    keep the cache in DIR instead of next to the file"
+        print "  --low-memory   don't keep reads in memory, read them from the",
+        print "file when needed"
+        print "  --mmap         read uncompressed files through a memory map"
+        print "  --packed       keep the nucleotides of reads in memory two bits",
+        print "each"
+        print "  --readahead    read the file BYTES at a time in a background",
+        print "thread while"
+        print "                 parsing, and report which of the two is slower"
+        print "  --sample       read all of the files given in as one sample, one",
+        print "process each"
+        print "  --paired       same, with the files given as R1 R2 pairs whose",
+        print "read IDs must match"
+        print "  --tail         the file is still being written, only read new",
+        print "reads when it is"
+        print "                 opened again or with option f"
+        print "  --kmer-index   index k-mers to speed up option m, either when",
+        print "the file is"
+        print "                 opened (eager) or on the first search (lazy)"
+        print "  --kmer-size    length of indexed k-mers (default 8)"
+        print "  --kmer-max-bytes  don't use the index if it needs more memory"
+        print "  --stats        print the statistics of each file"
+        print "  --match        print the number of reads matching PATTERN,",
+        print "repeat for more"
+        print "  --qual         print the number of reads at or above CUTOFF,",
+        print "repeat for more"
+        print "  --random       print N randomly chosen reads, --seed repeats them"
+        print "  --duplication  print the number of distinct reads and the",
+        print "percent duplicated"
+        print "  --overrepresented  print the N most common read sequences"
+        print "  --kmer-spectrum    print how many K-mers were seen each",
+        print "number of times"
+        print "  --dup-prefix   only compare the first N nucleotides of reads"
+        print "  --exact, --sketch  count exactly or estimate with bounded",
+        print "memory (default"
+        print "                 exact for files of up to 100000 reads)"
+        print "  --format       print answers as JSON lines (default) or TSV"
+        print "  --estimate     estimate the answers from reads sampled at",
+        print "random instead of"
+        print "                 reading uncompressed files in, with 95%",
+        print "confidence intervals"
+        print "  --target-error  sample until each interval is within this",
+        print "fraction of its"
+        print "                 estimate (default 0.02)"
+        print "  --max-samples  sample at most N reads (default 100000)"
+        print "  --serve        keep files read in and answer queries from",
+        print "fastqClient.py on a"
+        print "                 Unix socket or localhost HTTP, reading in the",
+        print "files given first"
+        print "  --memory-budget  drop the least recently queried files when",
+        print "those read in"
+        print "                 are estimated to use more memory than this"
+        print "  --allow-remote  let --serve listen on a host other machines",
+        print "can reach. They"
+        print "                 can then read any file the server can."
+        print "  --filter-out   write the reads that pass every filter to FILE,",
+        print "gzipped if it"
+        print "                 ends in .gz or --compress-level is given"
+        print "  --min-qual     drop reads whose average quality score is below C"
+        print "  --trim-qual    trim low quality bases below C from the 3' end",
+        print "first"
+        print "  --min-length, --max-length  drop reads outside this length"
+        print "  --max-n        drop reads with a larger fraction of Ns"
+        print "  --require      drop reads that have none of the patterns",
+        print "given, one each"
+        print "  --exclude      drop reads that have any of the patterns given,",
+        print "one each"
+        print "  -q, --quiet    don't print progress messages"
+        print "  --progress     show a progress bar on stderr while reading in"
+        print "  --timings      print how long each step took"
+        print "  --log FILE     append the timings of each step and query to",
+        print "FILE as JSON"
+        print "With any of these, each file is answered in turn without",
+        print "prompting and - or"
+        print "no file at all reads from standard input."
         exit(1)
 
 
-# Runs program and and handles UI until x passed in by user.
-def runLoop(sequences):
+# Runs program and and handles UI until x passed in by user. sequences
+# is a FastqReporter, or a FastqEstimateReporter with --estimate until
+# option w reads the file in with the options in args.
+def runLoop(sequences, args):
         running = True
         options()
         while (running):
@@ -53,6 +604,13 @@ def runLoop(sequences):
                 choice = choice.lower()  # So users can enter caps or not
                 print
 
+                if isinstance(sequences, FastqEstimator) and \
+                                choice in EXACT_OPTIONS:
+                        print "Option " + choice + " needs the whole file read",
+                        print "in, use option w to read it in first"
+                        print
+                        continue
+
                 if choice == 'a':
                         sequences.printAvgQualScore()
                 elif choice == 'b':
@@ -69,15 +627,24 @@ def runLoop(sequences):
                         print
                 elif choice == 'd':
                         detailedHelp()
+                elif choice == 'e':
+                        sequences.printFileSummaries()
+                elif choice == 'f':
+                        sequences.printRefresh()
                 elif choice == 'g':
                         sequences.printGC_AT()
+                elif choice == 'i':
+                        sequences.printDuplication()
                 elif choice == 'l':
                         sequences.printAvgReadLength()
                 elif choice == 'm':
                         seq = getSeq()
                         if seq == None:  # Invalid sequence pased in
                                 continue
-                        sequences.printNumMatches(seq)
+                        errors = getErrors()
+                        if errors == None:
+                                continue
+                        sequences.printNumMatches(seq, *errors)
                 elif choice == 'n':
                         sequences.printNumReads()
                 elif choice == 'o':
@@ -89,10 +656,25 @@ def runLoop(sequences):
                         if qScore == None:  # Signal that it was invalid qscre
                                 continue
                         sequences.printNumQualSeqs(qScore)
+                elif choice == 'k':
+                        k = getK()
+                        if k == None:
+                                continue
+                        sequences.printKmerSpectrum(k)
                 elif choice == 'r':
                         sequences.printRandomSeq()
+                elif choice == 's':
+                        sequences.printOverrepresentedSeqs()
                 elif choice == 'u':
                         sequences.printNumNucs()
+                elif choice == 'w':
+                        if not isinstance(sequences, FastqEstimator):
+                                print "The whole file is already read in"
+                                print
+                                continue
+                        sequences = sequences.getExact(**getOptions(args))
+                        print "Read in the whole file, answers are now exact"
+                        print
                 elif choice == 'x':
                         print "Goodbye"
                         running = False
@@ -149,15 +731,33 @@ def detailedHelp():
                 " it. The character entered by the user cannot be" +\
                 " whitespace, and it must only be one character long."
         print "d -- Prints this message."
+        print "e -- Prints the number of reads, average read length," +\
+                " average quality score and G/C content of each file. The" +\
+                " program must be started with several files and --sample" +\
+                " or --paired for there to be more than one."
+        print "f -- Reads in the reads that have been added to the end of" +\
+                " the file since it was opened, for files that are still" +\
+                " being written. The program must be started with --tail."
         print "g -- Get the G/C A/T content for all of the reads. This" +\
                 " feature does not include 'N' nucleotides in its" +\
                 " calculation."
+        print "i -- Prints the percent of reads whose sequence is the same" +\
+                " as an earlier read's. Large files are estimated with a" +\
+                " sketch that uses a fixed amount of memory."
+        print "k -- Prints how many distinct k-mers (sequences of length k" +\
+                " that the user enters) were seen once, twice and so on." +\
+                " K-mers seen only once or twice are mostly sequencing" +\
+                " errors."
         print "l -- Get the average number of nucleotides in each read in" +\
                 " the sample."
         print "m -- Prints the number of reads that have an exact match of" +\
                 " a nucleotide sequence entered by the user. Valid char" +\
                 "acters are 'A', 'C', 'G', 'T', 'N'. 'N' acts as a wildcard" +\
-                "  and matches any nucleotide."
+                "  and matches any nucleotide. Matches can be allowed a" +\
+                " number of mismatches, or of mismatches, insertions and" +\
+                " deletions, and the reverse complement of the sequence" +\
+                " can be searched for too, in which case the number of" +\
+                " reads found with each number of errors is also printed."
         print "n -- Prints the total number of reads in the sample."
         print "o -- Prints the options list."
         print "p -- Prints the number of single-sided pages it would take" +\
@@ -167,8 +767,15 @@ def detailedHelp():
                 " between ! (33) and ~ (126)"
         print "r -- Randomly select and print one reads exactly as it" +\
                 " appeared in the FASTQ file."
+        print "s -- Prints the ten sequences that the most reads have, with" +\
+                " the number and percent of reads that have each one."
         print "u -- Print the total number of nucleotides of each type in" +\
                 " the sample."
+        print "w -- Reads in the whole file, when the program was started" +\
+                " with --estimate, so that answers are exact rather than" +\
+                " estimated from reads sampled at random. Options a, g, l," +\
+                " m, n and q are estimated until then, with a 95%" +\
+                " confidence interval, and the others need the whole file."
 
         print "x -- Exit the program."
         print
@@ -181,20 +788,45 @@ def options():
         print "b -- Convert a number to ascii character"
         print "c -- Convert an ascii character to a number"
         print "d -- Detailed help"
+        print "e -- Statistics of each file"
+        print "f -- Read in reads added to the file since it was opened"
         print "g -- G/C and A/T content of all reads"
+        print "i -- Percent of duplicate reads"
+        print "k -- Number of k-mers seen each number of times"
         print "l -- Average read length of all reads"
-        print "m -- Number of reads that match an inputted sequence"
+        print "m -- Number of reads that match an inputted sequence," + \
+                        " allowing mismatches"
         print "n -- Total number of reads"
         print "o -- options"
         print "p -- Number of pages this file would be in 12-point font"
         print "q -- Number of quality scores at or above an inputted cutoff"
         print "r -- Randomly select and print sequence from this file"
+        print "s -- Most common read sequences"
         print "u -- Total number of each nucleotide in the file" 
+        print "w -- Read in the whole file for exact answers (--estimate)"
         print "x -- Exit"
         print
 
 
 
+# Returns a k-mer length that the user enters, or None after printing
+# an error message if it isn't between 1 and 32
+def getK():
+        try:
+                k = int(raw_input("What k-mer length would you like to use?\n"))
+        except ValueError:
+                print "Please enter a number for this functionality."
+                print
+                return None
+
+        if k < 1 or k > 32:
+                print "K-mer length must be between 1 and 32"
+                print
+                return None
+
+        return k
+
+
 # Gets a nucleotides sequence from the user.
 # This function controls for capitalization, and returns None
 # if any of the characters in the sequence are not A, C, G, T, or N.
@@ -211,6 +843,39 @@ def getSeq():
                 print
                 return None
 
+# Asks how many errors a match may have, whether insertions and deletions
+# count as errors and whether to search both strands. Returns them as a
+# tuple of (maxErrors, indels, bothStrands), or None after printing an
+# error message if the number isn't a whole number of at least 0.
+def getErrors():
+        errors = raw_input("How many mismatches may a match have? " + \
+                        "(press enter for none)\n").strip()
+        if errors == "":
+                errors = "0"
+        try:
+                maxErrors = int(errors)
+        except ValueError:
+                maxErrors = -1
+        if maxErrors < 0:
+                print "Please enter a whole number of mismatches."
+                print
+                return None
+
+        indels = False
+        if maxErrors > 0:
+                indels = getYesNo("Count insertions and deletions as " + \
+                                "mismatches too?")
+        bothStrands = getYesNo("Search the reverse complement too?")
+
+        return (maxErrors, indels, bothStrands)
+
+
+# Asks question and returns True if the answer starts with y
+def getYesNo(question):
+        answer = raw_input(question + " (y/n)\n")
+        return answer.strip().lower().startswith('y')
+
+
 # Returns True if a nucleotide sequence (has only A, C, T, G, or N)
 # and returns FAlse if it contains any other characters.
 # PRECONDITION: Sequence passed in must be in all caps.
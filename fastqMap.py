@@ -0,0 +1,262 @@
+#
+# fastqMap.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 1, 2014
+# Last Modified: Jun 1, 2014
+#
+# The FastqMap class reads an uncompressed FASTQ file through a memory
+# map instead of reading it in. Only the byte offset that each line
+# starts at is kept, plus the average quality score of each read, so the
+# largest file it can handle is limited by address space rather than
+# memory. Like FastqStore, it can be indexed and iterated over in place
+# of the list of reads, but reads are only copied out of the map when
+# they are asked for. getLineBuffer gives a line without copying it.
+#
+# Lines are found by scanning for newlines, a window at a time with NumPy
+# when it is installed. Line endings must be all "\n" or all "\r\n", and
+# other whitespace at the ends of lines is kept rather than stripped as
+# readIn does.
+#
+
+import mmap
+from array import array
+
+import fastqKernels
+
+try:
+        import numpy
+except ImportError:
+        numpy = None
+
+# Lines in each read
+ID_LINE = 0
+SEQ_LINE = 1
+STRAND_LINE = 2
+QSCORE_LINE = 3
+FASTQ_LINES = 4
+
+# Bytes scanned for newlines at a time
+WINDOW_BYTES = 1 << 26
+
+
+# Maps inputFile and finds its lines. Returns a FastqMap, or None if the
+# file is empty or mixes line endings, in which case it has to be read
+# in some other way. Raises IOError if the file can't be opened.
+def mapFile(inputFile):
+        with open(inputFile, 'rb') as filer:
+                try:
+                        buf = mmap.mmap(filer.fileno(), 0, \
+                                        access=mmap.ACCESS_READ)
+                except ValueError:
+                        # Empty files can't be mapped
+                        return None
+
+        starts = findLineStarts(buf)
+        newline = newlineLength(buf, starts)
+        if newline == None:
+                buf.close()
+                return None
+
+        # The end of the last line, as if it had a line ending too
+        if starts[-1] != len(buf):
+                starts.append(len(buf) + newline)
+
+        return FastqMap(buf, starts, newline)
+
+
+# Returns an array with the offset of the start of every line in buf,
+# plus the end of buf if it ends with a newline
+def findLineStarts(buf):
+        starts = array('L', [0])
+
+        if fastqKernels.USE_NUMPY:
+                dtype = numpy.dtype('u' + str(starts.itemsize))
+                for offset in xrange(0, len(buf), WINDOW_BYTES):
+                        window = numpy.frombuffer(buf, dtype=numpy.uint8, \
+                                count=min(WINDOW_BYTES, len(buf) - offset), \
+                                offset=offset)
+                        ends = numpy.flatnonzero(window == ord('\n'))
+                        starts.fromstring((ends + (offset + 1)).astype( \
+                                        dtype).tostring())
+
+                return starts
+
+        find = buf.find
+        pos = find('\n')
+        while pos != -1:
+                starts.append(pos + 1)
+                pos = find('\n', pos + 1)
+
+        return starts
+
+
+# Returns 2 if every line in buf that ends with a newline ends with
+# "\r\n", 1 if none do, or None if only some of them do
+def newlineLength(buf, starts):
+        ends = len(starts) - 1
+        if ends == 0 or buf.find('\r') == -1:
+                return 1
+
+        if fastqKernels.USE_NUMPY:
+                arr = numpy.frombuffer(buf, dtype=numpy.uint8)
+                before = numpy.frombuffer(starts, dtype=numpy.dtype('u' + \
+                                str(starts.itemsize)))[1:].astype(numpy.intp) - 2
+                crlf = int(numpy.count_nonzero(arr[before[before >= 0]] == \
+                                ord('\r')))
+        else:
+                crlf = 0
+                for start in starts[1:]:
+                        if start >= 2 and buf[start - 2] == '\r':
+                                crlf += 1
+
+        if crlf == 0:
+                return 1
+        if crlf == ends:
+                return 2
+
+        return None
+
+
+class FastqMap:
+        ################### Public API ###################
+        # Returns the number of whole reads in the file, ignoring any lines
+        # left over at the end
+        def getNumRecords(self):
+                return self.getNumLines() // FASTQ_LINES
+
+
+        # Returns the number of lines in the file
+        def getNumLines(self):
+                return len(self.starts) - 1
+
+
+        # Returns line k of the file without its line ending
+        def getLine(self, k):
+                return self.buf[self.starts[k]:self.starts[k + 1] - \
+                                self.newline]
+
+
+        # Returns line k of the file as a buffer into the map rather than
+        # a copy
+        def getLineBuffer(self, k):
+                start = self.starts[k]
+                return buffer(self.buf, start, self.starts[k + 1] - \
+                                self.newline - start)
+
+
+        # Returns the lengths of line number line (one of ID_LINE to
+        # QSCORE_LINE) of reads first up to but not including last
+        def getLineLengths(self, first, last, line):
+                starts = self.starts
+                newline = self.newline
+                return [starts[k + 1] - newline - starts[k] for k in \
+                        xrange(first * FASTQ_LINES + line, \
+                                last * FASTQ_LINES, FASTQ_LINES)]
+
+
+        # Returns line number line of reads first up to but not including
+        # last joined together, along with the offsets each one starts at
+        # in it and the total length at the end
+        def gatherLines(self, first, last, line):
+                starts = self.starts[first * FASTQ_LINES + line: \
+                                last * FASTQ_LINES:FASTQ_LINES]
+                lengths = self.getLineLengths(first, last, line)
+
+                offsets = [0]
+                for length in lengths:
+                        offsets.append(offsets[-1] + length)
+
+                return (fastqKernels.gatherRanges(self.buf, starts, lengths), \
+                                offsets)
+
+
+        # Returns the four lines of read i as [ID, SEQ, STRAND-SENSE,
+        # QSCORE]. Unlike indexing, this works before the average quality
+        # score of the read is known.
+        def getRecord(self, i):
+                first = i * FASTQ_LINES
+                return [self.getLine(first + ID_LINE),
+                        self.getLine(first + SEQ_LINE),
+                        self.getLine(first + STRAND_LINE),
+                        self.getLine(first + QSCORE_LINE)]
+
+
+        # Returns the nucleotides of read i
+        def getSeq(self, i):
+                return self.getLine(i * FASTQ_LINES + SEQ_LINE)
+
+
+        # Returns the average quality score of read i
+        def getQScore(self, i):
+                return self.means[i]
+
+
+        # Returns '+' or '-' for read i
+        def getStrand(self, i):
+                return self.getLine(i * FASTQ_LINES + STRAND_LINE)
+
+
+        # Yields the nucleotides of each read in order
+        def iterSeqs(self):
+                for i in xrange(len(self)):
+                        yield self.getSeq(i)
+
+
+        # Yields the average quality score of each read in order
+        def iterQScores(self):
+                for qScore in self.means:
+                        yield qScore
+
+
+        # Returns the number of bytes used by the arrays. The map itself is
+        # paged in and out by the operating system.
+        def memoryFootprint(self):
+                return self.starts.itemsize * len(self.starts) + \
+                                self.means.itemsize * len(self.means)
+
+
+        # Returns the byte offset that each read starts at
+        def getReadOffsets(self):
+                return self.starts[:len(self) * FASTQ_LINES:FASTQ_LINES]
+
+
+        # Unmaps the file. The FastqMap can't be used after this.
+        def close(self):
+                self.buf.close()
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # buf is the mapped file, starts the offset of each line in it
+        # with one more for the end of the last line, and newline the
+        # length of the line endings. The average quality scores in means
+        # are filled in as the reads are read in.
+        def __init__(self, buf, starts, newline):
+                self.buf = buf
+                self.starts = starts
+                self.newline = newline
+                self.means = array('d')
+
+
+        # Number of reads whose average quality score is known
+        def __len__(self):
+                return len(self.means)
+
+
+        # Builds the [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE] list for
+        # read i. Negative indices count from the end as with lists.
+        def __getitem__(self, i):
+                if i < 0:
+                        i += len(self)
+                if i < 0 or i >= len(self):
+                        raise IndexError("FastqMap index out of range")
+
+                seq = self.getRecord(i)
+                seq.append(self.means[i])
+                return seq
+
+
+        def __iter__(self):
+                for i in xrange(len(self)):
+                        yield self[i]
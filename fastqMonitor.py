@@ -0,0 +1,371 @@
+#
+# fastqMonitor.py
+# Author: Philip Braunstein
+#
+# Date Created: May 30, 2014
+# Last Modified: May 30, 2014
+#
+# Monitors are where FastqKeeper sends word of what it is doing. Each
+# phase of reading a file in, and each query, is timed between begin and
+# end, with progress in between. The record of a finished phase has its
+# wall time, CPU time, bytes and reads per second and the memory
+# high-water mark of the process so far.
+#
+#   Monitor          - keeps the records and says nothing
+#   NullMonitor      - does nothing at all, the off switch
+#   PrintMonitor     - prints the same messages FastqKeeper always has
+#   CallbackMonitor  - passes every event to a function
+#   LogMonitor       - writes every event to a file as a line of JSON
+#   ProgressMonitor  - draws a progress bar with an ETA based on how far
+#                      through the file reading in has got
+#
+# Other monitors can be made by overriding started, advanced, finished
+# and said, which the Monitor calls for each event.
+#
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from functools import wraps
+
+try:
+        import resource
+except ImportError:
+        resource = None
+
+
+# Returns the user plus system CPU time of this process in seconds
+def cpuTime():
+        times = os.times()
+        return times[0] + times[1]
+
+
+# Returns the peak resident set size of this process in bytes, or None
+# where it can't be found out
+def peakRss():
+        if resource == None:
+                return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        # Linux reports kilobytes, macOS bytes
+        if sys.platform != "darwin":
+                peak *= 1024
+
+        return peak
+
+
+# Decorates a FastqKeeper method so each call is timed as a phase named
+# after it. Costs one attribute lookup when the monitor is switched off.
+def monitored(method):
+        name = method.__name__
+
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+                monitor = self.monitor
+                if not monitor.enabled:
+                        return method(self, *args, **kwargs)
+
+                monitor.begin(name)
+                try:
+                        return method(self, *args, **kwargs)
+                finally:
+                        monitor.end()
+
+        return wrapper
+
+
+# One timed phase. totalBytes and totalReads, when known, are how far
+# position and reads will get by the end.
+class Phase:
+        def __init__(self, name, totalBytes=None, totalReads=None):
+                self.name = name
+                self.totalBytes = totalBytes
+                self.totalReads = totalReads
+                self.position = 0
+                self.reads = 0
+                self.start = time.time()
+                self.startCpu = cpuTime()
+                self.wall = None
+                self.cpu = None
+                self.maxRss = None
+
+
+        # Returns how much of the phase is done between 0 and 1, or None
+        # if that isn't known
+        def getFraction(self):
+                if self.totalBytes:
+                        return min(float(self.position) / self.totalBytes, 1.0)
+                if self.totalReads:
+                        return min(float(self.reads) / self.totalReads, 1.0)
+
+                return None
+
+
+        # Returns the wall time so far, or the total once finished
+        def getElapsed(self):
+                if self.wall != None:
+                        return self.wall
+
+                return time.time() - self.start
+
+
+        def getBytesPerSecond(self):
+                return self.position / max(self.getElapsed(), 1e-6)
+
+
+        def getReadsPerSecond(self):
+                return self.reads / max(self.getElapsed(), 1e-6)
+
+
+        def finish(self):
+                self.wall = time.time() - self.start
+                self.cpu = cpuTime() - self.startCpu
+                self.maxRss = peakRss()
+
+
+        # Returns the phase as an OrderedDict, for logs and callbacks
+        def toDict(self):
+                fields = OrderedDict()
+                fields["phase"] = self.name
+                fields["wall"] = self.getElapsed()
+                fields["cpu"] = self.cpu
+                fields["bytes"] = self.position
+                fields["reads"] = self.reads
+                fields["bytesPerSecond"] = self.getBytesPerSecond()
+                fields["readsPerSecond"] = self.getReadsPerSecond()
+                fields["fraction"] = self.getFraction()
+                fields["maxRss"] = self.maxRss
+
+                return fields
+
+
+class Monitor:
+        enabled = True
+
+        ################### Public API ###################
+        # Starts timing the phase name. text is what to tell the user, if
+        # anything.
+        def begin(self, name, text=None, totalBytes=None, totalReads=None):
+                phase = Phase(name, totalBytes, totalReads)
+                self.current.append(phase)
+                self.started(phase, text)
+
+
+        # Notes that the current phase has got position bytes into the
+        # file and through reads reads
+        def progress(self, position=None, reads=None):
+                phase = self.current[-1]
+                if position != None:
+                        phase.position = position
+                if reads != None:
+                        phase.reads = reads
+                self.advanced(phase)
+
+
+        # Stops timing the current phase, with the final position and
+        # reads if they weren't reported as progress
+        def end(self, position=None, reads=None):
+                phase = self.current.pop()
+                if position != None:
+                        phase.position = position
+                if reads != None:
+                        phase.reads = reads
+                phase.finish()
+
+                self.records.append(phase)
+                self.finished(phase)
+
+
+        # Tells the user text
+        def message(self, text=""):
+                self.said(text)
+
+
+        # Returns the records of finished phases named name, or of all of
+        # them
+        def getRecords(self, name=None):
+                if name == None:
+                        return list(self.records)
+
+                return [phase for phase in self.records if phase.name == name]
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        def __init__(self):
+                self.records = []
+                self.current = []
+
+
+        # Called for each event, to be overridden
+        def started(self, phase, text):
+                pass
+
+
+        def advanced(self, phase):
+                pass
+
+
+        def finished(self, phase):
+                pass
+
+
+        def said(self, text):
+                pass
+
+
+# Does nothing and keeps nothing
+class NullMonitor(Monitor):
+        enabled = False
+
+        def begin(self, name, text=None, totalBytes=None, totalReads=None):
+                pass
+
+
+        def progress(self, position=None, reads=None):
+                pass
+
+
+        def end(self, position=None, reads=None):
+                pass
+
+
+        def message(self, text=""):
+                pass
+
+
+# Prints messages to stdout as FastqKeeper always has. With timings=True
+# it also prints how long each phase took.
+class PrintMonitor(Monitor):
+        def __init__(self, timings=False):
+                Monitor.__init__(self)
+                self.timings = timings
+
+
+        def started(self, phase, text):
+                if text != None:
+                        print text
+
+
+        def finished(self, phase):
+                if self.timings:
+                        print "  " + phase.name, "took", round(phase.wall, 2), \
+                                "seconds"
+
+
+        def said(self, text):
+                print text
+
+
+# Calls callback(event, fields) for every event. event is one of
+# "begin", "progress", "end" and "message". fields is the phase's
+# toDict, or {"text": text} for messages.
+class CallbackMonitor(Monitor):
+        def __init__(self, callback):
+                Monitor.__init__(self)
+                self.callback = callback
+
+
+        def started(self, phase, text):
+                self.callback("begin", phase.toDict())
+
+
+        def advanced(self, phase):
+                self.callback("progress", phase.toDict())
+
+
+        def finished(self, phase):
+                self.callback("end", phase.toDict())
+
+
+        def said(self, text):
+                self.callback("message", {"text": text})
+
+
+# Writes every event to filew as a line of JSON with the time it happened
+class LogMonitor(CallbackMonitor):
+        def __init__(self, filew):
+                CallbackMonitor.__init__(self, self.write)
+                self.filew = filew
+
+
+        def write(self, event, fields):
+                record = OrderedDict()
+                record["time"] = time.time()
+                record["event"] = event
+                record.update(fields)
+
+                self.filew.write(json.dumps(record) + "\n")
+                self.filew.flush()
+
+
+# Draws a progress bar for the current phase on filew, redrawn at most
+# every interval seconds. Messages are written above it.
+class ProgressMonitor(Monitor):
+        def __init__(self, filew=sys.stderr, width=30, interval=0.2):
+                Monitor.__init__(self)
+                self.filew = filew
+                self.width = width
+                self.interval = interval
+                self.lastDraw = 0.0
+
+
+        def started(self, phase, text):
+                self.draw(phase)
+
+
+        def advanced(self, phase):
+                if time.time() - self.lastDraw >= self.interval:
+                        self.draw(phase)
+
+
+        def finished(self, phase):
+                self.draw(phase)
+                self.filew.write("\n")
+                self.filew.flush()
+
+
+        def said(self, text):
+                if text != "":
+                        self.filew.write("\r\033[K" + text + "\n")
+                        self.filew.flush()
+
+
+        # Redraws the line for phase in place
+        def draw(self, phase):
+                self.lastDraw = time.time()
+                fraction = phase.getFraction()
+                if phase.wall != None:
+                        fraction = 1.0
+
+                line = phase.name.ljust(16)
+                if fraction != None:
+                        done = int(round(fraction * self.width))
+                        line += " [" + "#" * done + " " * (self.width - done) + \
+                                        "] " + str(int(fraction * 100)).rjust(3) + "%"
+
+                if phase.position > 0:
+                        line += " " + str(round(phase.getBytesPerSecond() / \
+                                        (1024.0 * 1024.0), 1)) + " MB/s"
+                if phase.reads > 0:
+                        line += " " + str(int(phase.getReadsPerSecond())) + \
+                                        " reads/s"
+
+                if phase.wall != None:
+                        line += " in " + formatSeconds(phase.wall)
+                elif fraction != None and fraction > 0:
+                        remaining = phase.getElapsed() * (1 - fraction) / fraction
+                        line += " ETA " + formatSeconds(remaining)
+
+                self.filew.write("\r\033[K" + line)
+                self.filew.flush()
+
+
+# Returns seconds as H:MM:SS
+def formatSeconds(seconds):
+        seconds = int(round(seconds))
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, \
+                        seconds % 60)
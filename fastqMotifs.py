@@ -0,0 +1,333 @@
+#
+# fastqMotifs.py
+# Author: Philip Braunstein
+#
+# Date Created: May 28, 2014
+# Last Modified: May 28, 2014
+#
+# The MotifMatcher class finds which of many patterns occur in a read in
+# one pass over its nucleotides, using an Aho-Corasick automaton.
+#
+# Ns in a pattern match any one character, as in getNumMatches. Only the
+# longest run of A, C, G and T between the Ns of each pattern goes in the
+# automaton. Where that run is found, the pattern can only start at one
+# position in the read, so the whole pattern is checked there with a
+# regular expression. Patterns without Ns need no check. Patterns that
+# are all Ns match every read at least as long as they are.
+#
+# Reads are translated to one small number per character first, so each
+# state's transitions are a short list rather than a dict. Characters
+# other than A, C, G and T (N, lower case) never appear in a fragment and
+# send the automaton back to the start.
+#
+# The ApproximateMatcher class finds how few errors one pattern can be
+# found in a read with: mismatches only, using the bit-parallel shift-and
+# of Wu and Manber with a state word per number of errors, or mismatches,
+# insertions and deletions, using Myers' bit-vector edit distance. Either
+# way each read takes one pass over its nucleotides, with a few integer
+# operations per nucleotide whatever the pattern length. Ns in the pattern
+# match anything, Ns in the read only an N in the pattern.
+#
+
+import re
+
+# Characters fragments are made of, numbered from 1. Everything else is 0.
+ALPHABET = "ACGT"
+CLASSES = "".join([chr(ALPHABET.index(chr(i)) + 1) if chr(i) in ALPHABET \
+                else "\0" for i in range(256)])
+
+# Pattern characters that the characters of ALPHABET pair with
+COMPLEMENTS = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'N': 'N'}
+
+
+# Returns the reverse complement of pattern, a string of A, C, G, T and N
+def reverseComplement(pattern):
+        return "".join([COMPLEMENTS[nuc] for nuc in reversed(pattern)])
+
+
+class MotifMatcher:
+        ################### Public API ###################
+        # Returns the sorted indexes into patterns of the patterns that
+        # occur in seq
+        def match(self, seq):
+                length = len(seq)
+                matched = [i for i in self.wildcards \
+                                if self.lengths[i] <= length]
+                if self.numFragments == 0:
+                        return matched
+
+                found = set(matched)
+                goto = self.goto
+                output = self.output
+                lengths = self.lengths
+
+                state = 0
+                end = 0
+                for char in bytearray(seq.translate(CLASSES)):
+                        end += 1
+                        state = goto[state][char]
+
+                        hits = output[state]
+                        if hits == None:
+                                continue
+
+                        # (pattern, start of fragment in pattern, fragment
+                        # length, regex to check the whole pattern with)
+                        for (i, offset, fragLen, regex) in hits:
+                                if i in found:
+                                        continue
+
+                                start = end - fragLen - offset
+                                if start < 0 or start + lengths[i] > length:
+                                        continue
+
+                                if regex != None and \
+                                        regex.match(seq, start) == None:
+                                        continue
+
+                                found.add(i)
+                                matched.append(i)
+
+                matched.sort()
+                return matched
+
+
+        # Returns the number of states in the automaton
+        def getNumStates(self):
+                return len(self.goto)
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # patterns are strings of A, C, G, T and N
+        def __init__(self, patterns):
+                self.patterns = list(patterns)
+                self.lengths = [len(pattern) for pattern in self.patterns]
+
+                # Patterns with no fragments at all
+                self.wildcards = []
+
+                self.numFragments = 0
+                self.goto = [[0] * (len(ALPHABET) + 1)]
+                self.output = [None]
+                children = [{}]
+
+                for i, pattern in enumerate(self.patterns):
+                        (offset, fragment) = self.longestFragment(pattern)
+                        if fragment == "":
+                                self.wildcards.append(i)
+                                continue
+
+                        regex = None
+                        if len(fragment) < len(pattern):
+                                regex = re.compile(pattern.replace('N', '.'))
+
+                        self.numFragments += 1
+                        state = self.insert(fragment, children)
+                        if self.output[state] == None:
+                                self.output[state] = []
+                        self.output[state].append((i, offset, len(fragment), \
+                                regex))
+
+                self.link(children)
+
+
+        # Returns the longest run of pattern between its Ns as a tuple of
+        # (offset, fragment)
+        def longestFragment(self, pattern):
+                longest = (0, "")
+                offset = 0
+                for fragment in pattern.split('N'):
+                        if len(fragment) > len(longest[1]):
+                                longest = (offset, fragment)
+                        offset += len(fragment) + 1
+
+                return longest
+
+
+        # Adds the states spelling out fragment to the trie and returns
+        # the state it ends in
+        def insert(self, fragment, children):
+                state = 0
+                for char in bytearray(fragment.translate(CLASSES)):
+                        child = children[state].get(char)
+                        if child == None:
+                                child = len(self.goto)
+                                self.goto.append([0] * (len(ALPHABET) + 1))
+                                self.output.append(None)
+                                children.append({})
+                                children[state][char] = child
+                        state = child
+
+                return state
+
+
+        # Turns the trie into an automaton. Breadth first, each state's
+        # missing transitions are filled in from its failure state (the
+        # longest proper suffix that is also in the trie) and it takes on
+        # the output of its failure state.
+        def link(self, children):
+                fail = [0] * len(self.goto)
+                queue = []
+
+                for char, child in children[0].items():
+                        self.goto[0][char] = child
+                        queue.append(child)
+
+                for state in queue:
+                        for char in range(1, len(ALPHABET) + 1):
+                                child = children[state].get(char)
+                                if child == None:
+                                        self.goto[state][char] = \
+                                                self.goto[fail[state]][char]
+                                        continue
+
+                                self.goto[state][char] = child
+                                fail[child] = self.goto[fail[state]][char]
+                                queue.append(child)
+
+                                inherited = self.output[fail[child]]
+                                if inherited != None:
+                                        self.output[child] = \
+                                                (self.output[child] or []) + \
+                                                inherited
+
+
+class ApproximateMatcher:
+        ################### Public API ###################
+        # Returns the fewest errors that the pattern occurs with anywhere
+        # in seq, on either strand if asked for, or None if that is more
+        # than maxErrors
+        def distance(self, seq):
+                if self.regex.search(seq) != None:
+                        return 0
+                if self.maxErrors == 0:
+                        return None
+
+                chars = bytearray(seq.translate(CLASSES))
+                best = None
+                for masks in self.strands:
+                        if self.indels:
+                                errors = self.editDistance(chars, masks)
+                        else:
+                                errors = self.hammingDistance(chars, masks)
+
+                        if errors != None and (best == None or errors < best):
+                                best = errors
+
+                return best
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # pattern is a string of A, C, G, T and N. maxErrors is the most
+        # mismatches, or with indels=True mismatches, insertions and
+        # deletions, an occurrence may have. bothStrands also looks for
+        # the reverse complement of pattern.
+        def __init__(self, pattern, maxErrors, indels=False, \
+                        bothStrands=False):
+                self.pattern = pattern
+                self.maxErrors = maxErrors
+                self.indels = indels
+                self.length = len(pattern)
+                self.full = (1 << self.length) - 1
+                self.high = 1 << max(self.length - 1, 0)
+
+                patterns = [pattern]
+                if bothStrands and reverseComplement(pattern) != pattern:
+                        patterns.append(reverseComplement(pattern))
+
+                # Reads with an exact occurrence need no bit vectors
+                self.regex = re.compile("|".join([p.replace('N', '.') \
+                                for p in patterns]))
+
+                # The bit mask of each character class for each strand
+                self.strands = [self.charMasks(p) for p in patterns]
+
+
+        # Returns a list with a mask for each character class (see
+        # CLASSES) that has bit i set if the class matches pattern[i]
+        def charMasks(self, pattern):
+                masks = [0] * (len(ALPHABET) + 1)
+                for i, nuc in enumerate(pattern):
+                        if nuc == 'N':
+                                for char in range(len(masks)):
+                                        masks[char] |= 1 << i
+                        else:
+                                masks[ALPHABET.index(nuc) + 1] |= 1 << i
+
+                return masks
+
+
+        # Returns the fewest mismatches pattern occurs with in chars, or
+        # None if it is more than maxErrors. states[e] has bit i set if
+        # the first i + 1 characters of pattern end at the current
+        # character with at most e mismatches.
+        def hammingDistance(self, chars, masks):
+                maxErrors = self.maxErrors
+                full = self.full
+                high = self.high
+                states = [0] * (maxErrors + 1)
+                best = None
+
+                for char in chars:
+                        mask = masks[char]
+                        previous = states[0]
+                        states[0] = ((previous << 1) | 1) & mask
+                        for e in xrange(1, maxErrors + 1):
+                                current = states[e]
+                                # Match here, or mismatch on top of one
+                                # fewer errors
+                                states[e] = ((((current << 1) | 1) & mask) | \
+                                                (previous << 1) | 1) & full
+                                previous = current
+
+                        if states[maxErrors] & high:
+                                for e in xrange(maxErrors + 1):
+                                        if states[e] & high:
+                                                break
+                                if best == None or e < best:
+                                        best = e
+                                        if best == 0:
+                                                break
+
+                return best
+
+
+        # Returns the fewest edits pattern occurs with in chars, or None if
+        # it is more than maxErrors. Pv and Mv are the positions where the
+        # edit distance column goes up and down by one, and score is its
+        # last entry, the edits of the best occurrence ending here.
+        def editDistance(self, chars, masks):
+                full = self.full
+                high = self.high
+                Pv = full
+                Mv = 0
+                score = self.length
+                best = score
+
+                for char in chars:
+                        Eq = masks[char]
+                        Xv = Eq | Mv
+                        Xh = (((Eq & Pv) + Pv) ^ Pv) | Eq
+                        Ph = Mv | (~(Xh | Pv) & full)
+                        Mh = Pv & Xh
+
+                        if Ph & high:
+                                score += 1
+                        elif Mh & high:
+                                score -= 1
+                                if score < best:
+                                        best = score
+                                        if best == 0:
+                                                break
+
+                        Ph = (Ph << 1) & full
+                        Mh = (Mh << 1) & full
+                        Pv = Mh | (~(Xv | Ph) & full)
+                        Mv = Ph & Xv
+
+                if best > self.maxErrors:
+                        return None
+
+                return best
@@ -0,0 +1,229 @@
+#
+# fastqPacked.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 5, 2014
+# Last Modified: Jun 5, 2014
+#
+# The PackedSeqs class keeps the nucleotides of many reads in a quarter of
+# the memory of a str, for FastqStore to keep its reads' nucleotides in.
+# A, C, G and T are packed two bits each (see fastqKernels.packNucs), and
+# anything that isn't one of them is kept as well, sparsely:
+#
+#   - runs of other characters, such as N, with the characters themselves
+#   - runs of lower case a, c, g and t
+#
+# so that unpacking gives back exactly the nucleotides that were added.
+# Nucleotides are packed PACK_BASES at a time as they are added; the last
+# few are kept unpacked until there are enough of them.
+#
+# The nucleotides are counted (countBases) and searched (countMatches)
+# without unpacking them, see fastqKernels.
+#
+
+import re
+from array import array
+from bisect import bisect_right
+
+import fastqKernels
+
+# Nucleotides added before they are packed
+PACK_BASES = 1 << 16
+
+# Characters that are packed as themselves, and lower case ones, which
+# are packed as upper case
+PACKED_CHARS = "ACGTacgt"
+LOWER_CHARS = "acgt"
+
+# Characters that are packed as something they aren't
+EXCEPTION_CHARS = "".join([chr(i) for i in range(256) \
+                if chr(i) not in PACKED_CHARS])
+
+class PackedSeqs:
+        ################### Public API ###################
+        # Adds nucleotides, a str or bytearray, to the end
+        def extend(self, nucs):
+                if isinstance(nucs, PackedSeqs):
+                        self.extendPacked(nucs)
+                        return
+
+                self.pending.extend(nucs)
+                if len(self.pending) >= PACK_BASES:
+                        self.pack()
+
+
+        # Returns a tuple of the number of (A, C, G, T, N, other)
+        # nucleotides in either case, counted from the packed codes
+        def countBases(self):
+                (A, C, G, T) = fastqKernels.countPacked(self.packed)
+
+                # Exceptions were packed as A
+                A -= len(self.excBytes)
+                excs = str(self.excBytes)
+                N = excs.count('N') + excs.count('n')
+
+                pending = fastqKernels.countNucs(self.pending)
+                counts = (A + pending[0], C + pending[1], G + pending[2], \
+                                T + pending[3], N + pending[4])
+
+                return counts + (len(self) - sum(counts),)
+
+
+        # Returns the number of reads that have pattern, where read i
+        # spans nucleotides offsets[i] to offsets[i + 1]. pattern is upper
+        # case A, C, G, T and N, and is matched as getNumMatches matches
+        # it: Ns in pattern match anything and lower case nucleotides and
+        # Ns only an N in pattern.
+        def countMatches(self, pattern, offsets):
+                numReads = len(offsets) - 1
+                if pattern == "":
+                        return numReads
+
+                # Reads that are all packed are searched without unpacking
+                packedReads = bisect_right(offsets, len(self.packed) * 4) - 1
+                count = 0
+                if packedReads > 0:
+                        count = fastqKernels.packedMatches(self.packed, \
+                                offsets[:packedReads + 1], pattern, \
+                                [(self.excStarts, self.excEnds), \
+                                (self.lowStarts, self.lowEnds)])
+
+                regex = re.compile(pattern.replace('N', '.'))
+                for i in xrange(max(packedReads, 0), numReads):
+                        if regex.search(self[offsets[i]:offsets[i + 1]]) != \
+                                        None:
+                                count += 1
+
+                return count
+
+
+        # Returns the number of bytes used by the buffers and arrays
+        def memoryFootprint(self):
+                total = len(self.packed) + len(self.pending) + \
+                                len(self.excBytes)
+
+                for column in [self.excStarts, self.excEnds, self.excOffsets, \
+                                self.lowStarts, self.lowEnds]:
+                        total += column.itemsize * len(column)
+
+                return total
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Starts out empty, nucleotides are added with extend
+        def __init__(self):
+                self.packed = bytearray()
+                self.pending = bytearray()
+
+                # Run i of other characters spans excStarts[i] to
+                # excEnds[i], and the characters start at excOffsets[i]
+                # in excBytes
+                self.excStarts = array('L')
+                self.excEnds = array('L')
+                self.excOffsets = array('L')
+                self.excBytes = bytearray()
+
+                # Runs of lower case nucleotides
+                self.lowStarts = array('L')
+                self.lowEnds = array('L')
+
+
+        def __len__(self):
+                return len(self.packed) * 4 + len(self.pending)
+
+
+        # Unpacks the nucleotides in a slice, which must have no step
+        def __getitem__(self, key):
+                (start, end, step) = key.indices(len(self))
+                if start >= end:
+                        return ""
+
+                packedLen = len(self.packed) * 4
+                nucs = ""
+                if start < packedLen:
+                        nucs = self.unpack(start, min(end, packedLen))
+                if end > packedLen:
+                        nucs += str(self.pending[max(start - packedLen, 0): \
+                                        end - packedLen])
+
+                return nucs
+
+
+        # For Python 2, which slices old-style classes with __getslice__
+        def __getslice__(self, start, end):
+                return self.__getitem__(slice(start, end))
+
+
+        # Returns nucleotides start to end of the packed ones as they were
+        # added
+        def unpack(self, start, end):
+                nucs = bytearray(fastqKernels.unpackNucs(self.packed, start, \
+                                end))
+
+                i = bisect_right(self.lowEnds, start)
+                while i < len(self.lowStarts) and self.lowStarts[i] < end:
+                        first = max(self.lowStarts[i], start) - start
+                        last = min(self.lowEnds[i], end) - start
+                        nucs[first:last] = nucs[first:last].lower()
+                        i += 1
+
+                i = bisect_right(self.excEnds, start)
+                while i < len(self.excStarts) and self.excStarts[i] < end:
+                        first = max(self.excStarts[i], start)
+                        last = min(self.excEnds[i], end)
+                        offset = self.excOffsets[i] - self.excStarts[i]
+                        nucs[first - start:last - start] = \
+                                self.excBytes[offset + first:offset + last]
+                        i += 1
+
+                return str(nucs)
+
+
+        # Packs as many of the pending nucleotides as fill whole bytes
+        def pack(self):
+                length = len(self.pending) - len(self.pending) % 4
+                nucs = str(self.pending[:length])
+                base = len(self.packed) * 4
+
+                (starts, ends, offsets) = fastqKernels.findRuns(nucs, \
+                                EXCEPTION_CHARS, base)
+                excBase = len(self.excBytes)
+                self.excStarts.extend(starts)
+                self.excEnds.extend(ends)
+                self.excOffsets.extend([offset + excBase for offset in \
+                                offsets])
+                self.excBytes.extend(nucs.translate(None, PACKED_CHARS))
+
+                (starts, ends, offsets) = fastqKernels.findRuns(nucs, \
+                                LOWER_CHARS, base)
+                self.lowStarts.extend(starts)
+                self.lowEnds.extend(ends)
+
+                self.packed.extend(fastqKernels.packNucs(nucs))
+                del self.pending[:length]
+
+
+        # Adds the nucleotides of another PackedSeqs. Its packed bytes are
+        # copied as they are if this one ends on a whole byte.
+        def extendPacked(self, other):
+                if len(self.pending) != 0:
+                        for start in xrange(0, len(other), PACK_BASES):
+                                self.extend(other[start:start + PACK_BASES])
+                        return
+
+                base = len(self.packed) * 4
+                excBase = len(self.excBytes)
+
+                self.packed.extend(other.packed)
+                self.excStarts.extend([start + base for start in \
+                                other.excStarts])
+                self.excEnds.extend([end + base for end in other.excEnds])
+                self.excOffsets.extend([offset + excBase for offset in \
+                                other.excOffsets])
+                self.excBytes.extend(other.excBytes)
+                self.lowStarts.extend([start + base for start in \
+                                other.lowStarts])
+                self.lowEnds.extend([end + base for end in other.lowEnds])
+
+                self.extend(other.pending)
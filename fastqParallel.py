@@ -0,0 +1,209 @@
+#
+# fastqParallel.py
+# Author: Philip Braunstein
+#
+# Date Created: May 22, 2014
+# Last Modified: May 22, 2014
+#
+# Functions FastqKeeper uses to read in one FASTQ file with several
+# processes. The file is split at byte offsets into one chunk per worker,
+# each split is moved forward to the start of the next read, and the
+# chunks are read in by a process pool. The totals and reads from each
+# chunk are then merged in file order.
+#
+# parseFiles reads in a sample made of several files the same way, with
+# one process per file, or per pair of files for paired-end reads.
+#
+
+import os
+from multiprocessing import Pool
+
+from fastqInput import InputStats
+from fastqRecordIndex import FastqRecordIndex
+from fastqStats import FastqStats
+from fastqStore import FastqStore
+from fastqStore import PACKED
+
+# The FastqKeeper doing the reading in, set in each worker process
+keeper = None
+
+# Number of lines to look through for the start of a read. Two reads'
+# worth is always enough to find one.
+SYNC_LINES = 8
+
+
+# Returns a list of (start, end) byte offsets that split inputFile into
+# at most workers chunks. Every start is the beginning of a read, and
+# the last chunk's end is None.
+def findChunks(fastqKeeper, inputFile, workers):
+        try:
+                size = os.path.getsize(inputFile)
+        except OSError:
+                raise Exception(fastqKeeper.IO_EXCEPTION.format(inputFile))
+
+        starts = [0]
+        with open(inputFile, 'r') as filer:
+                for i in range(1, workers):
+                        start = syncToRecord(filer, size * i // workers)
+
+                        # Small files may not have a read for every worker
+                        if start > starts[-1] and start < size:
+                                starts.append(start)
+
+        return zip(starts, starts[1:] + [None])
+
+
+# Returns the byte offset of the first read that starts at or after
+# offset, or the end of the file if there isn't one.
+#
+# A line beginning with '@' is not enough to find a read, since '@' is
+# also a valid quality score and may start a quality score line. An ID
+# line is the only '@' line followed two lines later by a strand-sense
+# line. After a quality score line, that would be a line of nucleotides.
+def syncToRecord(filer, offset):
+        # Finish the line offset falls in, unless it is already at the
+        # start of one
+        filer.seek(max(offset - 1, 0))
+        if offset > 0:
+                filer.readline()
+
+        positions = []
+        lines = []
+        for i in range(SYNC_LINES):
+                positions.append(filer.tell())
+                lines.append(filer.readline())
+
+        for i in range(len(lines) - 2):
+                if lines[i].startswith('@') and lines[i + 2][:1] in "+-" \
+                        and lines[i + 2] != "":
+                        return positions[i]
+
+        filer.seek(0, os.SEEK_END)
+        return filer.tell()
+
+
+# Reads in the chunks of inputFile with a pool of one process per chunk.
+# Returns the merged FastqStats, reads and FastqRecordIndex, see
+# FastqKeeper.ingestRange.
+#
+# Exceptions raised while reading in a chunk are raised here as well.
+# Results are merged in file order, so the exception is the one for the
+# first bad read in the earliest bad chunk.
+def parseChunks(fastqKeeper, inputFile, chunks, keepReads, columnar, \
+                indexed=False):
+        # Packed reads are only packed here, as they are merged, since
+        # chunks don't end on whole bytes of packed nucleotides
+        tasks = []
+        for (start, end) in chunks:
+                tasks.append((inputFile, start, end, keepReads, \
+                        bool(columnar), indexed))
+
+        stats = FastqStats()
+        seqs = None
+        if keepReads and columnar:
+                seqs = FastqStore(columnar == PACKED)
+        elif keepReads:
+                seqs = []
+
+        recordIndex = None
+        if indexed:
+                recordIndex = FastqRecordIndex()
+
+        (pool, pending) = startPool(fastqKeeper, parseChunk, tasks)
+        try:
+                for asyncResult in pending:
+                        ((chunkStats, chunkSeqs, chunkIndex), inputStats) = \
+                                        asyncResult.get()
+                        stats.merge(chunkStats)
+                        fastqKeeper.inputStats.merge(inputStats)
+
+                        if keepReads:
+                                seqs.extend(chunkSeqs)
+                        if indexed:
+                                recordIndex.extend(chunkIndex)
+
+                        fastqKeeper.monitor.progress(stats.chars, \
+                                        stats.numReads)
+        finally:
+                pool.join()
+
+        return (stats, seqs, recordIndex)
+
+
+# Reads in each of inputFiles with a pool of one process per file, or per
+# pair of files if they are (R1, R2) tuples, see FastqKeeper.ingestPair.
+# Returns a list with the (FastqStats, reads, FastqRecordIndex) of each
+# file, in the order the files were given and with the two files of a
+# pair one after the other.
+#
+# As with parseChunks, the exception raised is the one for the earliest
+# bad file.
+def parseFiles(fastqKeeper, inputFiles, keepReads, columnar, indexed=False):
+        # As in parseChunks, reads are packed as they are merged
+        tasks = []
+        for inputFile in inputFiles:
+                tasks.append((inputFile, keepReads, bool(columnar), indexed))
+
+        results = []
+        stats = FastqStats()
+        (pool, pending) = startPool(fastqKeeper, parseFile, tasks)
+        try:
+                for asyncResult in pending:
+                        (fileResults, inputStats) = asyncResult.get()
+                        fastqKeeper.inputStats.merge(inputStats)
+                        for result in fileResults:
+                                results.append(result)
+                                stats.merge(result[0])
+
+                        fastqKeeper.monitor.progress(stats.chars, \
+                                        stats.numReads)
+        finally:
+                pool.join()
+
+        return results
+
+
+# Starts a pool of one process per task, each running function on its
+# task, and closes it to new tasks. Returns the pool and the AsyncResult
+# of each task, in the order of tasks.
+#
+# The caller must join the pool once it has the results, or when one
+# raises an exception. Waiting for the other tasks to finish is slower
+# than Pool.terminate, but terminating a pool after a task has failed
+# can hang in Python 2.7.
+def startPool(fastqKeeper, function, tasks):
+        pool = Pool(len(tasks), initWorker, (fastqKeeper,))
+        pending = []
+        for task in tasks:
+                pending.append(pool.apply_async(function, (task,)))
+        pool.close()
+
+        return (pool, pending)
+
+
+# Pool initializer, stores the FastqKeeper for parseChunk to use
+def initWorker(fastqKeeper):
+        global keeper
+        keeper = fastqKeeper
+
+
+# Reads in one chunk, task is the arguments to FastqKeeper.ingestRange.
+# Returns the results with the InputStats of reading the chunk, see
+# fastqInput, for the parent to report.
+def parseChunk(task):
+        keeper.inputStats = InputStats()
+        return (keeper.ingestRange(*task), keeper.inputStats)
+
+
+# Reads in one file or pair of files for parseFiles, returning a list
+# of the results for each file and the InputStats of reading them
+def parseFile(task):
+        (inputFile, keepReads, columnar, indexed) = task
+        keeper.inputStats = InputStats()
+
+        if isinstance(inputFile, tuple):
+                return (keeper.ingestPair(inputFile[0], inputFile[1], \
+                                keepReads, columnar, indexed), keeper.inputStats)
+
+        return ([keeper.ingestRange(inputFile, 0, None, keepReads, columnar, \
+                        indexed)], keeper.inputStats)
@@ -0,0 +1,110 @@
+#
+# fastqProfile.py
+# Author: Philip Braunstein
+#
+# Date Created: May 31, 2014
+# Last Modified: May 31, 2014
+#
+# The FastqProfile class describes the reads position by position (cycle
+# by cycle): the histogram, mean and quartiles of the quality scores at
+# each position and the number of each nucleotide there. Reads of
+# different lengths are allowed; later positions are just made up of
+# fewer reads.
+#
+# The counts are made while the reads are read in, see FastqStats, and
+# kept here as two flat arrays of unsigned longs. Quality scores are the
+# raw ASCII values of the quality characters, as elsewhere in
+# FastqKeeper.
+#
+
+from array import array
+
+import fastqKernels
+
+# Number of quality score bins at each position, one per byte value
+QUAL_BINS = 256
+
+# Nucleotide bins at each position, the last for anything else
+NUCS = "ACGTN"
+NUC_BINS = fastqKernels.NUM_NUC_BINS
+
+class FastqProfile:
+        ################### Public API ###################
+        # Returns the number of positions, the length of the longest read
+        def getLength(self):
+                return len(self.qualCounts) // QUAL_BINS
+
+
+        # Returns the number of reads that reach position pos (from 0)
+        def getNumReads(self, pos):
+                return sum(self.getQualityHistogram(pos))
+
+
+        # Returns a list where element i is the number of reads with
+        # quality score i at position pos
+        def getQualityHistogram(self, pos):
+                self.checkPos(pos)
+                return self.qualCounts[pos * QUAL_BINS:(pos + 1) * QUAL_BINS] \
+                                .tolist()
+
+
+        # Returns the mean quality score at position pos rounded to two
+        # decimal places
+        def getMeanQuality(self, pos):
+                histogram = self.getQualityHistogram(pos)
+                total = sum(histogram)
+                if total == 0:
+                        return None
+
+                score = sum([qual * count for qual, count in \
+                                enumerate(histogram) if count > 0])
+                return round(score / float(total), 2)
+
+
+        # Returns the quality score at position pos that fraction of the
+        # reads are at or below, e.g. 0.5 for the median. The smallest
+        # score that covers fraction of the reads is used.
+        def getQuantile(self, pos, fraction):
+                histogram = self.getQualityHistogram(pos)
+                total = sum(histogram)
+                if total == 0:
+                        return None
+
+                needed = max(fraction * total, 1)
+                seen = 0
+                for qual, count in enumerate(histogram):
+                        seen += count
+                        if seen >= needed:
+                                return qual
+
+
+        # Returns (lower quartile, median, upper quartile) of the quality
+        # scores at position pos
+        def getQuartiles(self, pos):
+                return (self.getQuantile(pos, 0.25), \
+                                self.getQuantile(pos, 0.5), \
+                                self.getQuantile(pos, 0.75))
+
+
+        # Returns the number of A, C, G, T and N nucleotides at position pos
+        # as a tuple. Lower case nucleotides are counted with upper case.
+        def getBaseCounts(self, pos):
+                self.checkPos(pos)
+                start = pos * NUC_BINS
+                return tuple(self.nucCounts[start:start + len(NUCS)])
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # qualCounts and nucCounts are flat lists of counts per position,
+        # see FastqStats.posQualCounts and posNucCounts
+        def __init__(self, qualCounts, nucCounts):
+                self.qualCounts = array('L', qualCounts)
+                self.nucCounts = array('L', nucCounts)
+
+
+        # Raises an IndexError unless pos is a position in the profile
+        def checkPos(self, pos):
+                if pos < 0 or pos >= self.getLength():
+                        raise IndexError("Position " + str(pos) + \
+                                        " is past the end of the reads")
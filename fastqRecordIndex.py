@@ -0,0 +1,65 @@
+#
+# fastqRecordIndex.py
+# Author: Philip Braunstein
+#
+# Date Created: May 23, 2014
+# Last Modified: May 23, 2014
+#
+# The FastqRecordIndex class keeps two numbers for every read in a FASTQ
+# file: the byte offset the read starts at and its average quality score.
+# With it a read can be read back from the file without keeping the file
+# in memory, and quality cutoffs can be counted without the reads at all.
+#
+# The columns are normally arrays, but any object that can be indexed,
+# iterated over and has a length will do. fastqCache uses this to back
+# them with a memory-mapped file.
+#
+
+from array import array
+
+class FastqRecordIndex:
+        ################### Public API ###################
+        # Appends all of the reads in another FastqRecordIndex. Offsets are
+        # from the start of the file, so they need no adjusting.
+        def extend(self, other):
+                self.offsets.extend(other.offsets)
+                self.means.extend(other.means)
+
+
+        # Returns this index with its columns as arrays, copying them if
+        # they are anything else, e.g. a cache's memory-mapped columns.
+        # Only then can it be extended.
+        def toArrays(self):
+                if isinstance(self.offsets, array) and \
+                        isinstance(self.means, array):
+                        return self
+
+                return FastqRecordIndex(array('L', self.offsets), \
+                                array('d', self.means))
+
+
+        # Returns the byte offset of read i
+        def getOffset(self, i):
+                return self.offsets[i]
+
+
+        # Returns the average quality score of read i
+        def getQScore(self, i):
+                return self.means[i]
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Starts out empty unless columns to use are passed in
+        def __init__(self, offsets=None, means=None):
+                if offsets == None:
+                        offsets = array('L')
+                if means == None:
+                        means = array('d')
+
+                self.offsets = offsets
+                self.means = means
+
+
+        def __len__(self):
+                return len(self.offsets)
@@ -11,6 +11,8 @@
 # a nice report printed to stdout.
 #
 
+import json
+from collections import OrderedDict
 from fastqKeeper import FastqKeeper
 from math import ceil
 
@@ -23,14 +25,18 @@ class FastqReporter(FastqKeeper):
 
         # Wrappers for getters of avg length and quality score
         def printAvgReadLength(self):
-                print "Average read length:", self.avgLen, "nucleotides"
+                print "Average read length:", self.formatValue(self.avgLen), \
+                                "nucleotides"
                 print
 
         def printAvgQualScore(self):
                 print "Average quality score:",
 
                 # Convert avg to int then unichar to get ascii
-                print unichr(int(round(self.avgQScore)))
+                if self.avgQScore == None:
+                        print self.formatValue(self.avgQScore)
+                else:
+                        print unichr(int(round(self.avgQScore)))
                 print
 
         # Prints a randomly chosen sequence in the format that
@@ -42,6 +48,14 @@ class FastqReporter(FastqKeeper):
                         print item
                 print
 
+        # Prints n randomly chosen sequences in the format that they
+        # appeared in the .fastq file, see getRandomSeqs
+        def printRandomSeqs(self, n, seed=None, replace=False):
+                for seq in self.getRandomSeqs(n, seed, replace):
+                        for item in seq[:-1]:  # Chop off avg q score
+                                print item
+                print
+
 
         # Prints a report of the number of nucleotides in the file
         def printNumNucs(self):
@@ -58,27 +72,69 @@ class FastqReporter(FastqKeeper):
         # Prints G/C A/T content
         def printGC_AT(self):
                 print "G/C A/T CONTENT FOR ALL READS"
-                print "G/C Content:", str(self.GC) + "%"
-                print "A/T Content:", str(self.AT) + "%"
+                print "G/C Content:", self.formatValue(self.GC) + "%"
+                print "A/T Content:", self.formatValue(self.AT) + "%"
                 print
 
 
         # Prints percentage of strandedness
         def printStrandedness(self):
                 print "STRANDEDNESS FOR ALL READS"
-                print "Positive Strand:", str(self.plus) + "%"
-                print "Negative Strand:", str(self.minus) + "%"
+                print "Positive Strand:", self.formatValue(self.plus) + "%"
+                print "Negative Strand:", self.formatValue(self.minus) + "%"
                 print
 
        
-        # Some nice formatting around getNumMatches inherited method 
-        def printNumMatches(self, pattern):
-                # Call inherited helper function
-                num = self.getNumMatches(pattern)
-                print "\"" + pattern + "\"", "found in", num, "out of", 
-                print self.numReads, "sequences"
-                print "(" + str(round(float(num) / self.numReads, 2) \
-                        * 100) + "%)"
+        # Some nice formatting around getNumMatches inherited method.
+        # With maxErrors or bothStrands, also prints how many reads were
+        # found with each number of errors, see getNumMatchesByErrors.
+        def printNumMatches(self, pattern, maxErrors=0, indels=False, \
+                        bothStrands=False):
+                if maxErrors == 0 and not bothStrands:
+                        # Call inherited helper function
+                        num = self.getNumMatches(pattern)
+                        print "\"" + pattern + "\"", "found in", num, "out of", 
+                        print self.numReads, "sequences"
+                        print "(" + str(round(float(num) / self.numReads, 2) \
+                                * 100) + "%)"
+                        print
+                        return
+
+                counts = self.getNumMatchesByErrors(pattern, maxErrors, \
+                                indels, bothStrands)
+                errors = "mismatches"
+                if indels:
+                        errors = "edits"
+
+                print "\"" + pattern + "\"", "found in", sum(counts), "out of",
+                print self.numReads, "sequences with up to", maxErrors, errors,
+                if bothStrands:
+                        print "on either strand",
+                print
+                print "Errors".ljust(8), "Reads".rjust(10), \
+                        "Percent".rjust(8), "Up to".rjust(10)
+                total = 0
+                for num, count in enumerate(counts):
+                        total += count
+                        percent = round(float(count) / self.numReads * 100, 2)
+                        print str(num).ljust(8), str(count).rjust(10), \
+                                str(percent).rjust(8), str(total).rjust(10)
+                print
+
+        # Prints a table of how many reads have each of patterns, see
+        # getNumMatchesMany
+        def printNumMatchesMany(self, patterns):
+                counts = self.getNumMatchesMany(patterns)
+                width = max([len(pattern) for pattern in patterns] + \
+                                [len("Pattern")])
+
+                print "Pattern".ljust(width), "Reads".rjust(10), \
+                        "Percent".rjust(8)
+                for pattern, num in zip(patterns, counts):
+                        percent = round(float(num) / self.numReads * 100, 2)
+                        print pattern.upper().ljust(width), \
+                                str(num).rjust(10), str(percent).rjust(8)
+                print "out of", self.numReads, "sequences"
                 print
 
         # Some nice formatting around the getNumQualSeqs inherited method
@@ -91,40 +147,297 @@ class FastqReporter(FastqKeeper):
                         * 100) + "%)"
                 print
 
+        # Some nice formatting around the getNumQualSeqsBetween inherited
+        # method
+        def printNumQualSeqsBetween(self, low, high):
+                num = self.getNumQualSeqsBetween(low, high)
+                print num, "of", self.numReads,
+                print "sequences have an average quality score of at least",
+                print "\"" + low + "\"", "and below", "\"" + high + "\""
+                print "(" + str(round(float(num) / self.numReads, 2) \
+                        * 100) + "%)"
+                print
+
+
+        # Prints the duplication rate of the reads, comparing only the
+        # first prefixLength nucleotides if it is given, see
+        # getNumDistinctSeqs
+        def printDuplication(self, prefixLength=None, exact=None):
+                distinct = self.getNumDistinctSeqs(prefixLength, exact)
+                percent = round(100 - 100.0 * distinct / self.numReads, 2)
+
+                print "DUPLICATE READS"
+                if prefixLength != None:
+                        print "Comparing the first", prefixLength, "nucleotides"
+                print "Distinct sequences:", distinct, "of", self.numReads
+                print "Duplicate reads:", str(percent) + "%"
+                self.printEstimated(exact)
+                print
+
+        # Prints the n most common sequences, see getOverrepresentedSeqs
+        def printOverrepresentedSeqs(self, n=10, prefixLength=None, \
+                        exact=None):
+                top = self.getOverrepresentedSeqs(n, prefixLength, exact)
+
+                print "OVERREPRESENTED SEQUENCES"
+                print "Reads".rjust(10), "Percent".rjust(8), "Sequence"
+                for seq, count, percent in top:
+                        print str(count).rjust(10), str(percent).rjust(8), seq
+                self.printEstimated(exact)
+                print
+
+        # Prints how many distinct k-mers were seen each number of times,
+        # with all those seen more than maxCount times on one line, see
+        # getKmerSpectrum
+        def printKmerSpectrum(self, k=21, exact=None, maxCount=20):
+                spectrum = self.getKmerSpectrum(k, exact)
+
+                print str(k) + "-MER SPECTRUM"
+                print "Times seen".rjust(10), "K-mers".rjust(12)
+                for count, kmers in spectrum:
+                        if count <= maxCount:
+                                print str(count).rjust(10), str(kmers).rjust(12)
+
+                more = sum([kmers for count, kmers in spectrum \
+                                if count > maxCount])
+                if more > 0:
+                        print (">" + str(maxCount)).rjust(10), \
+                                str(more).rjust(12)
+                self.printEstimated(exact)
+                print
+
+        # Says that the answer just printed is an estimate, unless exact
+        # says it was counted exactly, see useExact
+        def printEstimated(self, exact):
+                if not self.useExact(exact):
+                        print "(estimated with a sketch, not counted exactly)"
+
+
+        # Prints the mean and quartiles of the quality scores at each
+        # position of the reads. Quartiles are printed as quality score
+        # characters.
+        def printQualityProfile(self):
+                profile = self.getProfile()
+                print "QUALITY SCORES BY POSITION"
+                print "Position".rjust(8), "Reads".rjust(10), "Mean".rjust(7), \
+                        "Q1".rjust(3), "Med".rjust(3), "Q3".rjust(3)
+                for pos in range(profile.getLength()):
+                        quartiles = profile.getQuartiles(pos)
+                        print str(pos + 1).rjust(8), \
+                                str(profile.getNumReads(pos)).rjust(10), \
+                                str(profile.getMeanQuality(pos)).rjust(7), \
+                                " ".join([chr(qual).rjust(3) \
+                                        for qual in quartiles])
+                print
+
+        # Prints the percentage of each nucleotide at each position of the
+        # reads
+        def printBaseProfile(self):
+                profile = self.getProfile()
+                print "NUCLEOTIDES BY POSITION (%)"
+                print "Position".rjust(8), " ".join([nuc.rjust(6) \
+                        for nuc in "ACGTN"])
+                for pos in range(profile.getLength()):
+                        counts = profile.getBaseCounts(pos)
+                        total = float(max(sum(counts), 1))
+                        print str(pos + 1).rjust(8), \
+                                " ".join([str(round(count / total * 100, \
+                                        2)).rjust(6) for count in counts])
+                print
+
+        # Writes the profile at each position to outputFile, as tab
+        # separated values with one line per position (fileFormat "tsv")
+        # or as JSON that also has the full quality score histograms
+        # (fileFormat "json"). Positions are numbered from 1.
+        def exportProfile(self, outputFile, fileFormat="tsv"):
+                profile = self.getProfile()
+                rows = []
+                for pos in range(profile.getLength()):
+                        row = OrderedDict()
+                        row["position"] = pos + 1
+                        row["reads"] = profile.getNumReads(pos)
+                        row["mean"] = profile.getMeanQuality(pos)
+                        (row["q1"], row["median"], row["q3"]) = \
+                                        profile.getQuartiles(pos)
+                        for nuc, count in zip("ACGTN", \
+                                        profile.getBaseCounts(pos)):
+                                row[nuc] = count
+                        rows.append(row)
+
+                with open(outputFile, 'w') as filew:
+                        if fileFormat == "json":
+                                for pos, row in enumerate(rows):
+                                        row["histogram"] = dict([(qual, \
+                                                count) for qual, count in \
+                                                enumerate(profile. \
+                                                getQualityHistogram(pos)) \
+                                                if count > 0])
+                                json.dump(rows, filew)
+                                filew.write("\n")
+                                return
+
+                        if len(rows) > 0:
+                                filew.write("\t".join(rows[0].keys()) + "\n")
+                        for row in rows:
+                                filew.write("\t".join([str(value) for value \
+                                        in row.values()]) + "\n")
+
+
+        # Reads in the reads added to the file since it was last read in,
+        # see FastqKeeper.refresh, and counts their characters too
+        def refresh(self):
+                numReads = FastqKeeper.refresh(self)
+                self.totalCharsToWrite = self.stats.chars
+                return numReads
+
+
+        # Prints how many reads were added to the file since it was last
+        # read in, see refresh
+        def printRefresh(self):
+                if not self.tail:
+                        print "Start the program with --tail to read in reads",
+                        print "added to the file"
+                        print
+                        return
+
+                numReads = self.refresh()
+                print numReads, "new reads,", self.getNumReads(), "total reads"
+                print
+
+
+        # Writes the reads that pass readFilter to outputFile and prints how
+        # many failed each of its predicates, see writeFiltered
+        def printWriteFiltered(self, outputFile, readFilter, \
+                        compressLevel=None):
+                report = self.writeFiltered(outputFile, readFilter, \
+                                compressLevel)
+
+                print "Wrote", report["passed"], "of", report["reads"], \
+                                "reads to", outputFile
+                print "Trimmed:", report["trimmed"]
+                for name in report.keys()[3:]:
+                        print "Failed " + name + ":", report[name]
+                print
+
 
         def getTotalCharsToWrite(self):
                 return self.totalCharsToWrite
 
 
+        # Returns the number of pages it would take to write out the FASTQ
+        # file in 12 point font.
+        def getTotalNumPages(self):
+                return int(ceil(self.totalCharsToWrite / float( \
+                                        self.charsPerPage)))
+
+
         # Print the number of pages it would take to write out
         # the FASTQ file in 12 point font.
         def printTotalNumPages(self):
-                numPages = int(ceil(self.totalCharsToWrite / float( \
-                                        self.charsPerPage)))
+                numPages = self.getTotalNumPages()
                 print "It would take", numPages, "pages to write",
                 print "this FASTQ file in 12 point font"
 
 
 
+        # Returns the file-wide statistics the print methods report, by
+        # name, for output in machine-readable formats
+        def getSummary(self):
+                summary = OrderedDict()
+                summary["numReads"] = self.getNumReads()
+                summary["A"] = self.A
+                summary["C"] = self.C
+                summary["G"] = self.G
+                summary["T"] = self.T
+                summary["N"] = self.N
+                summary["total"] = self.total
+                summary["GC"] = self.GC
+                summary["AT"] = self.AT
+                summary["avgLen"] = self.avgLen
+                summary["avgQScore"] = self.avgQScore
+                summary["plus"] = self.plus
+                summary["minus"] = self.minus
+                summary["totalChars"] = self.getTotalCharsToWrite()
+                summary["pages"] = self.getTotalNumPages()
+
+                return summary
+
+
+        # Returns a list with the statistics of each file read in, see
+        # getFileStats, each an OrderedDict starting with the file name
+        def getFileSummaries(self):
+                summaries = []
+                for inputFile, stats in self.getFileStats().items():
+                        summary = OrderedDict()
+                        summary["file"] = inputFile
+                        summary.update(stats.getSummary())
+                        summaries.append(summary)
+
+                return summaries
+
+
+        # Prints the number of reads, average length, average quality
+        # score and G/C content of each file read in
+        def printFileSummaries(self):
+                print "Reads".rjust(10), "Avg len".rjust(8), \
+                                "Avg qual".rjust(8), "G/C %".rjust(6), "File"
+                for summary in self.getFileSummaries():
+                        print str(summary["numReads"]).rjust(10), \
+                                self.formatNumber(summary["avgLen"]).rjust(8), \
+                                self.formatNumber(summary["avgQScore"]).rjust(8), \
+                                self.formatValue(summary["GC"]).rjust(6), \
+                                summary["file"]
+                print
+
+
+        # Returns number rounded to 2 decimal places as a string, or "-" if
+        # it is None
+        def formatNumber(self, number):
+                if number == None:
+                        return "-"
+
+                return str(round(number, 2))
+
+
+        # Returns value as a string, or "-" if it is None, as the averages
+        # and percentages are for a tailed file with no reads yet
+        def formatValue(self, value):
+                if value == None:
+                        return "-"
+
+                return str(value)
+
+
+
         ##################### Private Methods ###########################
         # INITIALIZER
-        # Initializer needs to count the total number of chars
-        # that the file would take to writte out. First, it calls the
-        # super class initializer then runs a method to do this.
+        # Initializer needs the total number of chars that the file
+        # would take to writte out. First, it calls the super class
+        # initializer, then leaves the count to countTotalCharsToWrite
+        # the first time it is needed.
         #
-        def __init__(self, inputFile):
-                FastqKeeper.__init__(self, inputFile)
-                print "Initializing FastqReporter:"
+        # Keyword arguments are passed on to FastqKeeper. When the reads
+        # were ingested in a single pass the count is already known.
+        def __init__(self, inputFile, **kwargs):
+                FastqKeeper.__init__(self, inputFile, **kwargs)
+                self.monitor.message("Initializing FastqReporter:")
                 self.charsPerPage = 2812
-                self.totalCharsToWrite = self.countTotalCharsToWrite()
-                print "done."
-                print 
+                if self.stats != None:
+                        self.totalCharsToWrite = self.stats.chars
+                else:
+                        self.deferStats("countTotalCharsToWrite", \
+                                        ["totalCharsToWrite"])
+                self.monitor.message("done.")
+                self.monitor.message()
 
 
         # Counts the total number of chars that would be required to
         # write out a FASTQ file including the line breaks between the lines. 
+        # Sets totalCharsToWrite, which is worked out on first use, see
+        # FastqKeeper.__getattr__.
         def countTotalCharsToWrite(self):
-                print "Calculating total number of characters...."
+                self.monitor.begin("countTotalCharsToWrite", \
+                                "Calculating total number of characters....")
                 count = 0
                 for seq in self.seqs:
                         count += 4  # Line breaks after each line
@@ -133,5 +446,7 @@ class FastqReporter(FastqKeeper):
                         count += len(seq[self.STRAND_INDEX])
                         count += len(seq[self.QSCORE_INDEX])
 
+                self.monitor.end(reads=len(self.seqs))
+                self.totalCharsToWrite = count
                 return count
 
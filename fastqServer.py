@@ -0,0 +1,393 @@
+#
+# fastqServer.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 4, 2014
+# Last Modified: Jun 4, 2014
+#
+# Serves queries about FASTQ files from a long-running process, so that
+# each file is read in once and then queried by many clients. Files are
+# read in the first time they are asked about and kept in a ReporterPool
+# until it needs the memory for another file, when the least recently
+# queried ones are dropped.
+#
+# A request is a JSON object with the file to query and the queries to
+# run, named as fastqBatch.runQueries names them:
+#
+#   {"file": "run1.fastq", "stats": true, "patterns": ["ACGT"],
+#    "cutoffs": ["5"], "numRandom": 2, "seed": 7}
+#
+# The answer is the same JSON object fastqKnowledge.py prints for the
+# queries with --format json, or {"error": MESSAGE} if they couldn't be
+# answered. {"command": "status"} instead returns the files that are
+# read in and the memory they are estimated to use.
+#
+# The server listens either on a Unix socket, for an address that is a
+# path, where each line sent is a request and is answered with a line,
+# or over HTTP for an address of the form http://HOST:PORT, where
+# requests are POSTed and GET /status returns the status. Each
+# connection is handled by its own thread, and queries of different files
+# run at the same time, but queries of the same file one at a time.
+#
+# Clients can read any file the server can, so it should only listen
+# on localhost or on a socket only trusted users can reach. makeServer
+# refuses HTTP hosts that aren't loopback addresses unless allowRemote is
+# given. Files are read in without a cache unless options turn it on, so
+# that clients can't make the server write cache files next to them.
+#
+
+import BaseHTTPServer
+import json
+import os
+import socket
+import SocketServer
+import threading
+import urllib2
+import urlparse
+from collections import OrderedDict
+
+import fastqBatch
+import fastqInput
+from fastqMonitor import NullMonitor
+from fastqReporter import FastqReporter
+
+HTTP = "http://"
+
+STATUS = "status"
+
+# Keys of a request that are passed on to fastqBatch.runQueries
+QUERY_KEYS = ["stats", "patterns", "cutoffs", "numRandom", "seed", \
+                "duplication", "numOverrepresented", "spectrumK", \
+                "prefixLength", "exact"]
+
+FILE_EXCEPTION = "Request has no file to query"
+REQUEST_EXCEPTION = "Request must be a JSON object"
+QUERY_EXCEPTION = "Unknown query \"{}\""
+COMMAND_EXCEPTION = "Unknown command \"{}\""
+REMOTE_EXCEPTION = "Host \"{}\" isn't a loopback address, so clients on" + \
+                " other machines could read any file the server can"
+
+
+# Returns a server for address, see the top of this file, that answers
+# requests with pool. Call serve_forever on it to start answering them.
+# HTTP hosts other than loopback addresses raise an exception unless
+# allowRemote is True.
+def makeServer(address, pool, allowRemote=False):
+        if address.startswith(HTTP):
+                (host, port) = parseHttpAddress(address)
+                if not allowRemote and not isLoopback(host):
+                        raise Exception(REMOTE_EXCEPTION.format(host))
+                server = ThreadingHTTPServer((host, port), HttpHandler)
+        else:
+                # A socket left behind by a server that is gone
+                if os.path.exists(address):
+                        os.remove(address)
+                server = ThreadingUnixServer(address, UnixHandler)
+
+        server.pool = pool
+        return server
+
+
+# Returns the (host, port) of an http://HOST:PORT address
+def parseHttpAddress(address):
+        parts = urlparse.urlparse(address)
+        return (parts.hostname or "localhost", parts.port or 80)
+
+
+# Returns True if every address host resolves to is a loopback address,
+# which only clients on the same machine can reach
+def isLoopback(host):
+        try:
+                addresses = socket.getaddrinfo(host, None)
+        except socket.gaierror:
+                return False
+
+        for address in addresses:
+                ip = address[4][0]
+                if not ip.startswith("127.") and ip != "::1":
+                        return False
+
+        return len(addresses) > 0
+
+
+# Answers one request, a dict parsed from JSON, with pool. Returns the
+# answer as an OrderedDict, with an error message under "error" if the
+# request couldn't be answered.
+def answer(pool, request):
+        try:
+                if not isinstance(request, dict):
+                        raise Exception(REQUEST_EXCEPTION)
+
+                command = request.get("command")
+                if command == STATUS:
+                        return pool.getStatus()
+                if command != None:
+                        raise Exception(COMMAND_EXCEPTION.format(command))
+
+                return pool.query(request)
+        except Exception as e:
+                return OrderedDict([("error", str(e))])
+
+
+# Returns value with any unicode strings in it, as JSON gives them,
+# turned into the byte strings FastqKeeper expects
+def toStr(value):
+        if isinstance(value, unicode):
+                return value.encode("utf-8")
+        if isinstance(value, list):
+                return [toStr(item) for item in value]
+
+        return value
+
+
+# Sends request, a dict, to the server at address and returns its answer
+def query(address, request):
+        if address.startswith(HTTP):
+                if request.get("command") == STATUS:
+                        reply = urllib2.urlopen(address.rstrip("/") + "/" + \
+                                        STATUS)
+                else:
+                        try:
+                                reply = urllib2.urlopen(address, \
+                                                json.dumps(request))
+                        except urllib2.HTTPError as e:
+                                # Errors are answered with a JSON body too
+                                reply = e
+                try:
+                        return json.loads(reply.read(), \
+                                        object_pairs_hook=OrderedDict)
+                finally:
+                        reply.close()
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+                sock.connect(address)
+                filer = sock.makefile('rb')
+                sock.sendall(json.dumps(request) + "\n")
+                return json.loads(filer.readline(), \
+                                object_pairs_hook=OrderedDict)
+        finally:
+                sock.close()
+
+
+class ReporterPool:
+        ################### Public API ###################
+        # Runs the queries in request on the file it names, reading the
+        # file in first if it isn't already. Returns the answers as
+        # fastqBatch.formatJson would write them.
+        def query(self, request):
+                inputFile = request.get("file")
+                if not isinstance(inputFile, basestring) or inputFile in \
+                                ["", fastqInput.STDIN]:
+                        raise Exception(FILE_EXCEPTION)
+
+                kwargs = {}
+                for key, value in request.items():
+                        if key == "file":
+                                continue
+                        if key not in QUERY_KEYS:
+                                raise Exception(QUERY_EXCEPTION.format(key))
+                        kwargs[str(key)] = toStr(value)
+
+                entry = self.getEntry(toStr(inputFile))
+                with entry.lock:
+                        if entry.reporter == None:
+                                self.load(entry)
+
+                        results = fastqBatch.runQueries(entry.reporter, \
+                                        **kwargs)
+
+                answers = OrderedDict()
+                answers["file"] = inputFile
+                answers.update(results)
+                return answers
+
+
+        # Returns an OrderedDict with the memory budget, the estimated
+        # memory in use and the files read in, from least to most recently
+        # queried
+        def getStatus(self):
+                with self.lock:
+                        status = OrderedDict()
+                        status["maxBytes"] = self.maxBytes
+                        status["bytes"] = self.getBytes()
+                        status["files"] = [OrderedDict([("file", \
+                                entry.inputFile), ("bytes", entry.bytes), \
+                                ("queries", entry.queries)]) \
+                                for entry in self.entries.values() \
+                                if entry.reporter != None]
+
+                        return status
+
+
+        # Drops every file read in
+        def clear(self):
+                with self.lock:
+                        self.entries.clear()
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Files are read in as FastqReporter(inputFile, **options), so
+        # options can be any of its keyword arguments except monitor.
+        # They aren't cached unless options has cache=True, see the top
+        # of this file.
+        # Once the files read in are estimated to use more than maxBytes
+        # (see FastqKeeper.estimateMemory), the least recently queried
+        # ones are dropped until they fit, but the file just read in is
+        # always kept. maxBytes=None never drops files. Loading messages
+        # go to monitor.
+        def __init__(self, maxBytes=None, options=None, monitor=None):
+                if options == None:
+                        options = {}
+                if monitor == None:
+                        monitor = NullMonitor()
+
+                self.maxBytes = maxBytes
+                self.options = dict(options)
+                self.options.setdefault("cache", False)
+                self.monitor = monitor
+
+                # PoolEntry of each file from least to most recently
+                # queried. lock guards entries, each entry's own lock
+                # guards its reporter.
+                self.entries = OrderedDict()
+                self.lock = threading.Lock()
+
+
+        # Returns the PoolEntry for inputFile, adding an empty one if there
+        # isn't one yet, and marks it most recently queried. Entries are
+        # kept by absolute path, so the same file is only read in once.
+        def getEntry(self, inputFile):
+                key = os.path.abspath(inputFile)
+                with self.lock:
+                        entry = self.entries.pop(key, None)
+                        if entry == None:
+                                entry = PoolEntry(key)
+                        entry.queries += 1
+                        self.entries[key] = entry
+
+                        return entry
+
+
+        # Reads in the file of entry, which must be locked, and drops
+        # other files if they no longer fit in maxBytes. If the file can't
+        # be read in, entry is removed again.
+        def load(self, entry):
+                self.monitor.message("Reading in " + entry.inputFile)
+                try:
+                        reporter = FastqReporter(entry.inputFile, \
+                                        monitor=NullMonitor(), **self.options)
+                except Exception:
+                        with self.lock:
+                                if self.entries.get(entry.inputFile) is entry:
+                                        del self.entries[entry.inputFile]
+                        raise
+
+                entry.bytes = reporter.estimateMemory()
+                entry.reporter = reporter
+
+                with self.lock:
+                        self.evict(entry)
+                self.monitor.message("Read in " + entry.inputFile + " (" + \
+                                str(entry.bytes) + " bytes)")
+
+
+        # Drops the least recently queried files, other than keep, until
+        # the rest fit in maxBytes. Must be called with the lock held.
+        # A file being queried is only dropped from the pool, the query
+        # finishes with it.
+        def evict(self, keep):
+                if self.maxBytes == None:
+                        return
+
+                for key, entry in self.entries.items():
+                        if self.getBytes() <= self.maxBytes:
+                                return
+                        if entry is keep or entry.reporter == None:
+                                continue
+
+                        del self.entries[key]
+                        self.monitor.message("Dropped " + key + " (" + \
+                                        str(entry.bytes) + " bytes)")
+
+
+        # Returns the estimated bytes used by the files read in. Must be
+        # called with the lock held.
+        def getBytes(self):
+                return sum([entry.bytes for entry in self.entries.values()])
+
+
+# A file in a ReporterPool. reporter is None until the file is read in.
+class PoolEntry:
+        def __init__(self, inputFile):
+                self.inputFile = inputFile
+                self.reporter = None
+                self.bytes = 0
+                self.queries = 0
+                self.lock = threading.Lock()
+
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, \
+                SocketServer.UnixStreamServer):
+        daemon_threads = True
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, \
+                BaseHTTPServer.HTTPServer):
+        daemon_threads = True
+
+
+# Answers each line sent on a Unix socket connection as a request
+class UnixHandler(SocketServer.StreamRequestHandler):
+        def handle(self):
+                for line in self.rfile:
+                        if line.strip() == "":
+                                continue
+
+                        try:
+                                request = json.loads(line)
+                        except ValueError as e:
+                                reply = OrderedDict([("error", str(e))])
+                        else:
+                                reply = answer(self.server.pool, request)
+
+                        self.wfile.write(json.dumps(reply) + "\n")
+                        self.wfile.flush()
+
+
+# Answers a request POSTed as JSON, or GET /status
+class HttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+                if self.path.rstrip("/") == "/" + STATUS:
+                        self.reply(200, self.server.pool.getStatus())
+                else:
+                        self.reply(404, OrderedDict([("error", \
+                                        "Unknown path " + self.path)]))
+
+
+        def do_POST(self):
+                length = int(self.headers.getheader("Content-Length") or 0)
+                try:
+                        request = json.loads(self.rfile.read(length))
+                except ValueError as e:
+                        self.reply(400, OrderedDict([("error", str(e))]))
+                        return
+
+                reply = answer(self.server.pool, request)
+                self.reply(400 if "error" in reply else 200, reply)
+
+
+        # Sends reply as JSON with the status code status
+        def reply(self, status, reply):
+                body = json.dumps(reply)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+
+        # Requests aren't logged to stderr
+        def log_message(self, format, *args):
+                pass
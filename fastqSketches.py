@@ -0,0 +1,291 @@
+#
+# fastqSketches.py
+# Author: Philip Braunstein
+#
+# Date Created: Jun 2, 2014
+# Last Modified: Jun 2, 2014
+#
+# Sketches count things in a stream using a fixed amount of memory, at the
+# cost of answers that are estimates with a known error bound:
+#
+#   CountMinSketch  - how often each item has been seen. Never an
+#                     underestimate, and an overestimate by at most
+#                     error * (items added) with probability 1 - delta.
+#   HyperLogLog     - how many distinct items have been seen, with a
+#                     relative standard error of about 1.04 / sqrt(2^p)
+#                     for 2^p one byte registers.
+#   SpaceSaving     - the most frequent items, keeping at most capacity
+#                     of them. Each count is an overestimate by at most
+#                     (items added) / capacity, and any item seen more
+#                     often than that is guaranteed to be kept.
+#
+# Items are added as 64-bit hashes rather than as themselves, see
+# hashItem, except in SpaceSaving which has to give the items back. The
+# same hash is worked out with NumPy for many items at once by hashMany,
+# so both paths fill a sketch the same way.
+#
+
+import heapq
+import math
+from array import array
+
+import fastqKernels
+
+try:
+        import numpy
+except ImportError:
+        numpy = None
+
+MASK64 = (1 << 64) - 1
+
+
+# Scrambles a 64-bit integer so that every bit of the result depends on
+# every bit of x (the splitmix64 finalizer)
+def mix64(x):
+        x &= MASK64
+        x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & MASK64
+        x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & MASK64
+        return x ^ (x >> 31)
+
+
+# Returns a 64-bit hash of a string or integer
+def hashItem(item):
+        if isinstance(item, (int, long)):
+                return mix64(item)
+
+        return mix64(hash(item))
+
+
+# Returns the hashItem of each integer in codes, as a NumPy array of
+# uint64 when NumPy is used and otherwise a list
+def hashMany(codes):
+        if not fastqKernels.USE_NUMPY:
+                return [mix64(code) for code in codes]
+
+        x = numpy.asarray(codes, dtype=numpy.uint64)
+        x = (x ^ (x >> numpy.uint64(30))) * numpy.uint64(0xbf58476d1ce4e5b9)
+        x = (x ^ (x >> numpy.uint64(27))) * numpy.uint64(0x94d049bb133111eb)
+        return x ^ (x >> numpy.uint64(31))
+
+
+class CountMinSketch:
+        ################### Public API ###################
+        # Adds one sighting of the item with hash h
+        def add(self, h):
+                self.total += 1
+                for i in self.indexes(h):
+                        self.table[i] += 1
+
+
+        # Adds one sighting of each hash in hashes, see hashMany
+        def addMany(self, hashes):
+                self.total += len(hashes)
+                if self.useNumpy:
+                        (indexes, counts) = numpy.unique( \
+                                        self.indexesMany(hashes), \
+                                        return_counts=True)
+                        self.table[indexes] += counts.astype(numpy.uint32)
+                        return
+
+                for h in hashes:
+                        for i in self.indexes(h):
+                                self.table[i] += 1
+
+
+        # Returns the estimated number of times the item with hash h was
+        # added
+        def estimate(self, h):
+                return int(min([self.table[i] for i in self.indexes(h)]))
+
+
+        # Returns the estimate of each hash in hashes, as a NumPy array
+        # when NumPy is used and otherwise a list
+        def estimateMany(self, hashes):
+                if self.useNumpy:
+                        return self.table[self.indexesMany(hashes)].min(axis=0)
+
+                return [self.estimate(h) for h in hashes]
+
+
+        # Returns the most an estimate can be over by, with probability
+        # 1 - delta
+        def getErrorBound(self):
+                return int(math.ceil(self.total * math.e / self.width))
+
+
+        # Returns the number of bytes the counters take up
+        def getMemory(self):
+                return self.width * self.depth * 4
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Estimates are over by at most error times the number of items
+        # added with probability 1 - delta. That takes e / error counters
+        # in each of ln(1 / delta) rows. If maxBytes is given the rows are
+        # made as wide as fit in it instead, and error is whatever that
+        # gives, see getErrorBound.
+        def __init__(self, error=0.0001, delta=0.01, maxBytes=None):
+                self.depth = int(math.ceil(math.log(1.0 / delta)))
+                if maxBytes != None:
+                        self.width = max(maxBytes // (4 * self.depth), 1)
+                else:
+                        self.width = int(math.ceil(math.e / error))
+                self.total = 0
+
+                # All rows in one flat table, row i starting at i * width
+                self.useNumpy = fastqKernels.USE_NUMPY
+                if self.useNumpy:
+                        self.table = numpy.zeros(self.width * self.depth, \
+                                        dtype=numpy.uint32)
+                else:
+                        self.table = array('I', [0]) * (self.width * self.depth)
+
+
+        # Returns the counter in each row for the item with hash h. The
+        # rows use h1 + i * h2 from the two halves of h as their hashes.
+        def indexes(self, h):
+                h1 = h & 0xffffffff
+                h2 = (h >> 32) | 1
+                return [i * self.width + (h1 + i * h2) % self.width \
+                                for i in range(self.depth)]
+
+
+        # NumPy version of indexes for many hashes, one row of the result
+        # per row of the sketch
+        def indexesMany(self, hashes):
+                hashes = numpy.asarray(hashes, dtype=numpy.uint64)
+                h1 = hashes & numpy.uint64(0xffffffff)
+                h2 = (hashes >> numpy.uint64(32)) | numpy.uint64(1)
+                width = numpy.uint64(self.width)
+
+                return numpy.array([numpy.uint64(i) * width + \
+                        (h1 + numpy.uint64(i) * h2) % width \
+                        for i in range(self.depth)], dtype=numpy.intp)
+
+
+class HyperLogLog:
+        ################### Public API ###################
+        # Adds the item with hash h
+        def add(self, h):
+                index = h >> self.shift
+                rest = h & self.restMask
+
+                # Position of the first set bit after the index bits
+                rank = self.shift - rest.bit_length() + 1
+                if rank > self.registers[index]:
+                        self.registers[index] = rank
+
+
+        # Returns the estimated number of distinct items added
+        def estimate(self):
+                m = self.numRegisters
+                total = sum([2.0 ** -register for register in self.registers])
+                estimate = self.alpha * m * m / total
+
+                # Linear counting is more accurate for small numbers
+                zeros = self.registers.count("\0")
+                if estimate <= 2.5 * m and zeros > 0:
+                        estimate = m * math.log(float(m) / zeros)
+
+                return int(round(estimate))
+
+
+        # Returns the relative standard error of estimate
+        def getError(self):
+                return 1.04 / math.sqrt(self.numRegisters)
+
+
+        # Returns the number of bytes the registers take up
+        def getMemory(self):
+                return self.numRegisters
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Uses enough registers for a relative standard error of at most
+        # error, between 2^4 and 2^18 of them
+        def __init__(self, error=0.01):
+                precision = int(math.ceil(2 * math.log(1.04 / error, 2)))
+                precision = min(max(precision, 4), 18)
+
+                self.numRegisters = 1 << precision
+                self.shift = 64 - precision
+                self.restMask = (1 << self.shift) - 1
+                self.registers = bytearray(self.numRegisters)
+                self.alpha = 0.7213 / (1 + 1.079 / self.numRegisters)
+
+
+class SpaceSaving:
+        ################### Public API ###################
+        # Adds one sighting of item. When capacity items are already kept
+        # and item isn't one of them, the least counted one is replaced by
+        # item, which takes over its count.
+        def add(self, item):
+                self.total += 1
+                counts = self.counts
+
+                if item in counts:
+                        counts[item] += 1
+                        return
+
+                if len(counts) < self.capacity:
+                        counts[item] = 1
+                        self.errors[item] = 0
+                        heapq.heappush(self.heap, (1, item))
+                        return
+
+                (count, evicted) = self.popMin()
+                del counts[evicted]
+                del self.errors[evicted]
+
+                counts[item] = count + 1
+                self.errors[item] = count
+                heapq.heappush(self.heap, (count + 1, item))
+
+
+        # Returns the n most counted items as a list of (item, count,
+        # error) from most to least counted. The item was seen between
+        # count - error and count times. Items counted no more than
+        # getErrorBound times are left out, as they can't be told apart
+        # from items that were only seen once.
+        def getTop(self, n):
+                bound = self.getErrorBound()
+                top = heapq.nlargest(n, [(count, item) for item, count in \
+                                self.counts.items() if count > bound])
+
+                return [(item, count, self.errors[item]) \
+                                for count, item in top]
+
+
+        # Returns the most any count can be over by
+        def getErrorBound(self):
+                if len(self.counts) < self.capacity:
+                        return 0
+
+                return self.total // self.capacity
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Counts are over by at most error times the number of items added,
+        # which takes 1 / error counters
+        def __init__(self, error=0.001):
+                self.capacity = int(math.ceil(1.0 / error))
+                self.total = 0
+                self.counts = {}
+                self.errors = {}
+
+                # (count, item) for every item kept, but counts in the heap
+                # are only brought up to date when they reach the top
+                self.heap = []
+
+
+        # Removes and returns (count, item) for the least counted item
+        def popMin(self):
+                while True:
+                        (count, item) = heapq.heappop(self.heap)
+                        if self.counts[item] == count:
+                                return (count, item)
+
+                        heapq.heappush(self.heap, (self.counts[item], item))
@@ -0,0 +1,146 @@
+#
+# fastqStats.py
+# Author: Philip Braunstein
+#
+# Date Created: May 20, 2014
+# Last Modified: May 20, 2014
+#
+# The FastqStats class holds the running totals that FastqKeeper needs
+# to describe a FASTQ file: nucleotide counts, total read length, the sum
+# of the per-read average quality scores, the number of + strand reads,
+# the number of characters it would take to write the file out, a
+# histogram of the per-read average quality scores and the quality scores
+# and nucleotides seen at each position of the reads.
+#
+# Totals are kept as raw sums rather than averages so that two FastqStats
+# built over different parts of a file can be merged into one. They are
+# all whole numbers, so merging gives exactly the same totals whatever
+# order the parts are merged in.
+#
+
+from collections import OrderedDict
+from operator import add
+
+class FastqStats:
+        ################### Public API ###################
+        # Adds the totals from another FastqStats to this one. Merging
+        # is done in place and self is returned for convenience.
+        def merge(self, other):
+                self.numReads += other.numReads
+                self.A += other.A
+                self.C += other.C
+                self.G += other.G
+                self.T += other.T
+                self.N += other.N
+                self.length += other.length
+                self.score += other.score
+                self.plus += other.plus
+                self.chars += other.chars
+
+                for i in range(len(self.qualCounts)):
+                        self.qualCounts[i] += other.qualCounts[i]
+
+                addCounts(self.posQualCounts, other.posQualCounts)
+                addCounts(self.posNucCounts, other.posNucCounts)
+
+                if self.unknownNuc == None:
+                        self.unknownNuc = other.unknownNuc
+
+                return self
+
+
+        # Returns an OrderedDict of the totals worked out the way
+        # FastqKeeper.applyStats works them out, for reporting on part of
+        # a sample, e.g. one of its files
+        def getSummary(self):
+                summary = OrderedDict()
+                summary["numReads"] = self.numReads
+                summary["A"] = self.A
+                summary["C"] = self.C
+                summary["G"] = self.G
+                summary["T"] = self.T
+                summary["N"] = self.N
+
+                called = self.A + self.C + self.G + self.T
+                summary["GC"] = None
+                if called > 0:
+                        summary["GC"] = round(100.0 * (self.G + self.C) / \
+                                        called, 2)
+
+                summary["avgLen"] = None
+                summary["avgQScore"] = None
+                summary["plus"] = None
+                if self.numReads > 0:
+                        summary["avgLen"] = float(self.length) / self.numReads
+                        summary["avgQScore"] = self.getAvgQScore()
+                        summary["plus"] = round(float(self.plus) / \
+                                        self.numReads, 2) * 100
+
+                return summary
+
+
+        # Adds the average quality score of one read to the total
+        def addScore(self, qScore):
+                self.score += hundredths(qScore)
+
+
+        # Returns the average of the per-read average quality scores
+        def getAvgQScore(self):
+                return float(self.score) / (100 * self.numReads)
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # All totals start at zero
+        def __init__(self):
+                self.numReads = 0
+
+                # Nucleotide counts
+                self.A = 0
+                self.C = 0
+                self.G = 0
+                self.T = 0
+                self.N = 0
+
+                # Sum of read lengths and of per-read average quality
+                # scores, the latter in hundredths, see hundredths
+                self.length = 0
+                self.score = 0
+
+                # Number of reads on the + strand
+                self.plus = 0
+
+                # qualCounts[i] is the number of reads whose average quality
+                # score is at least i but less than i + 1
+                self.qualCounts = [0] * 256
+
+                # posQualCounts[pos * 256 + char] is the number of reads with
+                # quality score char at position pos, and posNucCounts[pos *
+                # 6 + nuc] the number with nucleotide nuc there (A, C, G, T,
+                # N, other). Both grow to the length of the longest read.
+                self.posQualCounts = []
+                self.posNucCounts = []
+
+                # Characters needed to write out the file, line breaks
+                # included
+                self.chars = 0
+
+                # First character seen that is not a nucleotide. It is
+                # reported once every read has been verified.
+                self.unknownNuc = None
+
+
+# Returns the average quality score of a read, which is rounded to two
+# decimal places, as a whole number of hundredths. Sums of these add up
+# exactly, where sums of the scores themselves depend on their order.
+def hundredths(qScore):
+        return int(round(qScore * 100))
+
+
+# Adds counts to totals element by element, first growing totals to the
+# length of counts if it is shorter
+def addCounts(totals, counts):
+        if len(totals) < len(counts):
+                totals.extend([0] * (len(counts) - len(totals)))
+
+        totals[:len(counts)] = map(add, totals[:len(counts)], counts)
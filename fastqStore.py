@@ -0,0 +1,192 @@
+#
+# fastqStore.py
+# Author: Philip Braunstein
+#
+# Date Created: May 20, 2014
+# Last Modified: May 20, 2014
+#
+# The FastqStore class is a compact, column based replacement for the
+# list of lists FastqKeeper keeps its reads in. Instead of four str objects
+# and a float per read it keeps:
+#
+#   - the IDs, nucleotides and quality scores of all reads concatenated
+#     into three byte buffers
+#   - offsets into those buffers (nucleotides and quality scores are the
+#     same length, so they share one offsets array)
+#   - a float32 array of average quality scores
+#   - a bitmap with one bit per read that is set for + strands
+#
+# A FastqStore can be used like the list it replaces: indexing it or
+# iterating over it gives reads as [ID, SEQ, STRAND-SENSE, QSCORE,
+# AVG_QSCORE] lists that are built on the fly.
+#
+# A packed FastqStore keeps the nucleotides two bits each in a PackedSeqs
+# instead, see fastqPacked. FastqKeeper makes one for columnar=PACKED.
+#
+
+import re
+from array import array
+
+from fastqPacked import PackedSeqs
+
+# Value of FastqKeeper's columnar argument for a packed FastqStore
+PACKED = "packed"
+
+class FastqStore:
+        ################### Public API ###################
+        # Adds a read of the form [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE]
+        # Strand-sense must already be verified to be + or -.
+        def append(self, seq):
+                self.ids.extend(seq[0])
+                self.idOffsets.append(len(self.ids))
+
+                self.nucs.extend(seq[1])
+                self.quals.extend(seq[3])
+                self.offsets.append(len(self.nucs))
+
+                self.means.append(seq[4])
+
+                # Grow bitmap one byte at a time
+                index = len(self.means) - 1
+                if index % 8 == 0:
+                        self.strands.append(0)
+                if seq[2] == '+':
+                        self.strands[index // 8] |= 1 << (index % 8)
+
+
+        # Appends all of the reads in another FastqStore
+        def extend(self, other):
+                idBase = self.idOffsets[-1]
+                base = self.offsets[-1]
+                count = len(self)
+
+                self.ids.extend(other.ids)
+                self.idOffsets.extend([offset + idBase \
+                        for offset in other.idOffsets[1:]])
+
+                self.nucs.extend(other.nucs)
+                self.quals.extend(other.quals)
+                self.offsets.extend([offset + base \
+                        for offset in other.offsets[1:]])
+
+                self.means.extend(other.means)
+
+                # Bitmap can be copied whole if it lines up on a byte
+                if count % 8 == 0:
+                        self.strands.extend(other.strands)
+                        return
+
+                for i in xrange(len(other)):
+                        index = count + i
+                        if index % 8 == 0:
+                                self.strands.append(0)
+                        if other.getStrand(i) == '+':
+                                self.strands[index // 8] |= 1 << (index % 8)
+
+
+        # Returns the nucleotides of read i
+        def getSeq(self, i):
+                return str(self.nucs[self.offsets[i]:self.offsets[i + 1]])
+
+
+        # Returns the average quality score of read i as it was appended
+        def getQScore(self, i):
+                # float32 holds two decimal places to well within rounding
+                return round(self.means[i], 2)
+
+
+        # Returns '+' or '-' for read i
+        def getStrand(self, i):
+                if self.strands[i // 8] & (1 << (i % 8)):
+                        return '+'
+                return '-'
+
+
+        # Yields the nucleotides of each read in order
+        def iterSeqs(self):
+                for i in xrange(len(self)):
+                        yield self.getSeq(i)
+
+
+        # Yields the average quality score of each read in order
+        def iterQScores(self):
+                for qScore in self.means:
+                        yield qScore
+
+
+        # Returns the number of reads whose nucleotides have pattern, a
+        # str of upper case A, C, G, T and N, matched as getNumMatches
+        # matches it. Packed nucleotides are searched without unpacking
+        # them.
+        def countMatches(self, pattern):
+                if self.packed:
+                        return self.nucs.countMatches(pattern, self.offsets)
+
+                regex = re.compile(pattern.replace('N', '.'))
+                count = 0
+                for nucs in self.iterSeqs():
+                        if regex.search(nucs) != None:
+                                count += 1
+
+                return count
+
+
+        # Returns the number of bytes used by the buffers and arrays
+        def memoryFootprint(self):
+                if self.packed:
+                        total = self.nucs.memoryFootprint()
+                else:
+                        total = len(self.nucs)
+                total += len(self.ids) + len(self.quals) + len(self.strands)
+
+                for column in [self.idOffsets, self.offsets, self.means]:
+                        total += column.itemsize * len(column)
+
+                return total
+
+
+        ################ Private Methods ################
+        # INITIALIZER
+        # Starts out empty, reads are added with append. With packed=True
+        # the nucleotides are kept in a PackedSeqs.
+        def __init__(self, packed=False):
+                self.packed = packed
+                self.ids = bytearray()
+                self.nucs = bytearray()
+                if packed:
+                        self.nucs = PackedSeqs()
+                self.quals = bytearray()
+                self.strands = bytearray()
+
+                # Each read i spans offsets[i] to offsets[i + 1]
+                self.idOffsets = array('L', [0])
+                self.offsets = array('L', [0])
+
+                self.means = array('f')
+
+
+        def __len__(self):
+                return len(self.means)
+
+
+        # Builds the [ID, SEQ, STRAND-SENSE, QSCORE, AVG_QSCORE] list for
+        # read i. Negative indices count from the end as with lists.
+        def __getitem__(self, i):
+                if i < 0:
+                        i += len(self)
+                if i < 0 or i >= len(self):
+                        raise IndexError("FastqStore index out of range")
+
+                start = self.offsets[i]
+                end = self.offsets[i + 1]
+
+                return [str(self.ids[self.idOffsets[i]:self.idOffsets[i + 1]]),
+                        str(self.nucs[start:end]),
+                        self.getStrand(i),
+                        str(self.quals[start:end]),
+                        self.getQScore(i)]
+
+
+        def __iter__(self):
+                for i in xrange(len(self)):
+                        yield self[i]
@@ -0,0 +1,73 @@
+#
+# test_fastqKeeper.py
+#
+# Tests of FastqKeeper. Run from the top of the repository with
+#
+#       python -m unittest discover tests
+#
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastqKeeper import FastqKeeper
+from fastqMonitor import NullMonitor
+
+
+class TestTail(unittest.TestCase):
+        def setUp(self):
+                self.tempDir = tempfile.mkdtemp()
+                self.inputFile = os.path.join(self.tempDir, "reads.fastq")
+
+
+        def tearDown(self):
+                shutil.rmtree(self.tempDir)
+
+
+        def write(self, text, mode='a'):
+                with open(self.inputFile, mode) as filew:
+                        filew.write(text)
+
+
+        def checkNoReads(self, keeper):
+                self.assertEqual(keeper.getNumReads(), 0)
+                self.assertEqual(keeper.avgLen, None)
+                self.assertEqual(keeper.avgQScore, None)
+                self.assertEqual(keeper.GC, None)
+                self.assertEqual(keeper.plus, None)
+
+
+        # A run that has just started has written nothing yet
+        def testEmptyFile(self):
+                self.write("", 'w')
+                keeper = FastqKeeper(self.inputFile, tail=True, \
+                                monitor=NullMonitor())
+                self.checkNoReads(keeper)
+
+                self.write("@read1/1\nACGG\n+\nIIII\n")
+                self.assertEqual(keeper.refresh(), 1)
+                self.assertEqual(keeper.getNumReads(), 1)
+                self.assertEqual(keeper.avgLen, 4.0)
+                self.assertEqual(keeper.GC, 75.0)
+
+
+        # Or has only written part of its first read
+        def testPartialFirstRead(self):
+                self.write("@read1/1\nACGG\n+\nII", 'w')
+                keeper = FastqKeeper(self.inputFile, tail=True, \
+                                monitor=NullMonitor())
+                self.checkNoReads(keeper)
+
+                self.write("II\n@read2/1\nAT")
+                self.assertEqual(keeper.refresh(), 1)
+                self.assertEqual(keeper.getNumReads(), 1)
+                self.assertEqual(keeper.avgQScore, 73.0)
+                self.assertEqual(keeper.plus, 100.0)
+
+
+if __name__ == "__main__":
+        unittest.main()
@@ -0,0 +1,105 @@
+#
+# test_fastqParallel.py
+#
+# Tests of reading in one FASTQ file with several worker processes, see
+# fastqParallel. Run from the top of the repository with
+#
+#       python -m unittest discover tests
+#
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastqKeeper import FastqKeeper
+from fastqMonitor import NullMonitor
+
+# Seconds to wait for a load that should fail straight away
+LOAD_TIMEOUT = 60
+
+
+# Writes numReads random reads to path. The read numbered badRead, if
+# given, has one quality score fewer than nucleotides.
+def writeFastq(path, numReads, badRead=None, seed=0):
+        rand = random.Random(seed)
+        with open(path, 'w') as filew:
+                for i in range(numReads):
+                        nucs = "".join([rand.choice("ACGT") for j in range(100)])
+                        quals = "".join([rand.choice("?@ABCDEFGHI") for j in \
+                                        range(100)])
+                        if i == badRead:
+                                quals = quals[:-1]
+
+                        filew.write("@read" + str(i) + "/1\n" + nucs + "\n+\n" + \
+                                        quals + "\n")
+
+
+class TestParallel(unittest.TestCase):
+        def setUp(self):
+                self.tempDir = tempfile.mkdtemp()
+                self.inputFile = os.path.join(self.tempDir, "reads.fastq")
+
+
+        def tearDown(self):
+                shutil.rmtree(self.tempDir)
+
+
+        # Loads inputFile with keeperArgs in a thread, and fails the test
+        # if it hasn't finished in LOAD_TIMEOUT seconds. Returns the
+        # FastqKeeper, or the exception the load raised.
+        def loadWithTimeout(self, **keeperArgs):
+                result = []
+                thread = threading.Thread(target=self.load, \
+                                args=(result, keeperArgs))
+                thread.daemon = True
+                thread.start()
+                thread.join(LOAD_TIMEOUT)
+
+                self.assertFalse(thread.is_alive(), "load did not finish")
+                return result[0]
+
+
+        def load(self, result, keeperArgs):
+                try:
+                        result.append(FastqKeeper(self.inputFile, \
+                                        monitor=NullMonitor(), **keeperArgs))
+                except Exception as e:
+                        result.append(e)
+
+
+        # A bad read in the second chunk raises its exception rather than
+        # leaving the pool hanging
+        def testBadReadInLaterChunk(self):
+                writeFastq(self.inputFile, 2000, 1001)
+
+                for i in range(5):
+                        result = self.loadWithTimeout(workers=2)
+                        self.assertIsInstance(result, Exception)
+                        self.assertEqual(str(result), "Read ID @read1001/1 has" + \
+                                        " a different number of qscores and" + \
+                                        " nucleotides")
+
+
+        # Reading in with workers gives the same statistics as one pass
+        def testSameStats(self):
+                writeFastq(self.inputFile, 5000)
+
+                single = FastqKeeper(self.inputFile, streaming=True, \
+                                monitor=NullMonitor())
+                parallel = self.loadWithTimeout(streaming=True, workers=4)
+
+                self.assertEqual(parallel.getNumReads(), single.getNumReads())
+                self.assertEqual(parallel.GC, single.GC)
+                self.assertEqual(parallel.plus, single.plus)
+                self.assertAlmostEqual(parallel.avgLen, single.avgLen)
+                self.assertAlmostEqual(parallel.avgQScore, single.avgQScore)
+
+
+if __name__ == "__main__":
+        unittest.main()